@@ -1,413 +1,290 @@
-import json
-import os
-from functools import wraps
-from time import sleep
 from typing import Any, Callable
 
-import requests
-from dotenv import find_dotenv, load_dotenv
-
+import async_api
+import config
 import data_models as dm
-from generate_data import (
-    generate_create_prediction_payload,
-    generate_start_inventory_classification_payload,
-    generate_start_trainer_payload,
-    generate_upload_data_payload,
-    load_data_from_json,
-)
-from token_manager import TokenManager
-
-load_dotenv(find_dotenv())
-
-# Environment variables
-VISMA_CONNECT_CLIENT_ID = os.getenv("VISMA_CONNECT_CLIENT_ID")
-VISMA_CONNECT_CLIENT_SECRET = os.getenv("VISMA_CONNECT_CLIENT_SECRET")
-VISMA_CONNECT_GRANT_TYPE = os.getenv("VISMA_CONNECT_GRANT_TYPE")
-VISMA_CONNECT_SCOPE = os.getenv("VISMA_CONNECT_SCOPE")
-VISMA_CONNECT_URL = os.getenv("VISMA_CONNECT_URL")
-IO_BASE_URL = os.getenv("IO_BASE_URL")
-TENANT_ID = os.getenv("TENANT_ID")
-
-# Constants
-MAX_RETRIES = 5
-SLEEP_DURATION_SHORT = 3
-SLEEP_DURATION_LONG = 6
-
-
-TM = TokenManager()
-
-
-def handle_token_expiry(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except dm.OutdatedAccessTokenException:
-            print("Access token expired. Refreshing...")
-            update_access_token()
-            print("Retrying request...")
-            return func(*args, **kwargs)
-        except Exception as e:
-            raise e
-
-    return wrapper
+import pipeline
+from job_journal import JobJournal
+from lazy_results import LazyResultsResponse
+from orchestrator import FlowRunSummary, Orchestrator, TenantFlow
+from parameter_table import ParameterTable
+from pipeline import PipelineBatch, PipelineSummary
+from polling import PollingStrategy
+from rate_limit import TenantRateLimiter
+from synthetic_data import SyntheticDataConfig
+from upload_manifest import UploadManifest
+from watermark_store import WatermarkStore
+from async_api import UploadSource, run_sync
+
+# Every function below is a blocking wrapper around its counterpart in async_api, run on
+# a shared background event loop. Use async_api directly to run many jobs concurrently.
 
 
 ### UPLOAD DATA ########################################################################
-def upload_data_from_json(tenant_id: str, path: str):
-    return upload_data(tenant_id, load_data_from_json, path)
+def upload_data_from_json(
+    tenant_id: str, path: str, manifest: UploadManifest | None = None
+) -> list[str]:
+    return run_sync(async_api.upload_data_from_json(tenant_id, path, manifest))
+
+
+def upload_dummy_data(tenant_id: str, nbr_datasets: int = 1) -> list[str]:
+    return run_sync(async_api.upload_dummy_data(tenant_id, nbr_datasets))
 
 
-def upload_dummy_data(tenant_id: str, nbr_datasets: int = 1):
-    return upload_data(tenant_id, generate_upload_data_payload, nbr_datasets)
+def upload_synthetic_data(
+    tenant_id: str, synthetic_config: SyntheticDataConfig
+) -> list[str]:
+    return run_sync(async_api.upload_synthetic_data(tenant_id, synthetic_config))
 
 
-@handle_token_expiry
 def upload_data(
     tenant_id: str,
-    payload_function: Callable[[Any], dm.UploadDataPayload],
+    payload_function: Callable[[Any], UploadSource],
     arg,
+    manifest: UploadManifest | None = None,
 ) -> list[str]:
-    # Start by getting the presigned url to upload data to and the job ID
-    presigned_url_response: dm.PresignedUrlResponseSuccess = get_presigned_url(
-        tenant_id
-    )
+    return run_sync(async_api.upload_data(tenant_id, payload_function, arg, manifest))
 
-    # Prepare headers and payload for the request to the presigned url
-    headers: dict = TM.generate_headers(include_token=False, tenant_id=tenant_id)
-    payload: dm.UploadDataPayload = payload_function(arg)
 
-    # Make the request to the presigned url
-    print("Uploading data...")
-    res = requests.put(
-        presigned_url_response.url,
-        headers=headers,
-        data=json.dumps(payload.model_dump()),  # NB! Need to stringify
+def upload_data_in_batches(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    max_batch_bytes: int = config.UPLOAD_BATCH_MAX_BYTES,
+    max_concurrency: int = config.UPLOAD_MAX_CONCURRENCY,
+    max_retries: int = config.MAX_RETRIES,
+) -> list[str]:
+    return run_sync(
+        async_api.upload_data_in_batches(
+            tenant_id,
+            payload_function,
+            arg,
+            max_batch_bytes,
+            max_concurrency,
+            max_retries,
+        )
     )
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
 
-    # Poll the status endpoint until the job is complete
-    poll_job_status(tenant_id, presigned_url_response.jobId)
-
-    # Return the dataset IDs that were uploaded
-    return [dataset.datasetId for dataset in payload.datasets]
+def get_presigned_url(tenant_id: str) -> dm.PresignedUrlResponseSuccess:
+    return run_sync(async_api.get_presigned_url(tenant_id))
 
 
-@handle_token_expiry
-def get_presigned_url(tenant_id: str) -> dm.PresignedUrlResponseSuccess:
-    # Prepare headers for the request to the /presigned_url endpoint
-    url = f"{IO_BASE_URL}/presigned_url"
-    headers: dict = TM.generate_headers(tenant_id=tenant_id)
+### INCREMENTAL SYNC ###################################################################
+def upload_data_incremental_from_json(
+    tenant_id: str, path: str, watermarks: WatermarkStore | None = None
+) -> list[str]:
+    return run_sync(
+        async_api.upload_data_incremental_from_json(tenant_id, path, watermarks)
+    )
 
-    # Make the request to the /presigned_url endpoint
-    print("Getting presigned url...")
-    res = requests.get(url, headers=headers)
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+def upload_data_incremental(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    watermarks: WatermarkStore | None = None,
+) -> list[str]:
+    return run_sync(
+        async_api.upload_data_incremental(tenant_id, payload_function, arg, watermarks)
+    )
 
-    # If the request was successful, return the success response
-    if res.status_code == 200:
-        return dm.PresignedUrlResponseSuccess(**res.json())
 
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "presigned_url")
+def resync_window(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    from_date: str,
+    to_date: str,
+    dataset_ids: list[str] | None = None,
+    watermarks: WatermarkStore | None = None,
+) -> dm.BulkDeleteReport:
+    return run_sync(
+        async_api.resync_window(
+            tenant_id,
+            payload_function,
+            arg,
+            from_date,
+            to_date,
+            dataset_ids,
+            watermarks,
+        )
+    )
 
 
 ### TRAINING ###########################################################################
-@handle_token_expiry
 def start_trainer(
-    tenant_id: str, dataset_ids: list[str] = ["dummy-dataset-1"]
+    tenant_id: str,
+    dataset_ids: list[str] = ["dummy-dataset-1"],
+    wait: bool = True,
+    parameters: ParameterTable | None = None,
 ) -> dm.StartTrainerResponseSuccess:
-    # Get the headers and payload for the request to the /start_trainer endpoint
-    headers = TM.generate_headers(include_content_type=True, tenant_id=tenant_id)
-    payload: dm.StartTrainerPayload = generate_start_trainer_payload(dataset_ids)
-
-    # Make the request to the /start_trainer endpoint
-    print("Starting trainer...")
-    res = requests.post(
-        url=f"{IO_BASE_URL}/start_trainer",
-        headers=headers,
-        data=json.dumps(payload.model_dump()),  # NB! Need to stringify
-    )
+    return run_sync(async_api.start_trainer(tenant_id, dataset_ids, wait, parameters))
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
 
-    # If the request was successful, poll the status endpoint until the job is complete
-    if res.status_code == 202:
-        start_trainer_response = dm.StartTrainerResponseSuccess(**res.json())
-        poll_job_status(tenant_id, start_trainer_response.jobId)
-        return start_trainer_response
-
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "start_trainer")
+def start_trainer_coalesced(
+    tenant_id: str, dataset_id: str
+) -> dm.StatusResponseSuccess:
+    return run_sync(async_api.start_trainer_coalesced(tenant_id, dataset_id))
 
 
 ### PREDICTION #########################################################################
-@handle_token_expiry
 def create_prediction(
-    tenant_id: str, dataset_ids=["dummy-dataset-1"]
+    tenant_id: str,
+    dataset_ids=["dummy-dataset-1"],
+    wait: bool = True,
+    parameters: ParameterTable | None = None,
 ) -> dm.CreatePredictionResponseSuccess:
-    # Get the headers and payload for the request to the /create_prediction endpoint
-    headers = TM.generate_headers(include_content_type=True, tenant_id=tenant_id)
-    payload: dm.CreatePredictionPayload = generate_create_prediction_payload(
-        dataset_ids
+    return run_sync(
+        async_api.create_prediction(tenant_id, dataset_ids, wait, parameters)
     )
 
-    # Make the request to the /create_prediction endpoint
-    print("Creating prediction...")
-    res = requests.post(
-        url=f"{IO_BASE_URL}/create_prediction",
-        headers=headers,
-        data=json.dumps(payload.model_dump()),  # NB! Need to stringify
-    )
-
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
 
-    # If the request was successful, poll the status endpoint until the job is complete
-    if res.status_code == 202:
-        create_prediction_response = dm.CreatePredictionResponseSuccess(**res.json())
-        poll_job_status(tenant_id, create_prediction_response.jobId)
-        print(create_prediction_response.jobId)
-        return create_prediction_response
+def create_prediction_coalesced(tenant_id: str, dataset_id: str) -> dm.ResultsObject:
+    # Calls from many threads are coalesced on the shared background loop
+    return run_sync(async_api.create_prediction_coalesced(tenant_id, dataset_id))
 
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "create_prediction")
 
+def get_results(
+    tenant_id: str, job_id: str, use_cache: bool = True
+) -> dm.ResultsResponseSuccess:
+    return run_sync(async_api.get_results(tenant_id, job_id, use_cache))
 
-@handle_token_expiry
-def get_results(tenant_id: str, job_id: str) -> dm.ResultsResponseSuccess:
-    # Get the headers for the request to the /results endpoint
-    headers = TM.generate_headers(tenant_id=tenant_id, job_id=job_id)
 
-    # Make the request to the /results endpoint
-    print("Getting results...")
-    res = requests.get(
-        url=f"{IO_BASE_URL}/results",
-        headers=headers,
+def get_results_lazy(
+    tenant_id: str, job_id: str, include_series: bool = True, use_cache: bool = True
+) -> LazyResultsResponse:
+    return run_sync(
+        async_api.get_results_lazy(tenant_id, job_id, include_series, use_cache)
     )
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
-
-    # If the request was successful, return the success response
-    if res.status_code == 200:
-        results_response = dm.ResultsResponseSuccess(**res.json())
-        msg = (
-            results_response.message
-            if results_response.message != ""
-            else "Job completed successfully!"
-        )
-        print(f"Results retrieved! Message: {msg}\n")
-        return results_response
 
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "results")
+def export_results(
+    tenant_id: str, job_id: str, path: str, file_format: str = "parquet"
+) -> list[str]:
+    return run_sync(async_api.export_results(tenant_id, job_id, path, file_format))
 
 
 ### INVENTORY CLASSIFICATION ###########################################################
-@handle_token_expiry
 def start_inventory_classification(
     tenant_id: str,
     dataset_ids: list[str],
+    wait: bool = True,
 ) -> dm.StartInventoryClassificationResponseSuccess:
-    # Get the headers and payload for the request to /start_inventory_classification
-    headers = TM.generate_headers(include_content_type=True, tenant_id=tenant_id)
-    payload = generate_start_inventory_classification_payload(dataset_ids)
-
-    # Make the request to the /start_inventory_classification endpoint
-    print("Starting inventory classification...")
-    res = requests.post(
-        url=f"{IO_BASE_URL}/start_inventory_classification",
-        headers=headers,
-        data=json.dumps(payload.model_dump()),  # NB! Need to stringify
+    return run_sync(
+        async_api.start_inventory_classification(tenant_id, dataset_ids, wait)
     )
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
-
-    # If the request was successful, poll the status endpoint until the job is complete
-    if res.status_code == 202:
-        res = dm.StartInventoryClassificationResponseSuccess(**res.json())
-        poll_job_status(tenant_id, res.jobId)
-        return res
-
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "start_inventory_classification")
-
 
-@handle_token_expiry
 def get_inventory_classification_results(
     tenant_id: str,
     job_id: str,
+    use_cache: bool = True,
 ) -> dm.InventoryClassificationResultsResponse:
-    # Get the headers for the request to the /inventory_classification_results endpoint
-    headers = TM.generate_headers(tenant_id=tenant_id, job_id=job_id)
-
-    # Make the request to the /inventory_classification_results endpoint
-    print("Getting inventory classification results...")
-    res = requests.get(
-        url=f"{IO_BASE_URL}/inventory_classification_results",
-        headers=headers,
+    return run_sync(
+        async_api.get_inventory_classification_results(tenant_id, job_id, use_cache)
     )
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
-
-    # If the request was successful, return the success response
-    if res.status_code == 200:
-        results_response = dm.InventoryClassificationResultsResponse(**res.json())
-        msg = (
-            results_response.message
-            if results_response.message != ""
-            else "NOT IMPLEMENTED"
-        )
-        print(f"Results retrieved! Message: {msg}\n")
-        return results_response
-
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "inventory_classification_results")
-
 
 ### DELETE DATA ########################################################################
-@handle_token_expiry
 def delete_data(
     tenant_id: str,
     dataset_id: str,
     from_date: str = "",
     to_date: str = "",
-):
-    # Get the headers for the request to the /data endpoint
-    headers = TM.generate_headers(include_content_type=True, tenant_id=tenant_id)
-
-    # Set the URL and query parameters for the request to the /data endpoint
-    url = (
-        f"{IO_BASE_URL}/data/{dataset_id}"
-        f"{'?fromDate=' + from_date if from_date else ''}"
-        f"{'&toDate=' + to_date if to_date else ''}"
-    )
+) -> dm.DeleteDataResponseSuccess:
+    return run_sync(async_api.delete_data(tenant_id, dataset_id, from_date, to_date))
 
-    # Make the request to the /data endpoint
-    print("Deleting data...")
-    res = requests.delete(
-        url=url,
-        headers=headers,
-    )
 
-    # If response status code is 403, raise exception to trigger access token update
-    if res.status_code == 403:
-        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+def delete_data_bulk(
+    tenant_id: str,
+    requests: list[str | dm.DeleteDataRequest],
+    max_concurrency: int = config.DELETE_MAX_CONCURRENCY,
+    requests_per_second: float = config.DELETE_REQUESTS_PER_SECOND,
+    max_retries: int = config.MAX_RETRIES,
+) -> dm.BulkDeleteReport:
+    return run_sync(
+        async_api.delete_data_bulk(
+            tenant_id, requests, max_concurrency, requests_per_second, max_retries
+        )
+    )
 
-    # If the request was successful, return the success response
-    if res.status_code == 200:
-        data_response = dm.DeleteDataResponseSuccess(**res.json())
-        print(f"Data deleted! Message: {data_response.message}\n")
-        return data_response
 
-    # If not, handle the failure by printing the error message and raising an exception
-    _handle_failed_request(res, "data")
+def wait_for_cleanup():
+    run_sync(async_api.CLEANUP_QUEUE.join())
 
 
 ### STATUS #############################################################################
-def poll_job_status(tenant_id: str, job_id: str):
-    print("Polling job status...")
-    url = f"{IO_BASE_URL}/status"
-    headers: dict = TM.generate_headers(tenant_id=tenant_id, job_id=job_id)
-    status_response: dm.StatusResponseSuccess = _start_status_poll(url, headers)
-    status_response: dm.StatusResponseSuccess = _call_status_endpoint(url, headers)
-    while status_response.status == "inProgress":
-        print(f"\tResponse status: {status_response.status}")
-        sleep(SLEEP_DURATION_LONG)
-        status_response: dm.StatusResponseSuccess = _call_status_endpoint(url, headers)
-    print(f"Job complete! Message: {status_response.message}\n")
-
-
-def _start_status_poll(url: str, headers: dict) -> dm.StatusResponseSuccess:
-    res = requests.get(url, headers=headers)
-    tries = 0
-    while res.status_code == 404 and tries < MAX_RETRIES:
-        tries += 1
-        sleep(SLEEP_DURATION_SHORT)
-        res = requests.get(url, headers=headers)
-    if res.status_code == 200:
-        return dm.StatusResponseSuccess(**res.json())
-    _handle_failed_request(res, "status")
-
-
-def _call_status_endpoint(url: str, headers: dict) -> dm.StatusResponseSuccess:
-    res = requests.get(url, headers=headers)
-    if res.status_code == 200:
-        return dm.StatusResponseSuccess(**res.json())
-    _handle_failed_request(res, "status")
-
-
-### ACCESS #############################################################################
-def update_access_token():
-    res = requests.post(
-        url=VISMA_CONNECT_URL,
-        data={
-            "client_id": VISMA_CONNECT_CLIENT_ID,
-            "client_secret": VISMA_CONNECT_CLIENT_SECRET,
-            "grant_type": VISMA_CONNECT_GRANT_TYPE,
-            "scope": VISMA_CONNECT_SCOPE,
-        },
-    ).json()
-    access_token = res["access_token"]
-    TM.update_token(access_token)
-    _update_env_file(access_token)
-
-
-def _update_env_file(access_token: str):
-    with open(".env", "r") as f:
-        lines = f.readlines()
-    for i, line in enumerate(lines):
-        if line.startswith("ACCESS_TOKEN"):
-            lines[i] = f"ACCESS_TOKEN={access_token}"
-            break
-    else:
-        lines.append(f"\nACCESS_TOKEN={access_token}")
-    with open(".env", "w") as f:
-        f.writelines(lines)
-
-
-### HELPERS ############################################################################
-def _handle_failed_request(res: requests.Response, endpoint_name: str):
-    failure_resposnse = dm.FailureResponse(**res.json())
-    print(
-        f"Call to {endpoint_name} failed."
-        f"\nError: {failure_resposnse.error}"
-        f"\nMessage: {failure_resposnse.message}"
+def poll_job_status(
+    tenant_id: str,
+    job_id: str,
+    job_type: str = "job",
+    strategy: PollingStrategy | None = None,
+) -> dm.StatusResponseSuccess:
+    return run_sync(async_api.poll_job_status(tenant_id, job_id, job_type, strategy))
+
+
+def poll_job_statuses(
+    jobs: list[tuple[str, str]], job_type: str = "job"
+) -> list[dm.StatusResponseSuccess]:
+    return run_sync(async_api.poll_job_statuses(jobs, job_type))
+
+
+### JOURNALED FLOW #####################################################################
+def run_journaled_flow(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    flow_id: str,
+    journal: JobJournal | None = None,
+) -> dm.ResultsResponseSuccess:
+    return run_sync(
+        async_api.run_journaled_flow(tenant_id, payload_function, arg, flow_id, journal)
+    )
+
+
+### PIPELINE ###########################################################################
+def run_pipeline(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    batch_size: int = config.PIPELINE_BATCH_SIZE,
+    queue_size: int = config.PIPELINE_QUEUE_SIZE,
+    on_results: Callable[[PipelineBatch, dm.ResultsResponseSuccess], Any] | None = None,
+) -> PipelineSummary:
+    # on_results runs on the background event loop thread
+    return run_sync(
+        pipeline.run_pipeline(
+            tenant_id, payload_function, arg, batch_size, queue_size, on_results
+        )
     )
-    raise Exception(f"Call to {endpoint_name} failed. See Error and Message above.")
+
+
+### ORCHESTRATION ######################################################################
+def run_tenant_flows(
+    flows: list[TenantFlow],
+    max_workers: int = config.ORCHESTRATOR_MAX_WORKERS,
+    stage_limits: dict[str, int] | None = None,
+    tenant_requests_per_second: float | None = None,
+) -> FlowRunSummary:
+    rate_limiter = None
+    if tenant_requests_per_second is not None:
+        rate_limiter = TenantRateLimiter(
+            tenant_requests_per_second, config.TENANT_REQUESTS_BURST
+        )
+    orchestrator = Orchestrator(max_workers, stage_limits, rate_limiter)
+    return run_sync(orchestrator.run(flows))
 
 
 def basic_flow():
-    upload_dummy_data(TENANT_ID)
-    start_trainer(TENANT_ID)
-    res: dm.CreatePredictionResponseSuccess = create_prediction(TENANT_ID)
-    get_results(TENANT_ID, job_id=res.jobId)
-    delete_data(TENANT_ID, dataset_id="dummy-dataset-1")
+    run_sync(async_api.basic_flow(config.TENANT_ID))
 
 
 def inventory_classification_flow():
-    dataset_ids = upload_dummy_data(TENANT_ID, nbr_datasets=10)
-    res = start_inventory_classification(TENANT_ID, dataset_ids)
-    get_inventory_classification_results(TENANT_ID, res.jobId)
-    for dataset_id in dataset_ids:
-        delete_data(TENANT_ID, dataset_id=dataset_id)
+    run_sync(async_api.inventory_classification_flow(config.TENANT_ID))
 
 
 if __name__ == "__main__":
     basic_flow()
     inventory_classification_flow()
+    wait_for_cleanup()
@@ -0,0 +1,1498 @@
+import asyncio
+import concurrent.futures
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    TypeVar,
+)
+
+import httpx
+
+import config
+import data_models as dm
+from cleanup_queue import CleanupQueue
+from coalescer import RequestCoalescer
+from columnar import ColumnarDataset
+from generate_data import (
+    generate_create_prediction_payload,
+    generate_start_inventory_classification_payload,
+    generate_start_trainer_payload,
+    generate_upload_data_payload,
+    iter_columnar_datasets_from_json,
+    iter_datasets_from_json,
+)
+from http_client import AsyncHttpClient, HttpClient
+from instrumentation import Instrumentation, endpoint_name
+from job_journal import JobJournal, JournalEntry
+from lazy_results import LazyResultsResponse
+from parameter_table import ParameterTable
+from polling import (
+    LearnedDurationPolling,
+    PollingStrategy,
+    PollStats,
+    retry_after,
+)
+from rate_limit import RateLimiter, TenantRateLimiter
+from results_cache import CacheKey, ResultsCache
+from results_export import write_results
+from serialization import (
+    BodyWriter,
+    compress,
+    content_encoding_headers,
+    dump_dataset,
+    encode_body,
+)
+from status_scheduler import StatusScheduler
+from synthetic_data import SyntheticDataConfig, iter_synthetic_datasets
+from token_cache import FileTokenCache, MemoryTokenCache
+from token_manager import TokenManager
+from upload_manifest import UploadManifest, content_hash
+from watermark_store import WatermarkStore
+
+T = TypeVar("T")
+_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+UploadSource = dm.UploadDataPayload | Iterable[dm.Dataset | ColumnarDataset]
+
+
+INSTRUMENTATION = Instrumentation()  # Add hooks, e.g. a PrometheusExporter, to enable
+CLIENT = HttpClient(
+    pool_connections=config.HTTP_POOL_CONNECTIONS,
+    pool_maxsize=config.HTTP_POOL_MAXSIZE,
+    timeout=(config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT),
+)
+
+
+def _fetch_access_token() -> dict:
+    start = time.perf_counter()
+    try:
+        token_response = _request_access_token()
+    except Exception as e:
+        INSTRUMENTATION.record_token_refresh(time.perf_counter() - start, e)
+        raise
+    INSTRUMENTATION.record_token_refresh(time.perf_counter() - start)
+    return token_response
+
+
+def _request_access_token() -> dict:
+    res = CLIENT.post(
+        url=config.VISMA_CONNECT_URL,
+        data={
+            "client_id": config.VISMA_CONNECT_CLIENT_ID,
+            "client_secret": config.VISMA_CONNECT_CLIENT_SECRET,
+            "grant_type": config.VISMA_CONNECT_GRANT_TYPE,
+            "scope": config.VISMA_CONNECT_SCOPE,
+        },
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+TM = TokenManager(
+    fetch_token=_fetch_access_token,
+    refresh_margin=config.TOKEN_REFRESH_MARGIN,
+    cache=(
+        FileTokenCache(config.TOKEN_CACHE_PATH)
+        if config.TOKEN_CACHE_PATH
+        else MemoryTokenCache()
+    ),
+)
+ASYNC_CLIENT = AsyncHttpClient(
+    max_connections=config.HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    timeout=(config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT),
+    instrumentation=INSTRUMENTATION,
+)
+POLLING_STRATEGY: PollingStrategy = LearnedDurationPolling(
+    initial_delay=config.POLL_INITIAL_DELAY,
+    factor=config.POLL_BACKOFF_FACTOR,
+    max_delay=config.POLL_MAX_DELAY,
+    jitter=config.POLL_JITTER,
+    deadline=config.POLL_DEADLINE,
+)
+POLL_STATS = PollStats()
+STATUS_SCHEDULER = StatusScheduler(
+    lambda tenant_id, job_id: _authorized_request(
+        "GET", f"{config.IO_BASE_URL}/status", tenant_id=tenant_id, job_id=job_id
+    ),
+    POLLING_STRATEGY,
+    POLL_STATS,
+    max_concurrent_requests=config.STATUS_MAX_CONCURRENT_REQUESTS,
+    requests_per_second=config.STATUS_REQUESTS_PER_SECOND,
+    instrumentation=INSTRUMENTATION,
+)
+UPLOAD_MANIFEST = (
+    UploadManifest(
+        config.UPLOAD_MANIFEST_PATH,
+        max_entries=config.UPLOAD_MANIFEST_MAX_ENTRIES,
+        max_age=config.UPLOAD_MANIFEST_MAX_AGE,
+    )
+    if config.UPLOAD_MANIFEST_PATH
+    else None
+)
+WATERMARKS = WatermarkStore(config.WATERMARKS_PATH)
+JOB_JOURNAL = JobJournal(config.JOB_JOURNAL_PATH, config.JOB_JOURNAL_FSYNC_INTERVAL)
+RESULTS_CACHE = ResultsCache(
+    max_bytes=config.RESULTS_CACHE_MAX_BYTES, path=config.RESULTS_CACHE_PATH
+)
+TENANT_RATE_LIMITER = TenantRateLimiter(
+    config.TENANT_REQUESTS_PER_SECOND, config.TENANT_REQUESTS_BURST
+)
+# Takes the place of TENANT_RATE_LIMITER for requests made in the current context, e.g.
+# by the stages of an Orchestrator with a rate limiter of its own
+REQUEST_RATE_LIMITER: ContextVar[TenantRateLimiter | None] = ContextVar(
+    "REQUEST_RATE_LIMITER", default=None
+)
+CLEANUP_QUEUE = CleanupQueue(
+    lambda tenant_id, requests: delete_data_bulk(tenant_id, requests)
+)
+TRAINER_COALESCER: RequestCoalescer[dm.StatusResponseSuccess] = RequestCoalescer(
+    lambda tenant_id, dataset_ids: _start_trainer_batch(tenant_id, dataset_ids),
+    window=config.COALESCE_WINDOW,
+    max_batch_size=config.COALESCE_MAX_BATCH_SIZE,
+)
+PREDICTION_COALESCER: RequestCoalescer[dm.ResultsObject] = RequestCoalescer(
+    lambda tenant_id, dataset_ids: _create_prediction_batch(tenant_id, dataset_ids),
+    window=config.COALESCE_WINDOW,
+    max_batch_size=config.COALESCE_MAX_BATCH_SIZE,
+)
+
+
+### EVENT LOOP #########################################################################
+_LOOP: asyncio.AbstractEventLoop | None = None
+_LOOP_LOCK = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # All sync callers share one background loop so the connection pool outlives each call
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(
+                target=_LOOP.run_forever, name="async-api-loop", daemon=True
+            ).start()
+    return _LOOP
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+### UPLOAD DATA ########################################################################
+async def upload_data_from_json(
+    tenant_id: str, path: str, manifest: UploadManifest | None = None
+) -> list[str]:
+    return await upload_data(tenant_id, iter_datasets_from_json, path, manifest)
+
+
+async def upload_dummy_data(tenant_id: str, nbr_datasets: int = 1) -> list[str]:
+    return await upload_data(tenant_id, generate_upload_data_payload, nbr_datasets)
+
+
+async def upload_synthetic_data(
+    tenant_id: str, synthetic_config: SyntheticDataConfig
+) -> list[str]:
+    # Streams generated datasets through the batch uploader, so any number of datasets
+    # can be uploaded without holding them all in memory
+    return await upload_data_in_batches(
+        tenant_id, iter_synthetic_datasets, synthetic_config
+    )
+
+
+async def upload_data(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    manifest: UploadManifest | None = None,
+    on_submitted: Callable[[str, list[str]], Any] | None = None,
+    on_completed: Callable[[dm.StatusResponseSuccess], Any] | None = None,
+) -> list[str]:
+    # With a manifest (UPLOAD_MANIFEST by default), datasets whose content is unchanged
+    # since their last successful upload are skipped. All dataset IDs are returned but
+    # those the upload job reported as failed; a failed job raises.
+    # on_submitted is called with the upload job ID and dataset IDs once data is sent,
+    # and on_completed with the job's final status; neither is called if nothing is.
+    if manifest is None:
+        manifest = UPLOAD_MANIFEST
+
+    # Prepare the payload first, off the loop, so the presigned url is fresh when used
+    body, body_size, dataset_ids, changed, date_spans = await asyncio.to_thread(
+        _spool_upload_body, payload_function, arg, tenant_id, manifest
+    )
+    if manifest is not None and len(changed) < len(dataset_ids):
+        print(f"Skipping {len(dataset_ids) - len(changed)} unchanged datasets")
+        if not changed:
+            body.close()
+            return dataset_ids
+
+    status_response = await _upload_body(
+        tenant_id,
+        body,
+        body_size,
+        on_submitted and (lambda job_id: on_submitted(job_id, dataset_ids)),
+    )
+    if manifest is not None:
+        manifest.record(
+            tenant_id, _without_failed_datasets(status_response, changed), date_spans
+        )
+    if on_completed is not None:
+        on_completed(status_response)
+
+    # Return the dataset IDs that were uploaded, or are unchanged on the server
+    uploaded = list(
+        _without_failed_datasets(status_response, dict.fromkeys(dataset_ids))
+    )
+    if len(uploaded) < len(dataset_ids):
+        print(f"{len(dataset_ids) - len(uploaded)} datasets failed to upload")
+    return uploaded
+
+
+async def _upload_body(
+    tenant_id: str,
+    body: IO[bytes],
+    body_size: int,
+    on_submitted: Callable[[str], Any] | None = None,
+) -> dm.StatusResponseSuccess:
+    # Get the presigned url to upload data to and the job ID
+    try:
+        presigned_url_response: dm.PresignedUrlResponseSuccess = (
+            await get_presigned_url(tenant_id)
+        )
+    except BaseException:
+        body.close()
+        raise
+    headers: dict = TM.generate_headers(include_token=False, tenant_id=tenant_id)
+
+    # Make the request to the presigned url
+    print("Uploading data...")
+    try:
+        res = await ASYNC_CLIENT.put(
+            presigned_url_response.url,
+            headers={
+                **headers,
+                **content_encoding_headers(config.REQUEST_COMPRESSION),
+                "Content-Length": str(body_size),
+            },
+            content=_iter_upload_body(body),  # Streamed from the spooled body
+        )
+    finally:
+        body.close()
+
+    # The presigned url carries its own credentials, so there is no token to refresh
+    if res.status_code >= 400:
+        raise Exception(f"Upload to presigned url failed with status {res.status_code}")
+    if on_submitted is not None:
+        on_submitted(presigned_url_response.jobId)
+
+    # Poll the status endpoint until the job is complete
+    job_id = presigned_url_response.jobId
+    status_response = await poll_job_status(tenant_id, job_id, "upload")
+    if status_response.status == "failed":
+        raise Exception(f"Upload job {job_id} failed: {status_response.message}")
+    return status_response
+
+
+def _spool_upload_body(
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    tenant_id: str = "",
+    manifest: UploadManifest | None = None,
+) -> tuple[IO[bytes], int, list[str], dict[str, str], dict[str, tuple[str, str]]]:
+    # Serialise datasets one by one as they are produced, spilling to disk when large
+    payload = payload_function(arg)
+    if isinstance(payload, dm.UploadDataPayload):
+        payload = payload.datasets
+
+    body = tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_SPOOL_MAX_SIZE)
+    writer = BodyWriter(body, config.REQUEST_COMPRESSION)
+    dataset_ids = []
+    changed: dict[str, str] = {}  # Content hashes of the datasets written to the body
+    date_spans: dict[str, tuple[str, str]] = {}  # And the departure dates they span
+    nbr_written = 0
+    writer.write(b'{"datasets":[')
+    for dataset in payload:
+        dataset_ids.append(dataset.datasetId)
+        serialised = dump_dataset(dataset)
+        if manifest is not None:
+            dataset_hash = content_hash(serialised)
+            if manifest.is_unchanged(tenant_id, dataset.datasetId, dataset_hash):
+                continue
+            changed[dataset.datasetId] = dataset_hash
+            date_span = _date_span(dataset)
+            if date_span is not None:
+                date_spans[dataset.datasetId] = date_span
+        if nbr_written:
+            writer.write(b",")
+        writer.write(serialised)
+        nbr_written += 1
+    writer.write(b"]}")
+    writer.finish()
+
+    body_size = body.tell()
+    body.seek(0)
+    return body, body_size, dataset_ids, changed, date_spans
+
+
+def _date_span(dataset) -> tuple[str, str] | None:
+    # First and last departure date of a dm.Dataset or columnar.ColumnarDataset
+    if isinstance(dataset, ColumnarDataset):
+        first_date = dataset.transactions.first_departure_date()
+        last_date = dataset.transactions.last_departure_date()
+        return None if first_date is None else (first_date, last_date)
+    if not dataset.transactions:
+        return None
+    departure_dates = [
+        transaction.departureDate for transaction in dataset.transactions
+    ]
+    return min(departure_dates), max(departure_dates)
+
+
+def _without_failed_datasets(
+    status_response: dm.StatusResponseSuccess, by_dataset_id: dict[str, T]
+) -> dict[str, T]:
+    # Only datasets the upload job did not report as failed count as uploaded
+    if status_response.status == "failed":
+        return {}
+    failed = {
+        dataset_status.datasetId
+        for dataset_status in status_response.datasetsStatus
+        if dataset_status.status == "failed"
+    }
+    return {
+        dataset_id: value
+        for dataset_id, value in by_dataset_id.items()
+        if dataset_id not in failed
+    }
+
+
+async def _iter_upload_body(
+    body: IO[bytes], chunk_size: int = 1 << 20
+) -> AsyncIterator[bytes]:
+    while chunk := await asyncio.to_thread(body.read, chunk_size):
+        yield chunk
+
+
+async def upload_data_in_batches(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    max_batch_bytes: int = config.UPLOAD_BATCH_MAX_BYTES,
+    max_concurrency: int = config.UPLOAD_MAX_CONCURRENCY,
+    max_retries: int = config.MAX_RETRIES,
+) -> list[str]:
+    # Batches are serialised and compressed in a thread while earlier ones upload; the
+    # bounded queue keeps at most max_concurrency batches waiting for an upload slot.
+    # Datasets the upload jobs report as failed are left out of the returned IDs.
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_concurrency)
+    uploaded: dict[int, list[str]] = {}
+    failed: dict[int, list[str]] = {}
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        # Gives up once the upload is stopped, as nothing takes from the queue any more
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                pass
+        future.cancel()
+        return False
+
+    def produce():
+        try:
+            batches = _iter_upload_batches(payload_function(arg), max_batch_bytes)
+            for batch_nbr, (body, dataset_ids) in enumerate(batches):
+                body = compress(body, config.REQUEST_COMPRESSION)
+                if not put((batch_nbr, body, dataset_ids)):
+                    return
+        finally:
+            for _ in range(max_concurrency):
+                if not put(None):
+                    break
+
+    async def work():
+        while (batch := await queue.get()) is not None:
+            batch_nbr, body, dataset_ids = batch
+            status_response = await _upload_batch_with_retry(
+                tenant_id, body, batch_nbr, max_retries
+            )
+            if status_response is None:
+                uploaded[batch_nbr], failed[batch_nbr] = [], dataset_ids
+                continue
+            succeeded = _without_failed_datasets(
+                status_response, dict.fromkeys(dataset_ids)
+            )
+            uploaded[batch_nbr] = list(succeeded)
+            if len(succeeded) < len(dataset_ids):
+                failed[batch_nbr] = [i for i in dataset_ids if i not in succeeded]
+
+    print("Uploading data in batches...")
+    producer = asyncio.ensure_future(asyncio.to_thread(produce))
+    workers = [asyncio.ensure_future(work()) for _ in range(max_concurrency)]
+    try:
+        await asyncio.gather(producer, *workers)
+    except BaseException:
+        # Reading the datasets failed, or the upload was cancelled. The producer thread
+        # can't be cancelled, so it is told to stop and waited for.
+        stopped.set()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(producer, *workers, return_exceptions=True)
+        raise
+
+    uploaded_dataset_ids = [
+        dataset_id for nbr in sorted(uploaded) for dataset_id in uploaded[nbr]
+    ]
+    if failed:
+        nbr_failed = sum(len(dataset_ids) for dataset_ids in failed.values())
+        raise dm.BatchUploadFailedException(
+            f"{nbr_failed} datasets in {len(failed)} of {len(uploaded)} batches failed "
+            "to upload!",
+            uploaded_dataset_ids=uploaded_dataset_ids,
+            failed_dataset_ids=[
+                dataset_id for nbr in sorted(failed) for dataset_id in failed[nbr]
+            ],
+        )
+    print(f"Uploaded {len(uploaded)} batches!\n")
+    return uploaded_dataset_ids
+
+
+async def _upload_batch_with_retry(
+    tenant_id: str, body: bytes, batch_nbr: int, max_retries: int
+) -> dm.StatusResponseSuccess | None:
+    # Each attempt gets a fresh presigned url and job, so only this batch is re-sent.
+    # Returns the status of the upload job, or None if every attempt failed.
+    for attempt in range(max_retries + 1):
+        try:
+            return await _upload_batch(tenant_id, body)
+        except Exception as e:
+            print(f"Upload of batch {batch_nbr} failed (attempt {attempt + 1}): {e}")
+            if attempt < max_retries:
+                INSTRUMENTATION.record_retry(
+                    "upload_batch", attempt + 1, type(e).__name__
+                )
+                await asyncio.sleep(config.SLEEP_DURATION_SHORT)
+    return None
+
+
+async def _upload_batch(tenant_id: str, body: bytes) -> dm.StatusResponseSuccess:
+    # The body is already compressed with REQUEST_COMPRESSION
+    presigned_url_response: dm.PresignedUrlResponseSuccess = await get_presigned_url(
+        tenant_id
+    )
+    headers: dict = TM.generate_headers(include_token=False, tenant_id=tenant_id)
+    res = await ASYNC_CLIENT.put(
+        presigned_url_response.url,
+        headers={**headers, **content_encoding_headers(config.REQUEST_COMPRESSION)},
+        content=body,
+    )
+
+    # The presigned url carries its own credentials, so there is no token to refresh
+    if res.status_code >= 400:
+        raise Exception(f"Upload to presigned url failed with status {res.status_code}")
+
+    # Many batches are in flight at once, so they share the multiplexed status poller
+    job_id = presigned_url_response.jobId
+    status_response = await STATUS_SCHEDULER.watch(tenant_id, job_id, "upload")
+    if status_response.status == "failed":
+        raise Exception(f"Upload job {job_id} failed: {status_response.message}")
+    return status_response
+
+
+def _iter_upload_batches(
+    payload: UploadSource, max_batch_bytes: int
+) -> Iterator[tuple[bytes, list[str]]]:
+    if isinstance(payload, dm.UploadDataPayload):
+        payload = payload.datasets
+
+    parts, dataset_ids, batch_bytes = [], [], 0
+    for dataset in payload:
+        part = dump_dataset(dataset)
+        if parts and batch_bytes + len(part) > max_batch_bytes:
+            yield _join_upload_body(parts), dataset_ids
+            parts, dataset_ids, batch_bytes = [], [], 0
+        parts.append(part)
+        dataset_ids.append(dataset.datasetId)
+        batch_bytes += len(part) + 1
+    if parts:
+        yield _join_upload_body(parts), dataset_ids
+
+
+def _join_upload_body(parts: list[bytes]) -> bytes:
+    return b'{"datasets":[' + b",".join(parts) + b"]}"
+
+
+async def get_presigned_url(tenant_id: str) -> dm.PresignedUrlResponseSuccess:
+    # Prepare the url for the request to the /presigned_url endpoint
+    url = f"{config.IO_BASE_URL}/presigned_url"
+
+    # Make the request to the /presigned_url endpoint
+    print("Getting presigned url...")
+    res = await _authorized_request("GET", url, tenant_id=tenant_id)
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, return the success response
+    if res.status_code == 200:
+        return dm.PresignedUrlResponseSuccess(**res.json())
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "presigned_url")
+
+
+### INCREMENTAL SYNC ###################################################################
+async def upload_data_incremental_from_json(
+    tenant_id: str, path: str, watermarks: WatermarkStore | None = None
+) -> list[str]:
+    return await upload_data_incremental(
+        tenant_id, iter_columnar_datasets_from_json, path, watermarks
+    )
+
+
+async def upload_data_incremental(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    watermarks: WatermarkStore | None = None,
+) -> list[str]:
+    # Uploads only the transactions departing after each dataset's watermark, i.e. the
+    # latest departureDate uploaded so far. Returns the IDs of datasets with new data.
+    if watermarks is None:
+        watermarks = WATERMARKS
+    deltas = await asyncio.to_thread(
+        _select_deltas, payload_function, arg, tenant_id, watermarks
+    )
+    if not deltas:
+        print("No new transactions to upload\n")
+        return []
+
+    print(f"Uploading new transactions for {len(deltas)} datasets...")
+    status_response = await _upload_columnar(tenant_id, deltas)
+    watermarks.advance(
+        tenant_id,
+        _without_failed_datasets(
+            status_response,
+            {
+                delta.datasetId: delta.transactions.last_departure_date()
+                for delta in deltas
+            },
+        ),
+    )
+    return [delta.datasetId for delta in deltas]
+
+
+async def resync_window(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    from_date: str,
+    to_date: str,
+    dataset_ids: Iterable[str] | None = None,
+    watermarks: WatermarkStore | None = None,
+) -> dm.BulkDeleteReport:
+    # Replaces a corrected window of history: the window is deleted from each dataset
+    # (all in the source, or only dataset_ids) and re-uploaded from the source. Datasets
+    # whose delete failed are not re-uploaded, see the returned report.
+    if watermarks is None:
+        watermarks = WATERMARKS
+    windows = await asyncio.to_thread(
+        _select_windows, payload_function, arg, from_date, to_date, dataset_ids
+    )
+    report = await delete_data_bulk(
+        tenant_id,
+        [
+            dm.DeleteDataRequest(
+                datasetId=window.datasetId, fromDate=from_date, toDate=to_date
+            )
+            for window in windows
+        ],
+    )
+    deleted = set(report.deleted)
+    windows = [
+        window
+        for window in windows
+        if window.datasetId in deleted and len(window.transactions)
+    ]
+    if windows:
+        print(f"Re-uploading {from_date} to {to_date} for {len(windows)} datasets...")
+        status_response = await _upload_columnar(tenant_id, windows)
+        watermarks.advance(
+            tenant_id,
+            _without_failed_datasets(
+                status_response,
+                {
+                    window.datasetId: window.transactions.last_departure_date()
+                    for window in windows
+                },
+            ),
+        )
+    return report
+
+
+async def _upload_columnar(
+    tenant_id: str, datasets: list[ColumnarDataset]
+) -> dm.StatusResponseSuccess:
+    body, body_size, _, _, _ = await asyncio.to_thread(
+        _spool_upload_body, lambda _: datasets, None
+    )
+    return await _upload_body(tenant_id, body, body_size)
+
+
+def _iter_columnar(payload: UploadSource) -> Iterator[ColumnarDataset]:
+    if isinstance(payload, dm.UploadDataPayload):
+        payload = payload.datasets
+    for dataset in payload:
+        if isinstance(dataset, dm.Dataset):
+            dataset = ColumnarDataset.from_dataset(dataset)
+        yield dataset
+
+
+def _select_deltas(
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    tenant_id: str,
+    watermarks: WatermarkStore,
+) -> list[ColumnarDataset]:
+    deltas = []
+    for dataset in _iter_columnar(payload_function(arg)):
+        transactions = dataset.transactions.select_dates(
+            after=watermarks.get(tenant_id, dataset.datasetId)
+        )
+        if len(transactions):
+            deltas.append(ColumnarDataset(dataset.datasetId, transactions))
+    return deltas
+
+
+def _select_windows(
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    from_date: str,
+    to_date: str,
+    dataset_ids: Iterable[str] | None,
+) -> list[ColumnarDataset]:
+    # Empty windows are kept, since their delete removes transactions dropped upstream
+    dataset_ids = None if dataset_ids is None else set(dataset_ids)
+    return [
+        ColumnarDataset(
+            dataset.datasetId,
+            dataset.transactions.select_dates(from_date=from_date, to_date=to_date),
+        )
+        for dataset in _iter_columnar(payload_function(arg))
+        if dataset_ids is None or dataset.datasetId in dataset_ids
+    ]
+
+
+### TRAINING ###########################################################################
+async def start_trainer(
+    tenant_id: str,
+    dataset_ids: list[str] = ["dummy-dataset-1"],
+    wait: bool = True,
+    parameters: ParameterTable | None = None,
+) -> dm.StartTrainerResponseSuccess:
+    # Get the payload for the request to the /start_trainer endpoint. With a parameter
+    # table each dataset is trained with its own row, serialised straight from columns.
+    payload: dm.StartTrainerPayload | bytes = (
+        generate_start_trainer_payload(dataset_ids)
+        if parameters is None
+        else parameters.select(dataset_ids).start_trainer_body()
+    )
+
+    # Make the request to the /start_trainer endpoint
+    print("Starting trainer...")
+    body, encoding_headers = encode_body(payload, config.REQUEST_COMPRESSION)
+    res = await _authorized_request(
+        "POST",
+        url=f"{config.IO_BASE_URL}/start_trainer",
+        include_content_type=True,
+        tenant_id=tenant_id,
+        extra_headers=encoding_headers,
+        content=body,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, poll the status endpoint until the job is complete
+    if res.status_code == 202:
+        start_trainer_response = dm.StartTrainerResponseSuccess(**res.json())
+        if wait:
+            await poll_job_status(tenant_id, start_trainer_response.jobId, "trainer")
+        return start_trainer_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "start_trainer")
+
+
+async def start_trainer_coalesced(
+    tenant_id: str, dataset_id: str
+) -> dm.StatusResponseSuccess:
+    # Trains the dataset in one job together with the tenant's other datasets requested
+    # around the same time, and returns the status of that shared job
+    return await TRAINER_COALESCER.submit(tenant_id, dataset_id)
+
+
+async def _start_trainer_batch(
+    tenant_id: str, dataset_ids: list[str]
+) -> dict[str, dm.StatusResponseSuccess | Exception]:
+    res = await start_trainer(tenant_id, dataset_ids, wait=False)
+    status_response = await STATUS_SCHEDULER.watch(tenant_id, res.jobId, "trainer")
+    return {
+        **dict.fromkeys(dataset_ids, status_response),
+        **_failed_datasets(status_response, dataset_ids),
+    }
+
+
+### PREDICTION #########################################################################
+async def create_prediction(
+    tenant_id: str,
+    dataset_ids=["dummy-dataset-1"],
+    wait: bool = True,
+    parameters: ParameterTable | None = None,
+) -> dm.CreatePredictionResponseSuccess:
+    # Get the payload for the request to the /create_prediction endpoint. With a
+    # parameter table each dataset is predicted with its own row.
+    payload: dm.CreatePredictionPayload | bytes = (
+        generate_create_prediction_payload(dataset_ids)
+        if parameters is None
+        else parameters.select(dataset_ids).create_prediction_body()
+    )
+
+    # Make the request to the /create_prediction endpoint
+    print("Creating prediction...")
+    body, encoding_headers = encode_body(payload, config.REQUEST_COMPRESSION)
+    res = await _authorized_request(
+        "POST",
+        url=f"{config.IO_BASE_URL}/create_prediction",
+        include_content_type=True,
+        tenant_id=tenant_id,
+        extra_headers=encoding_headers,
+        content=body,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, poll the status endpoint until the job is complete
+    if res.status_code == 202:
+        create_prediction_response = dm.CreatePredictionResponseSuccess(**res.json())
+        if wait:
+            await poll_job_status(
+                tenant_id, create_prediction_response.jobId, "prediction"
+            )
+        print(create_prediction_response.jobId)
+        return create_prediction_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "create_prediction")
+
+
+async def create_prediction_coalesced(
+    tenant_id: str, dataset_id: str
+) -> dm.ResultsObject:
+    # Predicts the dataset in one job together with the tenant's other datasets
+    # requested around the same time, and returns this dataset's results
+    return await PREDICTION_COALESCER.submit(tenant_id, dataset_id)
+
+
+async def _create_prediction_batch(
+    tenant_id: str, dataset_ids: list[str]
+) -> dict[str, dm.ResultsObject | Exception]:
+    res = await create_prediction(tenant_id, dataset_ids, wait=False)
+    status_response = await STATUS_SCHEDULER.watch(tenant_id, res.jobId, "prediction")
+    if status_response.status == "failed":
+        return _failed_datasets(status_response, dataset_ids)
+    # Nobody else knows the shared job, so its results aren't worth caching
+    results_response = await get_results(tenant_id, res.jobId, use_cache=False)
+    return {
+        **{result.datasetId: result for result in results_response.results},
+        **_failed_datasets(status_response),
+    }
+
+
+async def get_results(
+    tenant_id: str, job_id: str, use_cache: bool = True
+) -> dm.ResultsResponseSuccess:
+    # Results of a completed job never change, so repeat reads are served from cache.
+    # use_cache=False neither reads nor stores them.
+    key = ("results", tenant_id, job_id)
+    if use_cache:
+        results_response = await _get_cached_results(
+            key, dm.ResultsResponseSuccess.model_validate_json
+        )
+        if results_response is not None:
+            print("Results retrieved from cache!\n")
+            return results_response
+
+    # Make the request to the /results endpoint
+    print("Getting results...")
+    res = await _authorized_request(
+        "GET",
+        url=f"{config.IO_BASE_URL}/results",
+        tenant_id=tenant_id,
+        job_id=job_id,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, return the success response
+    if res.status_code == 200:
+        results_response = dm.ResultsResponseSuccess.model_validate_json(res.content)
+        if use_cache:
+            await _cache_results(key, results_response, res.content)
+        msg = (
+            results_response.message
+            if results_response.message != ""
+            else "Job completed successfully!"
+        )
+        print(f"Results retrieved! Message: {msg}\n")
+        return results_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "results")
+
+
+async def get_results_lazy(
+    tenant_id: str, job_id: str, include_series: bool = True, use_cache: bool = True
+) -> LazyResultsResponse:
+    # Like get_results, but each ResultsObject is only validated when it is accessed
+    key = ("lazy_results", tenant_id, job_id)
+    if use_cache:
+        results_response = await _get_cached_results(key, LazyResultsResponse)
+        if results_response is not None:
+            print("Results retrieved from cache!\n")
+            return results_response.view(include_series)
+
+    # Make the request to the /results endpoint
+    print("Getting results...")
+    res = await _authorized_request(
+        "GET",
+        url=f"{config.IO_BASE_URL}/results",
+        tenant_id=tenant_id,
+        job_id=job_id,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, return the lazy response without validating it
+    if res.status_code == 200:
+        results_response = LazyResultsResponse(res.content, include_series)
+        if use_cache:
+            await _cache_results(key, results_response, res.content)
+        print("Results retrieved!\n")
+        return results_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "results")
+
+
+async def export_results(
+    tenant_id: str, job_id: str, path: str, file_format: str = "parquet"
+) -> list[str]:
+    # Writes the forecast, historicalData and suggestions tables of a job's results
+    # to columnar files in the directory `path`; see results_export for reading them
+    results_response = await get_results_lazy(tenant_id, job_id)
+    print(f"Exporting results to {path}...")
+    paths = await asyncio.to_thread(write_results, results_response, path, file_format)
+    print(f"Results exported to {len(paths)} files!\n")
+    return paths
+
+
+### INVENTORY CLASSIFICATION ###########################################################
+async def start_inventory_classification(
+    tenant_id: str,
+    dataset_ids: list[str],
+    wait: bool = True,
+) -> dm.StartInventoryClassificationResponseSuccess:
+    # Get the payload for the request to /start_inventory_classification
+    payload = generate_start_inventory_classification_payload(dataset_ids)
+
+    # Make the request to the /start_inventory_classification endpoint
+    print("Starting inventory classification...")
+    body, encoding_headers = encode_body(payload, config.REQUEST_COMPRESSION)
+    res = await _authorized_request(
+        "POST",
+        url=f"{config.IO_BASE_URL}/start_inventory_classification",
+        include_content_type=True,
+        tenant_id=tenant_id,
+        extra_headers=encoding_headers,
+        content=body,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, poll the status endpoint until the job is complete
+    if res.status_code == 202:
+        res = dm.StartInventoryClassificationResponseSuccess(**res.json())
+        if wait:
+            await poll_job_status(tenant_id, res.jobId, "inventory_classification")
+        return res
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "start_inventory_classification")
+
+
+async def get_inventory_classification_results(
+    tenant_id: str,
+    job_id: str,
+    use_cache: bool = True,
+) -> dm.InventoryClassificationResultsResponse:
+    # Results of a completed job never change, so repeat reads are served from cache
+    key = ("inventory_classification_results", tenant_id, job_id)
+    if use_cache:
+        results_response = await _get_cached_results(
+            key, dm.InventoryClassificationResultsResponse.model_validate_json
+        )
+        if results_response is not None:
+            print("Results retrieved from cache!\n")
+            return results_response
+
+    # Make the request to the /inventory_classification_results endpoint
+    print("Getting inventory classification results...")
+    res = await _authorized_request(
+        "GET",
+        url=f"{config.IO_BASE_URL}/inventory_classification_results",
+        tenant_id=tenant_id,
+        job_id=job_id,
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, return the success response
+    if res.status_code == 200:
+        results_response = (
+            dm.InventoryClassificationResultsResponse.model_validate_json(res.content)
+        )
+        if use_cache:
+            await _cache_results(key, results_response, res.content)
+        msg = (
+            results_response.message
+            if results_response.message != ""
+            else "NOT IMPLEMENTED"
+        )
+        print(f"Results retrieved! Message: {msg}\n")
+        return results_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "inventory_classification_results")
+
+
+### DELETE DATA ########################################################################
+async def delete_data(
+    tenant_id: str,
+    dataset_id: str,
+    from_date: str = "",
+    to_date: str = "",
+) -> dm.DeleteDataResponseSuccess:
+    # Make the request to the /data endpoint
+    print("Deleting data...")
+    res = await _send_delete_data_request(
+        tenant_id,
+        dm.DeleteDataRequest(datasetId=dataset_id, fromDate=from_date, toDate=to_date),
+    )
+
+    # If the token is still rejected after a refresh, raise exception
+    if res.status_code == 403:
+        raise dm.OutdatedAccessTokenException("Outdated access token!", res)
+
+    # If the request was successful, return the success response
+    if res.status_code == 200:
+        data_response = dm.DeleteDataResponseSuccess(**res.json())
+        _forget_uploads(
+            tenant_id,
+            [
+                dm.DeleteDataRequest(
+                    datasetId=dataset_id, fromDate=from_date, toDate=to_date
+                )
+            ],
+        )
+        print(f"Data deleted! Message: {data_response.message}\n")
+        return data_response
+
+    # If not, handle the failure by printing the error message and raising an exception
+    _handle_failed_request(res, "data")
+
+
+async def delete_data_bulk(
+    tenant_id: str,
+    requests: Iterable[str | dm.DeleteDataRequest],
+    max_concurrency: int = config.DELETE_MAX_CONCURRENCY,
+    requests_per_second: float = config.DELETE_REQUESTS_PER_SECOND,
+    max_retries: int = config.MAX_RETRIES,
+) -> dm.BulkDeleteReport:
+    # Failures are reported per dataset instead of raised, so one bad dataset doesn't
+    # stop the rest. All workers share the connection pool and one rate limit.
+    requests = dm.DeleteDataRequest.from_ids(requests)
+    rate_limiter = RateLimiter(requests_per_second, max_concurrency)
+    results: list[dm.DeleteDataResult | None] = [None] * len(requests)
+    indices = iter(range(len(requests)))
+
+    async def work():
+        for index in indices:
+            results[index] = await _delete_data_with_retry(
+                tenant_id, requests[index], rate_limiter, max_retries
+            )
+
+    print(f"Deleting {len(requests)} datasets...")
+    await asyncio.gather(*(work() for _ in range(min(max_concurrency, len(requests)))))
+    report = dm.BulkDeleteReport(results=results)
+    _forget_uploads(tenant_id, [result for result in report.results if result.deleted])
+    print(f"Deleted {len(report.deleted)} of {len(requests)} datasets!\n")
+    return report
+
+
+def _forget_uploads(
+    tenant_id: str, deletes: list[dm.DeleteDataRequest | dm.DeleteDataResult]
+):
+    # Deleted data is no longer on the server, so the next upload must not skip it as
+    # unchanged. Only a full delete resets the watermark, so the next incremental upload
+    # sends the whole history; a ranged delete keeps it, or the history after the range
+    # would be sent again. Re-uploading the range is then up to the caller.
+    by_range: dict[tuple[str, str], list[str]] = {}
+    for delete in deletes:
+        date_range = (delete.fromDate or "", delete.toDate or "")
+        by_range.setdefault(date_range, []).append(delete.datasetId)
+    for (from_date, to_date), dataset_ids in by_range.items():
+        if UPLOAD_MANIFEST is not None:
+            UPLOAD_MANIFEST.invalidate(tenant_id, dataset_ids, from_date, to_date)
+        if not from_date and not to_date:
+            WATERMARKS.reset(tenant_id, dataset_ids)
+
+
+def schedule_cleanup(
+    tenant_id: str, requests: Iterable[str | dm.DeleteDataRequest]
+) -> concurrent.futures.Future:
+    # Thread-safe entry point; the deletes run in the background on the event loop
+    requests = list(requests)
+
+    async def schedule() -> dm.BulkDeleteReport:
+        cleanup = CLEANUP_QUEUE.schedule(tenant_id, requests)
+        cleanup.add_done_callback(
+            lambda future: _log_cleanup_outcome(tenant_id, requests, future)
+        )
+        return await cleanup
+
+    return asyncio.run_coroutine_threadsafe(schedule(), get_event_loop())
+
+
+def _log_cleanup_outcome(tenant_id: str, requests: list, future: asyncio.Future):
+    # Cleanups run in the background, so their failures are reported here
+    if future.cancelled():
+        print(f"Cleanup of {len(requests)} datasets for {tenant_id} was cancelled")
+    elif future.exception() is not None:
+        print(
+            f"Cleanup of {len(requests)} datasets for {tenant_id} failed: "
+            f"{future.exception()}"
+        )
+
+
+async def _delete_data_with_retry(
+    tenant_id: str,
+    request: dm.DeleteDataRequest,
+    rate_limiter: RateLimiter,
+    max_retries: int,
+) -> dm.DeleteDataResult:
+    result = dm.DeleteDataResult(**request.model_dump())
+    for attempt in range(max_retries + 1):
+        await rate_limiter.acquire()
+        result.attempts += 1
+        delay = None
+        try:
+            res = await _send_delete_data_request(tenant_id, request)
+        except httpx.TransportError as e:
+            result.error = f"{type(e).__name__}: {e}"
+            reason = type(e).__name__
+        else:
+            if res.status_code == 200:
+                result.deleted = True
+                result.message = dm.DeleteDataResponseSuccess(**res.json()).message
+                result.error = None
+                return result
+            result.error = _failure_message(res)
+            if res.status_code not in _RETRYABLE_STATUS_CODES:
+                return result
+            delay = retry_after(res.headers)
+            reason = str(res.status_code)
+        if attempt < max_retries:
+            INSTRUMENTATION.record_retry("/data", attempt + 1, reason)
+            await asyncio.sleep(config.SLEEP_DURATION_SHORT if delay is None else delay)
+    return result
+
+
+async def _send_delete_data_request(
+    tenant_id: str, request: dm.DeleteDataRequest
+) -> httpx.Response:
+    params = {"fromDate": request.fromDate, "toDate": request.toDate}
+    return await _authorized_request(
+        "DELETE",
+        url=f"{config.IO_BASE_URL}/data/{request.datasetId}",
+        include_content_type=True,
+        tenant_id=tenant_id,
+        params={key: value for key, value in params.items() if value},
+    )
+
+
+### STATUS #############################################################################
+async def poll_job_status(
+    tenant_id: str,
+    job_id: str,
+    job_type: str = "job",
+    strategy: PollingStrategy | None = None,
+) -> dm.StatusResponseSuccess:
+    print("Polling job status...")
+    strategy = strategy or POLLING_STRATEGY
+    url = f"{config.IO_BASE_URL}/status"
+    record = POLL_STATS.start(job_id, job_type)
+    started = time.monotonic()
+
+    # The job may not be visible to /status right away, so a few 404s are retried
+    not_found = 0
+    while True:
+        res = await _authorized_request("GET", url, tenant_id=tenant_id, job_id=job_id)
+        record.polls += 1
+        INSTRUMENTATION.record_poll(record, res.status_code)
+        if res.status_code == 200:
+            status_response = dm.StatusResponseSuccess(**res.json())
+            if status_response.status != "inProgress":
+                break
+            print(f"\tResponse status: {status_response.status}")
+        elif res.status_code == 404 and not_found < config.MAX_RETRIES:
+            not_found += 1
+        elif res.status_code not in (429, 503) or retry_after(res.headers) is None:
+            record.status = "failed"
+            INSTRUMENTATION.record_job(record, time.monotonic() - started)
+            _handle_failed_request(res, "status")
+
+        # A Retry-After from the server takes precedence over the strategy
+        elapsed = time.monotonic() - started
+        delay = retry_after(res.headers)
+        if delay is None:
+            delay = strategy.next_delay(job_type, record.polls - 1, elapsed)
+        if strategy.deadline is not None and elapsed + delay > strategy.deadline:
+            record.status = "deadlineExceeded"
+            INSTRUMENTATION.record_job(record, elapsed)
+            raise TimeoutError(
+                f"Job {job_id} did not complete within {strategy.deadline} seconds"
+            )
+        record.waited += delay
+        await asyncio.sleep(delay)
+
+    record.duration = time.monotonic() - started
+    record.status = status_response.status
+    strategy.record_completion(job_type, record.duration)
+    INSTRUMENTATION.record_job(record, record.duration)
+    print(f"Job complete! Message: {status_response.message}\n")
+    return status_response
+
+
+async def poll_job_statuses(
+    jobs: list[tuple[str, str]], job_type: str = "job"
+) -> list[dm.StatusResponseSuccess]:
+    # Waits for many (tenant_id, job_id) pairs through the shared status scheduler
+    return await asyncio.gather(
+        *(
+            STATUS_SCHEDULER.watch(tenant_id, job_id, job_type)
+            for tenant_id, job_id in jobs
+        )
+    )
+
+
+def watch_job_status(
+    tenant_id: str,
+    job_id: str,
+    job_type: str = "job",
+    callback: Callable[[dm.StatusResponseSuccess], None] | None = None,
+) -> concurrent.futures.Future:
+    # Thread-safe entry point; the callback runs on the background event loop thread
+    async def watch() -> dm.StatusResponseSuccess:
+        return await STATUS_SCHEDULER.watch(tenant_id, job_id, job_type, callback)
+
+    return asyncio.run_coroutine_threadsafe(watch(), get_event_loop())
+
+
+### JOURNALED FLOW #####################################################################
+async def run_journaled_flow(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    flow_id: str,
+    journal: JobJournal | None = None,
+) -> dm.ResultsResponseSuccess:
+    # Uploads, trains and predicts, recording every job in the journal (JOB_JOURNAL by
+    # default). Running it again with the same flow_id resumes: completed stages are
+    # skipped, in-flight jobs are re-attached to through /status, and only stages that
+    # never started or failed are submitted again.
+    journal = journal or JOB_JOURNAL
+
+    async def upload(
+        on_submitted: Callable[[str, list[str]], Any],
+    ) -> dm.StatusResponseSuccess:
+        completed: list[dm.StatusResponseSuccess] = []
+        dataset_ids = await upload_data(
+            tenant_id,
+            payload_function,
+            arg,
+            on_submitted=on_submitted,
+            on_completed=completed.append,
+        )
+        if not completed:
+            # Every dataset was unchanged since its last upload, so no job was needed
+            on_submitted("", dataset_ids)
+            return dm.StatusResponseSuccess(
+                status="completed", message="Nothing to upload", datasetsStatus=[]
+            )
+        return completed[0]
+
+    uploaded = await _run_journaled_job(
+        journal, flow_id, tenant_id, "upload", "upload", upload
+    )
+    dataset_ids = uploaded.datasetIds
+
+    async def train(
+        on_submitted: Callable[[str, list[str]], Any],
+    ) -> dm.StatusResponseSuccess:
+        res = await start_trainer(tenant_id, dataset_ids, wait=False)
+        on_submitted(res.jobId, dataset_ids)
+        return await poll_job_status(tenant_id, res.jobId, "trainer")
+
+    await _run_journaled_job(journal, flow_id, tenant_id, "train", "trainer", train)
+
+    async def predict(
+        on_submitted: Callable[[str, list[str]], Any],
+    ) -> dm.StatusResponseSuccess:
+        res = await create_prediction(tenant_id, dataset_ids, wait=False)
+        on_submitted(res.jobId, dataset_ids)
+        return await poll_job_status(tenant_id, res.jobId, "prediction")
+
+    predicted = await _run_journaled_job(
+        journal, flow_id, tenant_id, "predict", "prediction", predict
+    )
+    return await get_results(tenant_id, predicted.jobId)
+
+
+async def _run_journaled_job(
+    journal: JobJournal,
+    flow_id: str,
+    tenant_id: str,
+    stage: str,
+    job_type: str,
+    submit: Callable[
+        [Callable[[str, list[str]], Any]],
+        Coroutine[Any, Any, dm.StatusResponseSuccess],
+    ],
+) -> JournalEntry:
+    # submit starts the job, passes its ID to the callback it is given as soon as the
+    # job is accepted (or an empty ID if no job was needed), and returns the job's
+    # terminal status. Datasets the job reports as failed are dropped from its entry.
+    entry = journal.latest(flow_id, stage)
+    if entry is not None and entry.tenantId != tenant_id:
+        raise ValueError(f"Flow {flow_id} was journaled for tenant {entry.tenantId}")
+    if entry is not None and entry.status == "completed":
+        print(f"Skipping {stage}, job {entry.jobId} already completed\n")
+        return entry
+    if entry is not None and entry.status == "submitted":
+        # The job kept running on the server while nobody was watching it
+        print(f"Re-attaching to {stage} job {entry.jobId}...")
+        try:
+            status_response = await poll_job_status(tenant_id, entry.jobId, job_type)
+            entry = journal.record(_completed_entry(entry, status_response))
+        except Exception as e:
+            entry = journal.record(
+                entry.model_copy(update={"status": "failed", "error": str(e)})
+            )
+        if entry.status == "completed":
+            return entry
+        print(f"The {stage} job ended as {entry.status}, submitting it again")
+
+    submitted: list[JournalEntry] = []
+
+    def on_submitted(job_id: str, dataset_ids: list[str]):
+        entry = JournalEntry(
+            flowId=flow_id,
+            tenantId=tenant_id,
+            stage=stage,
+            jobType=job_type,
+            jobId=job_id,
+            datasetIds=dataset_ids,
+        )
+        submitted.append(journal.record(entry))
+
+    try:
+        status_response = await submit(on_submitted)
+    except Exception as e:
+        if submitted:
+            journal.record(
+                submitted[-1].model_copy(update={"status": "failed", "error": str(e)})
+            )
+        raise
+    if not submitted:
+        raise Exception(
+            f"The {stage} stage ended as {status_response.status} without submitting "
+            "a job"
+        )
+    entry = journal.record(_completed_entry(submitted[-1], status_response))
+    if entry.status != "completed":
+        raise Exception(f"The {stage} job {entry.jobId} ended as {entry.status}")
+    return entry
+
+
+def _completed_entry(
+    entry: JournalEntry, status_response: dm.StatusResponseSuccess
+) -> JournalEntry:
+    if status_response.status == "failed":
+        return entry.model_copy(update={"status": "failed"})
+    dataset_ids = _without_failed_datasets(
+        status_response, dict.fromkeys(entry.datasetIds)
+    )
+    return entry.model_copy(
+        update={"status": status_response.status, "datasetIds": list(dataset_ids)}
+    )
+
+
+### ACCESS #############################################################################
+def update_access_token():
+    TM.refresh()
+
+
+### HELPERS ############################################################################
+async def _authorized_request(
+    method: str,
+    url: str,
+    include_content_type: bool = False,
+    tenant_id: str = "",
+    job_id: str = "",
+    extra_headers: dict | None = None,
+    **kwargs,
+) -> httpx.Response:
+    # The token is refreshed ahead of expiry; if it is rejected anyway, refresh it once
+    # (shared with any concurrent callers) and re-send only this request
+    async def send() -> httpx.Response:
+        headers = TM.generate_headers(
+            include_content_type=include_content_type,
+            tenant_id=tenant_id,
+            job_id=job_id,
+        )
+        await (REQUEST_RATE_LIMITER.get() or TENANT_RATE_LIMITER).acquire(tenant_id)
+        return await ASYNC_CLIENT.request(
+            method, url, headers={**headers, **(extra_headers or {})}, **kwargs
+        )
+
+    token = await TM.ensure_fresh_async()
+    res = await send()
+    if res.status_code == 403:
+        print("Access token rejected. Refreshing...")
+        INSTRUMENTATION.record_retry(endpoint_name(res.request), 1, "403")
+        await TM.refresh_async(stale_token=token)
+        print("Retrying request...")
+        res = await send()
+    return res
+
+
+async def _get_cached_results(key: CacheKey, parse: Callable[[bytes], T]) -> T | None:
+    results_response = RESULTS_CACHE.get(key)
+    if results_response is None and RESULTS_CACHE.path is not None:
+        results_response = await asyncio.to_thread(RESULTS_CACHE.load, key, parse)
+    if results_response is None:
+        RESULTS_CACHE.record_miss()
+    return results_response
+
+
+async def _cache_results(key: CacheKey, results_response: Any, content: bytes):
+    # Writing the disk tier is blocking I/O, so it happens off the loop
+    if RESULTS_CACHE.path is None:
+        RESULTS_CACHE.put(key, results_response, content)
+    else:
+        await asyncio.to_thread(RESULTS_CACHE.put, key, results_response, content)
+
+
+def _failure_message(res: httpx.Response) -> str:
+    try:
+        failure_response = dm.FailureResponse(**res.json())
+    except ValueError:
+        return f"Status {res.status_code}: {res.text}"
+    return f"{failure_response.error}: {failure_response.message}"
+
+
+def _failed_datasets(
+    status_response: dm.StatusResponseSuccess, dataset_ids: Iterable[str] = ()
+) -> dict[str, dm.DatasetFailedException]:
+    # A failed job fails all of its dataset_ids, not only those it reports as failed
+    messages = {}
+    if status_response.status == "failed":
+        messages = dict.fromkeys(dataset_ids, status_response.message)
+    for dataset_status in status_response.datasetsStatus:
+        if dataset_status.status == "failed":
+            messages[dataset_status.datasetId] = dataset_status.message
+    return {
+        dataset_id: dm.DatasetFailedException(
+            f"Dataset {dataset_id} failed: {message}", dataset_id
+        )
+        for dataset_id, message in messages.items()
+    }
+
+
+def _handle_failed_request(res: httpx.Response, endpoint_name: str):
+    failure_resposnse = dm.FailureResponse(**res.json())
+    print(
+        f"Call to {endpoint_name} failed."
+        f"\nError: {failure_resposnse.error}"
+        f"\nMessage: {failure_resposnse.message}"
+    )
+    raise Exception(f"Call to {endpoint_name} failed. See Error and Message above.")
+
+
+async def basic_flow(tenant_id: str = config.TENANT_ID):
+    await upload_dummy_data(tenant_id)
+    await start_trainer(tenant_id)
+    res: dm.CreatePredictionResponseSuccess = await create_prediction(tenant_id)
+    await get_results(tenant_id, job_id=res.jobId)
+    await delete_data(tenant_id, dataset_id="dummy-dataset-1")
+
+
+async def inventory_classification_flow(
+    tenant_id: str = config.TENANT_ID,
+) -> asyncio.Future:
+    dataset_ids = await upload_dummy_data(tenant_id, nbr_datasets=10)
+    res = await start_inventory_classification(tenant_id, dataset_ids)
+    await get_inventory_classification_results(tenant_id, res.jobId)
+
+    # Deleting doesn't need to hold up the flow, so it is handed to the cleanup queue.
+    # Await the returned future, or CLEANUP_QUEUE.join(), before the event loop closes.
+    cleanup = CLEANUP_QUEUE.schedule(tenant_id, dataset_ids)
+    cleanup.add_done_callback(
+        lambda future: _log_cleanup_outcome(tenant_id, dataset_ids, future)
+    )
+    return cleanup
+
+
+async def run_for_tenants(
+    flow: Callable[[str], Coroutine[Any, Any, T]], tenant_ids: list[str]
+) -> list[T | BaseException]:
+    # Every tenant's flow runs concurrently, bounded by the client's connection limit
+    return await asyncio.gather(
+        *(flow(tenant_id) for tenant_id in tenant_ids), return_exceptions=True
+    )
@@ -0,0 +1,21 @@
+import contextlib
+import os
+import tempfile
+
+
+def atomic_write(path: str, data: bytes):
+    # Writes to a temporary file in the same directory and renames it over the target,
+    # so readers, including other processes, never see a partially written file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,318 @@
+# Runs the prediction and inventory classification flows end to end against the local
+# mock server and reports where the time goes. Run from the repository root:
+#   python -m benchmarks.bench_pipeline --scales 1 100 10000 --output results.json
+#   python -m benchmarks.bench_pipeline --compare results.json
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+
+FLOWS = ("prediction", "inventory_classification")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def serve(mock_config: dict, connection):
+    # Runs in its own process so the server doesn't compete with the client for the GIL
+    from mock_server import MockServer, MockServerConfig
+
+    server = MockServer(MockServerConfig(**mock_config))
+    connection.send(server.url)
+    server.serve_forever()
+
+
+class Recorder:
+    # Times every HTTP request by endpoint, and the serialisation and parsing calls
+    def __init__(self):
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        # (start, end) of each status request, by job
+        self.status_requests: defaultdict[str, list[tuple[float, float]]] = defaultdict(
+            list
+        )
+        self.serialisation: list[float] = []
+        self.parsing: list[float] = []
+
+    def install(self, async_api, dm):
+        client = async_api.ASYNC_CLIENT
+        send = client.request
+
+        async def timed_request(method: str, url: str, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await send(method, url, **kwargs)
+            finally:
+                end = time.perf_counter()
+                endpoint = urlsplit(str(url)).path.strip("/").split("/")[0]
+                self.latencies[f"{method} /{endpoint}"].append(end - start)
+                job_id = (kwargs.get("headers") or {}).get("jobId")
+                if endpoint == "status" and job_id:
+                    self.status_requests[job_id].append((start, end))
+
+        client.request = timed_request
+        for name in ("dump_dataset", "encode_body"):
+            setattr(
+                async_api, name, self._timed(getattr(async_api, name), "serialisation")
+            )
+        for model in (
+            dm.ResultsResponseSuccess,
+            dm.InventoryClassificationResultsResponse,
+        ):
+            model.model_validate_json = self._timed(
+                model.model_validate_json, "parsing"
+            )
+
+    def _timed(self, function, bucket: str):
+        durations = getattr(self, bucket)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+
+        return timed
+
+    def polling_wall_time(self) -> float:
+        # Seconds during which at least one job was waiting for its next status poll.
+        # Jobs poll concurrently, so their waits overlap and are not simply summed.
+        waits = [
+            (previous[1], current[0])
+            for requests in self.status_requests.values()
+            for previous, current in zip(requests, requests[1:])
+        ]
+        total, covered_until = 0.0, float("-inf")
+        for start, end in sorted(waits):
+            if end > covered_until:
+                total += end - max(start, covered_until)
+                covered_until = end
+        return total
+
+    def endpoint_summary(self) -> dict:
+        return {
+            endpoint: {
+                "requests": len(durations),
+                "p50_ms": float(np.percentile(durations, 50)) * 1000,
+                "p99_ms": float(np.percentile(durations, 99)) * 1000,
+                "total_s": float(np.sum(durations)),
+            }
+            for endpoint, durations in sorted(self.latencies.items())
+        }
+
+
+async def run_flow(flow: str, nbr_datasets: int, args) -> dict:
+    import async_api
+    from synthetic_data import SyntheticDataConfig
+
+    tenant_id = f"bench-{flow}-{nbr_datasets}"
+    synthetic_config = SyntheticDataConfig(
+        nbr_datasets=nbr_datasets, nbr_periods=args.periods, seed=1
+    )
+    stages = {}
+
+    async def stage(name: str, coroutine):
+        start = time.perf_counter()
+        result = await coroutine
+        stages[name] = time.perf_counter() - start
+        return result
+
+    dataset_ids = await stage(
+        "upload", async_api.upload_synthetic_data(tenant_id, synthetic_config)
+    )
+    if flow == "prediction":
+        await stage("train", async_api.start_trainer(tenant_id, dataset_ids))
+        prediction = await stage(
+            "predict", async_api.create_prediction(tenant_id, dataset_ids)
+        )
+        await stage(
+            "results",
+            async_api.get_results(tenant_id, prediction.jobId, use_cache=False),
+        )
+    else:
+        classification = await stage(
+            "classify",
+            async_api.start_inventory_classification(tenant_id, dataset_ids),
+        )
+        await stage(
+            "results",
+            async_api.get_inventory_classification_results(
+                tenant_id, classification.jobId, use_cache=False
+            ),
+        )
+    report = await stage(
+        "delete",
+        async_api.delete_data_bulk(
+            tenant_id, dataset_ids, requests_per_second=args.delete_rps
+        ),
+    )
+    if report.failed:
+        raise RuntimeError(f"{len(report.failed)} datasets failed to delete")
+    return stages
+
+
+def run_scale(url: str, flow: str, nbr_datasets: int, args) -> dict:
+    # Runs in a fresh process, so peak RSS and learned polling delays are per run
+    import config
+
+    config.IO_BASE_URL = url
+    config.VISMA_CONNECT_URL = f"{url}/token"
+    import async_api
+    import data_models as dm
+
+    recorder = Recorder()
+    recorder.install(async_api, dm)
+    output = (
+        contextlib.nullcontext()
+        if args.verbose
+        else contextlib.redirect_stdout(io.StringIO())
+    )
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    with output:
+        stages = asyncio.run(run_flow(flow, nbr_datasets, args))
+    elapsed = time.perf_counter() - start
+
+    sleeping = recorder.polling_wall_time()
+    serialisation = float(np.sum(recorder.serialisation))
+    parsing = float(np.sum(recorder.parsing))
+    return {
+        "flow": flow,
+        "datasets": nbr_datasets,
+        "transactions": nbr_datasets * args.periods,
+        "seconds": elapsed,
+        "datasets_per_second": nbr_datasets / elapsed,
+        "stages_s": stages,
+        "polling_sleep_s": sleeping,
+        # Summed over jobs, so it can exceed the flow's duration
+        "polling_sleep_per_job_s": sum(
+            record.waited for record in async_api.POLL_STATS.records.values()
+        ),
+        "working_s": elapsed - sleeping,
+        "serialisation_s": serialisation,
+        "parsing_s": parsing,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_increase_mb": _peak_rss_mb() - rss_before,
+        "endpoints": recorder.endpoint_summary(),
+    }
+
+
+def print_result(result: dict):
+    print(
+        f"{result['flow']:<26}{result['datasets']:>8}{result['seconds']:>10.2f}"
+        f"{result['datasets_per_second']:>10.0f}{result['polling_sleep_s']:>10.2f}"
+        f"{result['working_s']:>10.2f}{result['serialisation_s']:>10.2f}"
+        f"{result['parsing_s']:>10.2f}{result['peak_rss_mb']:>10.0f}"
+    )
+    for endpoint, summary in result["endpoints"].items():
+        print(
+            f"    {endpoint:<40}{summary['requests']:>8} requests"
+            f"{summary['p50_ms']:>10.1f} ms p50{summary['p99_ms']:>10.1f} ms p99"
+        )
+
+
+def compare(current: list[dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["flow"], r["datasets"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared to {baseline_path} (current / baseline):")
+    print(f"{'flow':<26}{'datasets':>8}{'seconds':>10}{'working':>10}{'peak MB':>10}")
+    for result in current:
+        previous = baseline.get((result["flow"], result["datasets"]))
+        if previous is None:
+            continue
+        print(
+            f"{result['flow']:<26}{result['datasets']:>8}"
+            f"{result['seconds'] / previous['seconds']:>10.2f}"
+            f"{result['working_s'] / previous['working_s']:>10.2f}"
+            f"{result['peak_rss_mb'] / previous['peak_rss_mb']:>10.2f}"
+        )
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=[1, 100, 10_000, 100_000]
+    )
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+    parser.add_argument(
+        "--periods", type=int, default=12, help="Transactions per dataset"
+    )
+    parser.add_argument("--job-duration", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--delete-rps", type=float, default=1000.0)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--compare", help="Earlier output to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show client output")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    mock_config = {
+        "latency": args.latency,
+        "job_durations": dict.fromkeys(
+            ["upload", "trainer", "prediction", "inventory_classification"],
+            args.job_duration,
+        ),
+    }
+    receiver, sender = ctx.Pipe(duplex=False)
+    server = ctx.Process(target=serve, args=(mock_config, sender), daemon=True)
+    server.start()
+    url = receiver.recv()
+
+    results = []
+    print(
+        f"{'flow':<26}{'datasets':>8}{'seconds':>10}{'sets/s':>10}{'sleeping':>10}"
+        f"{'working':>10}{'serialise':>10}{'parse':>10}{'peak MB':>10}"
+    )
+    try:
+        for nbr_datasets in args.scales:
+            for flow in args.flows:
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(run_scale, (url, flow, nbr_datasets, args))
+                print_result(result)
+                results.append(result)
+    finally:
+        server.terminate()
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "arguments": vars(args),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nSaved results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
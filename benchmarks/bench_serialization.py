@@ -0,0 +1,86 @@
+# Compares the time and peak memory of the payload serialisation paths.
+# Run from the repository root: python -m benchmarks.bench_serialization
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+import data_models as dm
+from serialization import compress, dump_model, orjson
+
+
+def build_payload(nbr_transactions: int, txns_per_dataset: int) -> dm.UploadDataPayload:
+    # model_construct keeps payload construction out of the measurement
+    datasets = []
+    for i in range(nbr_transactions // txns_per_dataset):
+        transactions = [
+            dm.Transaction.model_construct(
+                quantity=float(j % 97),
+                departureDate=f"2024-{j % 12 + 1:02d}-{j % 28 + 1:02d}",
+                transactionId=f"txn-{i}-{j}",
+                unitCost=52.5,
+                unitPrice=99.9,
+            )
+            for j in range(txns_per_dataset)
+        ]
+        datasets.append(
+            dm.Dataset.model_construct(
+                datasetId=f"dataset-{i}", transactions=transactions
+            )
+        )
+    return dm.UploadDataPayload.model_construct(datasets=datasets)
+
+
+CASES = {
+    "model_dump + json.dumps": lambda p: json.dumps(p.model_dump()).encode(),
+    "pydantic to_json": dump_model,
+    "pydantic to_json + gzip": lambda p: compress(dump_model(p), "gzip"),
+    "pydantic to_json + deflate": lambda p: compress(dump_model(p), "deflate"),
+}
+if orjson is not None:
+    CASES["model_dump + orjson"] = lambda p: orjson.dumps(p.model_dump())
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name: str, nbr_transactions: int, txns_per_dataset: int) -> dict:
+    payload = build_payload(nbr_transactions, txns_per_dataset)
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    body = CASES[name](payload)
+    elapsed = time.perf_counter() - start
+    return {
+        "case": name,
+        "seconds": elapsed,
+        "peak_rss_increase_mb": _peak_rss_mb() - rss_before,
+        "body_mb": len(body) / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--transactions-per-dataset", type=int, default=100)
+    args = parser.parse_args()
+
+    # Every case runs in a fresh process so peak memory is not shared between cases
+    ctx = multiprocessing.get_context("spawn")
+    print(f"Serialising {args.transactions} transactions...")
+    print(f"{'case':<30}{'seconds':>10}{'peak MB':>10}{'body MB':>10}")
+    for name in CASES:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(
+                run_case, (name, args.transactions, args.transactions_per_dataset)
+            )
+        print(
+            f"{result['case']:<30}{result['seconds']:>10.2f}"
+            f"{result['peak_rss_increase_mb']:>10.0f}{result['body_mb']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
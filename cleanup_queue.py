@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+from collections import deque
+from typing import Awaitable, Callable, Iterable
+
+import data_models as dm
+from loop_local import LoopLocal
+
+
+class _LoopState:
+    def __init__(self):
+        self.items: deque[tuple[str, list[dm.DeleteDataRequest], asyncio.Future]] = (
+            deque()
+        )
+        self.pending: set[asyncio.Future] = set()
+        self.runner: asyncio.Task | None = None
+
+
+class CleanupQueue:
+    # Runs bulk deletes one after another on the event loop, so a flow can hand off its
+    # cleanup and carry on. Each bulk delete is parallel and rate limited by itself.
+    def __init__(
+        self,
+        delete_data_bulk: Callable[
+            [str, list[dm.DeleteDataRequest]], Awaitable[dm.BulkDeleteReport]
+        ],
+    ):
+        self.delete_data_bulk = delete_data_bulk
+        self._states = LoopLocal(_LoopState)
+
+    def schedule(
+        self, tenant_id: str, requests: Iterable[str | dm.DeleteDataRequest]
+    ) -> asyncio.Future:
+        # Must be called on the event loop; await the returned future for the report
+        state = self._states.get()
+        future = asyncio.get_running_loop().create_future()
+        state.items.append((tenant_id, dm.DeleteDataRequest.from_ids(requests), future))
+        state.pending.add(future)
+        future.add_done_callback(state.pending.discard)
+        if state.runner is None or state.runner.done():
+            # Shared by every caller, so it doesn't run in the context of whichever one
+            # started it
+            state.runner = asyncio.get_running_loop().create_task(
+                self._run(state), context=contextvars.Context()
+            )
+        return future
+
+    @property
+    def nbr_pending(self) -> int:
+        return sum(len(state.pending) for state in self._states.values())
+
+    async def join(self):
+        # Waits for everything scheduled so far on this event loop, including work
+        # scheduled meanwhile
+        state = self._states.get()
+        while state.pending:
+            await asyncio.wait(set(state.pending))
+
+    async def _run(self, state: _LoopState):
+        while state.items:
+            tenant_id, requests, future = state.items.popleft()
+            if future.cancelled():
+                continue
+            try:
+                report = await self.delete_data_bulk(tenant_id, requests)
+            except Exception as e:
+                future.set_exception(e)  # Logged by whoever scheduled the cleanup
+                continue
+            if report.failed:
+                print(
+                    f"Cleanup for tenant {tenant_id} could not delete "
+                    f"{len(report.failed)} of {len(report.results)} datasets"
+                )
+            future.set_result(report)
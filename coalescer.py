@@ -0,0 +1,99 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, TypeVar
+
+import data_models as dm
+from loop_local import LoopLocal
+
+T = TypeVar("T")
+
+
+class _OpenBatch:
+    def __init__(self, timer: asyncio.TimerHandle):
+        self.timer = timer
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+
+
+class _LoopState:
+    def __init__(self):
+        self.open: dict[str, _OpenBatch] = {}
+        self.in_flight: set[asyncio.Task] = set()
+
+
+class RequestCoalescer(Generic[T]):
+    # Collects single-dataset requests per tenant and submits them as one job, once
+    # max_batch_size distinct datasets are waiting or window seconds after the first
+    # request of the batch. submit_batch is called with (tenant_id, dataset_ids) and
+    # returns each dataset's outcome, a result or an exception, which is handed back to
+    # every caller that asked for that dataset.
+    def __init__(
+        self,
+        submit_batch: Callable[[str, list[str]], Awaitable[dict[str, T | Exception]]],
+        window: float = 0.1,
+        max_batch_size: int = 1000,
+    ):
+        self.submit_batch = submit_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._states = LoopLocal(_LoopState)
+
+    async def submit(self, tenant_id: str, dataset_id: str) -> T:
+        # Must be called on the event loop
+        loop = asyncio.get_running_loop()
+        state = self._states.get()
+        batch = state.open.get(tenant_id)
+        if batch is None:
+            timer = loop.call_later(self.window, self._flush, state, tenant_id)
+            batch = state.open[tenant_id] = _OpenBatch(timer)
+        future = loop.create_future()
+        batch.waiters.setdefault(dataset_id, []).append(future)
+        if len(batch.waiters) >= self.max_batch_size:
+            self._flush(state, tenant_id)
+        return await future
+
+    @property
+    def nbr_waiting(self) -> int:
+        return sum(
+            len(batch.waiters)
+            for state in self._states.values()
+            for batch in state.open.values()
+        )
+
+    async def flush(self):
+        # Submits every open batch of this event loop now and waits until all its
+        # submitted batches finish
+        state = self._states.get()
+        for tenant_id in list(state.open):
+            self._flush(state, tenant_id)
+        while state.in_flight:
+            await asyncio.wait(set(state.in_flight))
+
+    def _flush(self, state: _LoopState, tenant_id: str):
+        batch = state.open.pop(tenant_id, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._run(tenant_id, batch))
+        state.in_flight.add(task)
+        task.add_done_callback(state.in_flight.discard)
+
+    async def _run(self, tenant_id: str, batch: _OpenBatch):
+        dataset_ids = list(batch.waiters)
+        print(f"Submitting {len(dataset_ids)} coalesced datasets for {tenant_id}...")
+        try:
+            outcomes = await self.submit_batch(tenant_id, dataset_ids)
+        except Exception as e:
+            outcomes = dict.fromkeys(dataset_ids, e)
+        for dataset_id, futures in batch.waiters.items():
+            outcome = outcomes.get(dataset_id)
+            if outcome is None:
+                outcome = dm.DatasetFailedException(
+                    f"No outcome for dataset {dataset_id}", dataset_id
+                )
+            for future in futures:
+                # Callers that gave up waiting have cancelled their future
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
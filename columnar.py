@@ -0,0 +1,260 @@
+from typing import Iterable, Sequence
+
+import numpy as np
+
+import data_models as dm
+from serialization import dump_json_numbers, dump_json_strings
+
+_TRANSACTION_JSON = (
+    b'{"quantity":%s,"departureDate":"%s","transactionId":"%s","unitCost":%s,'
+    b'"unitPrice":%s}'
+)
+
+
+class TransactionColumns:
+    # One array per Transaction field instead of one pydantic object per row. Dates are
+    # interned: each row stores a code into the array of distinct departure dates.
+    def __init__(
+        self,
+        quantity: np.ndarray,
+        departure_date_codes: np.ndarray,
+        departure_dates: np.ndarray,
+        transaction_ids: np.ndarray,
+        unit_cost: np.ndarray,
+        unit_price: np.ndarray,
+    ):
+        self.quantity = quantity
+        self.departure_date_codes = departure_date_codes
+        self.departure_dates = departure_dates
+        self.transaction_ids = transaction_ids
+        self.unit_cost = unit_cost
+        self.unit_price = unit_price
+
+    @classmethod
+    def from_arrays(
+        cls,
+        quantity: Sequence[float] | np.ndarray,
+        departure_date: Sequence[str] | np.ndarray,
+        transaction_id: Sequence[str] | np.ndarray,
+        unit_cost: Sequence[float | None] | np.ndarray | None = None,
+        unit_price: Sequence[float | None] | np.ndarray | None = None,
+    ) -> "TransactionColumns":
+        # Validation runs once per column; missing unit cost/price is stored as NaN
+        nbr_rows = len(quantity)
+        quantity = float_column("quantity", quantity, nbr_rows, nullable=False)
+        unit_cost = float_column("unitCost", unit_cost, nbr_rows, nullable=True)
+        unit_price = float_column("unitPrice", unit_price, nbr_rows, nullable=True)
+        transaction_ids = str_column("transactionId", transaction_id, nbr_rows)
+        departure_date = str_column("departureDate", departure_date, nbr_rows)
+        departure_dates, departure_date_codes = np.unique(
+            departure_date.astype(str), return_inverse=True
+        )
+        return cls(
+            quantity=quantity,
+            departure_date_codes=departure_date_codes.astype(np.int32).reshape(-1),
+            departure_dates=departure_dates.astype(object),
+            transaction_ids=transaction_ids,
+            unit_cost=unit_cost,
+            unit_price=unit_price,
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "TransactionColumns":
+        # Rows as they appear in the upload JSON; unit cost and price default to 0.0
+        rows = list(rows)
+        return cls.from_arrays(
+            quantity=[row["quantity"] for row in rows],
+            departure_date=[row["departureDate"] for row in rows],
+            transaction_id=[row["transactionId"] for row in rows],
+            unit_cost=[row.get("unitCost", 0.0) for row in rows],
+            unit_price=[row.get("unitPrice", 0.0) for row in rows],
+        )
+
+    @classmethod
+    def from_transactions(
+        cls, transactions: Iterable[dm.Transaction]
+    ) -> "TransactionColumns":
+        transactions = list(transactions)
+        return cls.from_arrays(
+            quantity=[txn.quantity for txn in transactions],
+            departure_date=[txn.departureDate for txn in transactions],
+            transaction_id=[txn.transactionId for txn in transactions],
+            unit_cost=[txn.unitCost for txn in transactions],
+            unit_price=[txn.unitPrice for txn in transactions],
+        )
+
+    def __len__(self) -> int:
+        return len(self.quantity)
+
+    @property
+    def departure_date(self) -> np.ndarray:
+        return self.departure_dates[self.departure_date_codes]
+
+    def take(self, indices: np.ndarray) -> "TransactionColumns":
+        # Row subset by slice, index array or boolean mask, sharing the interned dates
+        return TransactionColumns(
+            quantity=self.quantity[indices],
+            departure_date_codes=self.departure_date_codes[indices],
+            departure_dates=self.departure_dates,
+            transaction_ids=self.transaction_ids[indices],
+            unit_cost=self.unit_cost[indices],
+            unit_price=self.unit_price[indices],
+        )
+
+    def select_dates(
+        self,
+        after: str | None = None,
+        from_date: str | None = None,
+        to_date: str | None = None,
+    ) -> "TransactionColumns":
+        # Rows departing strictly after `after` and within [from_date, to_date]; the
+        # comparisons run once per distinct date rather than once per row
+        keep = np.ones(len(self.departure_dates), dtype=bool)
+        dates = self.departure_dates.astype(str)
+        if after is not None:
+            keep &= dates > after
+        if from_date is not None:
+            keep &= dates >= from_date
+        if to_date is not None:
+            keep &= dates <= to_date
+        return self.take(keep[self.departure_date_codes])
+
+    def first_departure_date(self) -> str | None:
+        if not len(self):
+            return None
+        return self.departure_dates[self.departure_date_codes.min()]
+
+    def last_departure_date(self) -> str | None:
+        # Interned dates are sorted, so the highest code in use is the latest date
+        if not len(self):
+            return None
+        return self.departure_dates[self.departure_date_codes.max()]
+
+    def to_rows(self) -> list[dict]:
+        # Same keys, order and null handling as Transaction.model_dump()
+        return [
+            {
+                "quantity": quantity,
+                "departureDate": departure_date,
+                "transactionId": transaction_id,
+                "unitCost": unit_cost,
+                "unitPrice": unit_price,
+            }
+            for quantity, departure_date, transaction_id, unit_cost, unit_price in zip(
+                self.quantity.tolist(),
+                self.departure_date.tolist(),
+                self.transaction_ids.tolist(),
+                _nullable_list(self.unit_cost),
+                _nullable_list(self.unit_price),
+            )
+        ]
+
+    def to_json_rows(self) -> list[bytes]:
+        # Each row as Transaction serialises it, including its float formatting, which
+        # content hashes depend on. Values are formatted a column at a time rather than
+        # through a dict per row, and each distinct date only once.
+        dates = np.array(dump_json_strings(self.departure_dates.tolist()), dtype=object)
+        return [
+            _TRANSACTION_JSON % row
+            for row in zip(
+                dump_json_numbers(self.quantity),
+                dates[self.departure_date_codes].tolist(),
+                dump_json_strings(self.transaction_ids.tolist()),
+                dump_json_numbers(self.unit_cost),
+                dump_json_numbers(self.unit_price),
+            )
+        ]
+
+    def to_transactions(self) -> list[dm.Transaction]:
+        # The columns are already validated, so skip per-row pydantic validation
+        return [dm.Transaction.model_construct(**row) for row in self.to_rows()]
+
+
+class ColumnarDataset:
+    def __init__(self, datasetId: str, transactions: TransactionColumns):
+        self.datasetId = datasetId
+        self.transactions = transactions
+
+    @classmethod
+    def from_dataset(cls, dataset: dm.Dataset) -> "ColumnarDataset":
+        return cls(
+            datasetId=dataset.datasetId,
+            transactions=TransactionColumns.from_transactions(dataset.transactions),
+        )
+
+    def to_dataset(self) -> dm.Dataset:
+        return dm.Dataset.model_construct(
+            datasetId=self.datasetId, transactions=self.transactions.to_transactions()
+        )
+
+    def to_json_bytes(self) -> bytes:
+        # Serialises to the same bytes as dump_model(self.to_dataset())
+        return datasets_to_json(
+            [self.datasetId], self.transactions, [len(self.transactions)]
+        )[0]
+
+
+def datasets_to_json(
+    dataset_ids: Sequence[str],
+    transactions: TransactionColumns,
+    nbr_transactions: Sequence[int],
+) -> list[bytes]:
+    # The JSON of consecutive datasets whose transactions are held in one set of
+    # columns, nbr_transactions[i] rows of them for dataset_ids[i], so a whole chunk of
+    # datasets is formatted at once
+    rows = transactions.to_json_rows()
+    bodies, end = [], 0
+    for dataset_id, count in zip(
+        dump_json_strings(list(dataset_ids)), nbr_transactions
+    ):
+        start, end = end, end + count
+        bodies.append(
+            b'{"datasetId":"%s","transactions":[%s]}'
+            % (dataset_id, b",".join(rows[start:end]))
+        )
+    return bodies
+
+
+### HELPERS ############################################################################
+def float_column(name: str, values, nbr_rows: int, nullable: bool) -> np.ndarray:
+    if values is None:
+        if not nullable:
+            raise ValueError(f"Column {name} is required")
+        return np.full(nbr_rows, np.nan)
+    if nullable and not isinstance(values, np.ndarray):
+        values = [np.nan if value is None else value for value in values]
+    try:
+        column = np.asarray(values, dtype=np.float64).reshape(-1)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Column {name} must contain only numbers: {e}") from e
+    if len(column) != nbr_rows:
+        raise ValueError(f"Column {name} has {len(column)} rows, expected {nbr_rows}")
+    invalid = np.isinf(column) if nullable else ~np.isfinite(column)
+    if invalid.any():
+        row = int(np.argmax(invalid))
+        raise ValueError(f"Column {name} has invalid value {column[row]} at row {row}")
+    return column
+
+
+def str_column(name: str, values, nbr_rows: int) -> np.ndarray:
+    column = np.asarray(values, dtype=object).reshape(-1)
+    if len(column) != nbr_rows:
+        raise ValueError(f"Column {name} has {len(column)} rows, expected {nbr_rows}")
+    if isinstance(values, np.ndarray) and values.dtype.kind == "U":
+        return column
+    invalid = np.fromiter(
+        (not isinstance(value, str) for value in column), dtype=bool, count=nbr_rows
+    )
+    if invalid.any():
+        row = int(np.argmax(invalid))
+        raise ValueError(
+            f"Column {name} has non-string value {column[row]!r} at row {row}"
+        )
+    return column
+
+
+def _nullable_list(column: np.ndarray) -> list[float | None]:
+    values = column.tolist()
+    if not np.isnan(column).any():
+        return values
+    return [None if value != value else value for value in values]
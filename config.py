@@ -0,0 +1,56 @@
+import os
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+# Environment variables
+VISMA_CONNECT_CLIENT_ID = os.getenv("VISMA_CONNECT_CLIENT_ID")
+VISMA_CONNECT_CLIENT_SECRET = os.getenv("VISMA_CONNECT_CLIENT_SECRET")
+VISMA_CONNECT_GRANT_TYPE = os.getenv("VISMA_CONNECT_GRANT_TYPE")
+VISMA_CONNECT_SCOPE = os.getenv("VISMA_CONNECT_SCOPE")
+VISMA_CONNECT_URL = os.getenv("VISMA_CONNECT_URL")
+IO_BASE_URL = os.getenv("IO_BASE_URL")
+TENANT_ID = os.getenv("TENANT_ID")
+
+# Constants
+MAX_RETRIES = 5
+SLEEP_DURATION_SHORT = 3
+SLEEP_DURATION_LONG = 6
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+UPLOAD_SPOOL_MAX_SIZE = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE", 16 * 1024 * 1024))
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", 50 * 1024 * 1024))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", 4))
+UPLOAD_MANIFEST_PATH = os.getenv("UPLOAD_MANIFEST_PATH") or None  # Skips unchanged data
+UPLOAD_MANIFEST_MAX_ENTRIES = int(os.getenv("UPLOAD_MANIFEST_MAX_ENTRIES", 100_000))
+UPLOAD_MANIFEST_MAX_AGE = float(os.getenv("UPLOAD_MANIFEST_MAX_AGE", 0)) or None
+WATERMARKS_PATH = os.getenv("WATERMARKS_PATH") or None  # For incremental uploads
+JOB_JOURNAL_PATH = os.getenv("JOB_JOURNAL_PATH") or None  # Lets flows resume
+JOB_JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOB_JOURNAL_FSYNC_INTERVAL", 1))
+RESULTS_CACHE_MAX_BYTES = int(os.getenv("RESULTS_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+RESULTS_CACHE_PATH = os.getenv("RESULTS_CACHE_PATH") or None  # Survives restarts
+REQUEST_COMPRESSION = os.getenv("REQUEST_COMPRESSION") or None  # "gzip" or "deflate"
+POLL_INITIAL_DELAY = float(os.getenv("POLL_INITIAL_DELAY", 1))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", 1.5))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", 30))
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0.2))
+POLL_DEADLINE = float(os.getenv("POLL_DEADLINE", 0)) or None
+STATUS_MAX_CONCURRENT_REQUESTS = int(os.getenv("STATUS_MAX_CONCURRENT_REQUESTS", 20))
+STATUS_REQUESTS_PER_SECOND = float(os.getenv("STATUS_REQUESTS_PER_SECOND", 20))
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", 60))
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH") or None  # Shared between processes
+DELETE_MAX_CONCURRENCY = int(os.getenv("DELETE_MAX_CONCURRENCY", 16))
+DELETE_REQUESTS_PER_SECOND = float(os.getenv("DELETE_REQUESTS_PER_SECOND", 20))
+TENANT_REQUESTS_PER_SECOND = float(os.getenv("TENANT_REQUESTS_PER_SECOND", 0)) or None
+TENANT_REQUESTS_BURST = int(os.getenv("TENANT_REQUESTS_BURST", 10))
+ORCHESTRATOR_MAX_WORKERS = int(os.getenv("ORCHESTRATOR_MAX_WORKERS", 32))
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", 1000))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 1))
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0.1))
+COALESCE_MAX_BATCH_SIZE = int(os.getenv("COALESCE_MAX_BATCH_SIZE", 1000))
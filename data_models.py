@@ -1,6 +1,9 @@
-from typing import List, Optional
+from typing import TYPE_CHECKING, Iterable, List, Optional
 from pydantic import BaseModel
 
+if TYPE_CHECKING:
+    from columnar import ColumnarDataset
+
 
 ### EXCEPTION ##########################################################################
 class OutdatedAccessTokenException(Exception):
@@ -9,6 +12,19 @@ class OutdatedAccessTokenException(Exception):
         self.response = response
 
 
+class BatchUploadFailedException(Exception):
+    def __init__(self, message, uploaded_dataset_ids, failed_dataset_ids):
+        super().__init__(message)
+        self.uploaded_dataset_ids = uploaded_dataset_ids
+        self.failed_dataset_ids = failed_dataset_ids
+
+
+class DatasetFailedException(Exception):
+    def __init__(self, message, dataset_id):
+        super().__init__(message)
+        self.dataset_id = dataset_id
+
+
 ### UPLOAD DATA ########################################################################
 class Transaction(BaseModel):
     quantity: float
@@ -22,10 +38,28 @@ class Dataset(BaseModel):
     datasetId: str
     transactions: List[Transaction]
 
+    @classmethod
+    def from_columnar(cls, dataset: "ColumnarDataset") -> "Dataset":
+        return dataset.to_dataset()
+
+    def to_columnar(self) -> "ColumnarDataset":
+        from columnar import ColumnarDataset
+
+        return ColumnarDataset.from_dataset(self)
+
 
 class UploadDataPayload(BaseModel):
     datasets: List[Dataset]
 
+    @classmethod
+    def from_columnar(cls, datasets: List["ColumnarDataset"]) -> "UploadDataPayload":
+        return cls.model_construct(
+            datasets=[dataset.to_dataset() for dataset in datasets]
+        )
+
+    def to_columnar(self) -> List["ColumnarDataset"]:
+        return [dataset.to_columnar() for dataset in self.datasets]
+
 
 class PresignedUrlResponseSuccess(BaseModel):
     url: str
@@ -113,12 +147,15 @@ class HistoricalDataObject(BaseModel):
     quantity: float
 
 
-class ResultsObject(BaseModel):
+class ResultsSummaryObject(BaseModel):
     datasetId: str
     supplierId: str
     safetyStockSuggestion: Suggestion
     reorderPointSuggestion: Suggestion
     replenishmentSuggestion: Suggestion
+
+
+class ResultsObject(ResultsSummaryObject):
     forecast: List[ForecastObject]
     historicalData: List[HistoricalDataObject]
 
@@ -163,6 +200,44 @@ class DeleteDataResponseSuccess(BaseModel):
     message: str
 
 
+class DeleteDataRequest(BaseModel):
+    datasetId: str
+    fromDate: Optional[str] = ""
+    toDate: Optional[str] = ""
+
+    @classmethod
+    def from_ids(
+        cls, requests: Iterable["str | DeleteDataRequest"]
+    ) -> List["DeleteDataRequest"]:
+        # Plain dataset ids delete the dataset's whole date range
+        return [
+            cls(datasetId=request) if isinstance(request, str) else request
+            for request in requests
+        ]
+
+
+class DeleteDataResult(BaseModel):
+    datasetId: str
+    fromDate: Optional[str] = ""
+    toDate: Optional[str] = ""
+    deleted: bool = False
+    attempts: int = 0
+    message: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkDeleteReport(BaseModel):
+    results: List[DeleteDataResult]
+
+    @property
+    def deleted(self) -> List[str]:
+        return [result.datasetId for result in self.results if result.deleted]
+
+    @property
+    def failed(self) -> List[DeleteDataResult]:
+        return [result for result in self.results if not result.deleted]
+
+
 ### STATUS #############################################################################
 class DatasetStatus(BaseModel):
     datasetId: str
@@ -1,9 +1,15 @@
 import random
+import re
 from datetime import datetime
 import json
+from typing import Iterator
 from dateutil.relativedelta import relativedelta
 
 import data_models as dm
+from columnar import ColumnarDataset, TransactionColumns
+
+_DATASETS_ARRAY_START = re.compile(r'"datasets"\s*:\s*\[')
+_SEPARATOR = re.compile(r"[\s,]*")
 
 
 def generate_upload_data_payload(nbr_datasets: int = 1) -> dm.UploadDataPayload:
@@ -37,33 +43,74 @@ def generate_upload_data_payload(nbr_datasets: int = 1) -> dm.UploadDataPayload:
 
 def load_data_from_json(file_path) -> dm.UploadDataPayload:
     print("Loading data from JSON file...")
-    datasets = []
+    return dm.UploadDataPayload(datasets=list(iter_datasets_from_json(file_path)))
 
-    with open(file_path, "r") as file:
-        json_data = json.load(file)
-        dataset_data = json_data["datasets"]  # Extract the datasets array
-
-        for data in dataset_data:
-            dataset_id = data["datasetId"]
-            transactions_data = data["transactions"]
-            transactions = []
-
-            for txn_data in transactions_data:
-                txn = dm.Transaction(
-                    quantity=txn_data["quantity"],
-                    departureDate=txn_data["departureDate"],
-                    transactionId=txn_data["transactionId"],
-                    unitCost=txn_data["unitCost"] if "unitCost" in txn_data else 0.0,
-                    unitPrice=(
-                        txn_data["unitPrice"] if "unitPrice" in txn_data else 0.0
-                    ),
-                )
-                transactions.append(txn)
 
-            dataset = dm.Dataset(datasetId=dataset_id, transactions=transactions)
-            datasets.append(dataset)
+def iter_datasets_from_json(
+    file_path, chunk_size: int = 1 << 20
+) -> Iterator[dm.Dataset]:
+    for data in _iter_json_datasets(file_path, chunk_size):
+        yield _dataset_from_json(data)
 
-    return dm.UploadDataPayload(datasets=datasets)
+
+def iter_columnar_datasets_from_json(
+    file_path, chunk_size: int = 1 << 20
+) -> Iterator[ColumnarDataset]:
+    # Like iter_datasets_from_json, but validates each dataset column by column
+    for data in _iter_json_datasets(file_path, chunk_size):
+        yield ColumnarDataset(
+            datasetId=data["datasetId"],
+            transactions=TransactionColumns.from_rows(data["transactions"]),
+        )
+
+
+def _iter_json_datasets(file_path, chunk_size: int) -> Iterator[dict]:
+    # Decode one element of the datasets array at a time, so only the dataset being
+    # parsed (and the chunk after it) is held in memory instead of the whole file
+    decoder = json.JSONDecoder()
+
+    with open(file_path, "r") as file:
+        buffer = file.read(chunk_size)
+        while (match := _DATASETS_ARRAY_START.search(buffer)) is None:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"No datasets array found in {file_path}")
+            buffer += chunk
+        pos = match.end()
+
+        while True:
+            pos = _SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                data, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is cut off; grow the read geometrically to stay linear
+                chunk = file.read(max(chunk_size, len(buffer) - pos))
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield data
+
+
+def _dataset_from_json(data: dict) -> dm.Dataset:
+    dataset_id = data["datasetId"]
+    transactions_data = data["transactions"]
+    transactions = []
+
+    for txn_data in transactions_data:
+        txn = dm.Transaction(
+            quantity=txn_data["quantity"],
+            departureDate=txn_data["departureDate"],
+            transactionId=txn_data["transactionId"],
+            unitCost=txn_data["unitCost"] if "unitCost" in txn_data else 0.0,
+            unitPrice=(txn_data["unitPrice"] if "unitPrice" in txn_data else 0.0),
+        )
+        transactions.append(txn)
+
+    return dm.Dataset(datasetId=dataset_id, transactions=transactions)
 
 
 def generate_start_trainer_payload(dataset_ids) -> dm.StartTrainerPayload:
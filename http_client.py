@@ -0,0 +1,218 @@
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+import requests
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from instrumentation import Instrumentation
+from loop_local import LoopLocal
+
+
+class ConnectionStats(BaseModel):
+    host: str
+    requests: int
+    handshakes: int
+    reused: int
+
+
+def _counting_pool_class(pool_class: type[HTTPConnectionPool]):
+    # urllib3 silently reconnects a dropped connection object, so count real connects
+    class CountingConnectionPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.num_handshakes = 0
+            pool = self
+
+            class CountingConnection(self.ConnectionCls):
+                def connect(self):
+                    pool.num_handshakes += 1
+                    super().connect()
+
+            self.ConnectionCls = CountingConnection
+
+    return CountingConnectionPool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool),
+            "https": _counting_pool_class(HTTPSConnectionPool),
+        }
+
+
+class HttpClient:
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        timeout: float | tuple[float, float] = (5.0, 60.0),
+        keep_alive: bool = True,
+    ):
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        # One adapter for both schemes so every host gets a pool of reusable connections
+        self.adapter = CountingHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def connection_stats(self) -> list[ConnectionStats]:
+        # Every request that did not need a new handshake reused a kept-alive connection
+        pools = self.adapter.poolmanager.pools
+        stats = []
+        for key in pools.keys():
+            pool = pools[key]
+            stats.append(
+                ConnectionStats(
+                    host=f"{pool.scheme}://{pool.host}:{pool.port}",
+                    requests=pool.num_requests,
+                    handshakes=pool.num_handshakes,
+                    reused=max(pool.num_requests - pool.num_handshakes, 0),
+                )
+            )
+        return stats
+
+    def print_connection_stats(self):
+        _print_connection_stats(self.connection_stats())
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHttpClient:
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: tuple[float, float] = (5.0, 60.0),
+        instrumentation: Instrumentation | None = None,
+    ):
+        self.instrumentation = instrumentation
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # Requests queue on the semaphore instead of timing out waiting for the pool
+        connect_timeout, read_timeout = timeout
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=None)
+        self._semaphores = LoopLocal(lambda: asyncio.Semaphore(max_connections))
+        self._clients = LoopLocal(
+            lambda: httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        )
+        self._requests: Counter = Counter()
+        self._handshakes: Counter = Counter()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Each event loop gets its own client, since connections are bound to a loop
+        return self._clients.get()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        return self._semaphores.get()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        request = self.client.build_request(method, url, **kwargs)
+        origin = _origin(request.url)
+        request.extensions["trace"] = self._trace_for(origin)
+        instrumentation = self.instrumentation
+        if instrumentation is None or not instrumentation.enabled:
+            async with self.semaphore:
+                res = await self.client.send(request)
+            self._requests[origin] += 1
+            return res
+
+        # Timed from the moment the request waits for a connection slot
+        start = time.perf_counter()
+        try:
+            async with self.semaphore:
+                res = await self.client.send(request)
+        except Exception as e:
+            instrumentation.record_request(
+                request, None, time.perf_counter() - start, e
+            )
+            raise
+        instrumentation.record_request(request, res, time.perf_counter() - start)
+        self._requests[origin] += 1
+        return res
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+    def _trace_for(self, origin: str):
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.started":
+                self._handshakes[origin] += 1
+
+        return trace
+
+    def connection_stats(self) -> list[ConnectionStats]:
+        return [
+            ConnectionStats(
+                host=origin,
+                requests=requests,
+                handshakes=self._handshakes[origin],
+                reused=max(requests - self._handshakes[origin], 0),
+            )
+            for origin, requests in self._requests.items()
+        ]
+
+    def print_connection_stats(self):
+        _print_connection_stats(self.connection_stats())
+
+    async def close(self):
+        # Closes the running loop's client; the next request opens a new one
+        client = self._clients.pop()
+        if client is not None:
+            await client.aclose()
+
+
+def _origin(url: httpx.URL) -> str:
+    port = url.port or {"http": 80, "https": 443}.get(url.scheme)
+    return f"{url.scheme}://{url.host}:{port}"
+
+
+def _print_connection_stats(connection_stats: list[ConnectionStats]):
+    for stats in connection_stats:
+        print(
+            f"{stats.host}: {stats.requests} requests, "
+            f"{stats.handshakes} handshakes ({stats.reused} reused)"
+        )
@@ -0,0 +1,393 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from polling import PollRecord
+
+# Path segments naming the Inventory Optimization endpoints, used to label requests
+# without the dataset IDs, job IDs or presigned url keys that are also in their paths
+API_ENDPOINTS = (
+    "presigned_url",
+    "start_trainer",
+    "create_prediction",
+    "results",
+    "start_inventory_classification",
+    "inventory_classification_results",
+    "data",
+    "status",
+)
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+JOB_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+### EVENTS #############################################################################
+class RequestEvent(BaseModel):
+    method: str
+    endpoint: str
+    statusCode: Optional[int] = None  # None if no response was received
+    duration: float
+    requestBytes: int
+    responseBytes: int
+    error: Optional[str] = None
+    timestamp: float  # When the request finished, in seconds since the epoch
+
+
+class RetryEvent(BaseModel):
+    endpoint: str
+    attempt: int  # The attempt that failed, starting at 1
+    reason: str
+    timestamp: float
+
+
+class TokenRefreshEvent(BaseModel):
+    duration: float
+    error: Optional[str] = None
+    timestamp: float
+
+
+class PollEvent(BaseModel):
+    jobId: str
+    jobType: str
+    statusCode: int
+    timestamp: float
+
+
+class JobEvent(BaseModel):
+    jobId: str
+    jobType: str
+    status: Optional[str] = None
+    polls: int
+    waited: float
+    duration: float
+    timestamp: float
+
+
+class InstrumentationHook:
+    # Override the events you need; hooks may be called from any thread
+    def on_request(self, event: RequestEvent):
+        pass
+
+    def on_retry(self, event: RetryEvent):
+        pass
+
+    def on_token_refresh(self, event: TokenRefreshEvent):
+        pass
+
+    def on_poll(self, event: PollEvent):
+        pass
+
+    def on_job(self, event: JobEvent):
+        pass
+
+
+### INSTRUMENTATION ####################################################################
+class Instrumentation:
+    # Fans events out to the registered hooks. Without hooks every record_* call returns
+    # straight away and requests aren't even timed, so it costs next to nothing.
+    def __init__(self, hooks: list[InstrumentationHook] | None = None):
+        self.hooks: list[InstrumentationHook] = list(hooks or [])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    def add_hook(self, hook: InstrumentationHook) -> InstrumentationHook:
+        self.hooks = [*self.hooks, hook]  # Copied, so emitting never sees a half update
+        return hook
+
+    def remove_hook(self, hook: InstrumentationHook):
+        self.hooks = [h for h in self.hooks if h is not hook]
+
+    def record_request(
+        self,
+        request: httpx.Request,
+        response: httpx.Response | None,
+        duration: float,
+        error: BaseException | None = None,
+    ):
+        if not self.hooks:
+            return
+        event = RequestEvent(
+            method=request.method,
+            endpoint=endpoint_name(request),
+            statusCode=None if response is None else response.status_code,
+            duration=duration,
+            requestBytes=int(request.headers.get("Content-Length", 0)),
+            responseBytes=0 if response is None else len(response.content),
+            error=None if error is None else type(error).__name__,
+            timestamp=time.time(),
+        )
+        self._emit("on_request", event)
+
+    def record_retry(self, endpoint: str, attempt: int, reason: str):
+        if not self.hooks:
+            return
+        event = RetryEvent(
+            endpoint=endpoint, attempt=attempt, reason=reason, timestamp=time.time()
+        )
+        self._emit("on_retry", event)
+
+    def record_token_refresh(self, duration: float, error: BaseException | None = None):
+        if not self.hooks:
+            return
+        event = TokenRefreshEvent(
+            duration=duration,
+            error=None if error is None else type(error).__name__,
+            timestamp=time.time(),
+        )
+        self._emit("on_token_refresh", event)
+
+    def record_poll(self, record: PollRecord, status_code: int):
+        if not self.hooks:
+            return
+        event = PollEvent(
+            jobId=record.jobId,
+            jobType=record.jobType,
+            statusCode=status_code,
+            timestamp=time.time(),
+        )
+        self._emit("on_poll", event)
+
+    def record_job(self, record: PollRecord, duration: float):
+        # Called once per watched job, whether it completed, failed or timed out
+        if not self.hooks:
+            return
+        event = JobEvent(
+            jobId=record.jobId,
+            jobType=record.jobType,
+            status=record.status,
+            polls=record.polls,
+            waited=record.waited,
+            duration=duration,
+            timestamp=time.time(),
+        )
+        self._emit("on_job", event)
+
+    def _emit(self, method: str, event: BaseModel):
+        # A failing hook must never break the request it is observing
+        for hook in self.hooks:
+            try:
+                getattr(hook, method)(event)
+            except Exception as e:
+                print(f"Instrumentation hook {type(hook).__name__} failed: {e}")
+
+
+def endpoint_name(request: httpx.Request) -> str:
+    for segment in request.url.path.split("/"):
+        if segment in API_ENDPOINTS:
+            return f"/{segment}"
+    # Presigned urls point at the storage service, with the object key as the path
+    return "presigned_url_upload" if request.method == "PUT" else request.url.host
+
+
+### PROMETHEUS #########################################################################
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+
+class PrometheusExporter(InstrumentationHook):
+    # Aggregates events into counters and histograms, rendered in the Prometheus text
+    # exposition format, e.g. to serve on a /metrics endpoint or write for the
+    # node_exporter textfile collector
+    def __init__(self, namespace: str = "io_client"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+        self._help: dict[str, str] = {}
+
+    def on_request(self, event: RequestEvent):
+        labels = (
+            ("endpoint", event.endpoint),
+            ("method", event.method),
+            ("status", str(event.statusCode or event.error)),
+        )
+        route = labels[:2]
+        self._inc("requests_total", labels, 1, "HTTP requests sent")
+        self._inc(
+            "request_bytes_total", route, event.requestBytes, "Request body bytes"
+        )
+        self._inc(
+            "response_bytes_total", route, event.responseBytes, "Response body bytes"
+        )
+        self._observe(
+            "request_duration_seconds",
+            route,
+            event.duration,
+            REQUEST_DURATION_BUCKETS,
+            "HTTP request latency",
+        )
+
+    def on_retry(self, event: RetryEvent):
+        labels = (("endpoint", event.endpoint), ("reason", event.reason))
+        self._inc("retries_total", labels, 1, "Requests retried")
+
+    def on_token_refresh(self, event: TokenRefreshEvent):
+        labels = (("outcome", "error" if event.error else "success"),)
+        self._inc("token_refreshes_total", labels, 1, "Access token fetches")
+        self._observe(
+            "token_refresh_duration_seconds",
+            (),
+            event.duration,
+            REQUEST_DURATION_BUCKETS,
+            "Access token fetch latency",
+        )
+
+    def on_poll(self, event: PollEvent):
+        labels = (("job_type", event.jobType), ("status", str(event.statusCode)))
+        self._inc("polls_total", labels, 1, "Job status polls")
+
+    def on_job(self, event: JobEvent):
+        labels = (("job_type", event.jobType), ("status", str(event.status)))
+        self._inc("jobs_total", labels, 1, "Jobs watched until they finished")
+        self._inc(
+            "job_poll_wait_seconds_total",
+            labels[:1],
+            event.waited,
+            "Time spent sleeping between status polls",
+        )
+        self._observe(
+            "job_duration_seconds",
+            labels,
+            event.duration,
+            JOB_DURATION_BUCKETS,
+            "Wall time from the first status poll until the job finished",
+        )
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in self._histograms.items():
+                lines += [
+                    f"# HELP {name} {self._help[name]}",
+                    f"# TYPE {name} histogram",
+                ]
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    bounds = [*map(str, histogram.buckets), "+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels((*labels, ("le", bound)))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {histogram.sum:g}"
+                    )
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _inc(self, name: str, labels: tuple, value: float, help_text: str):
+        name = f"{self.namespace}_{name}"
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+            self._help[name] = help_text
+
+    def _observe(
+        self,
+        name: str,
+        labels: tuple,
+        value: float,
+        buckets: tuple[float, ...],
+        help_text: str,
+    ):
+        name = f"{self.namespace}_{name}"
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = _Histogram(buckets)
+            series[labels].observe(value)
+            self._help[name] = help_text
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+### SPANS ##############################################################################
+class Span(BaseModel):
+    name: str
+    startTime: float  # In seconds since the epoch
+    endTime: float
+    attributes: dict[str, Any] = {}
+
+
+class SpanExporter(InstrumentationHook):
+    # Turns requests, token refreshes and jobs into spans named and attributed after the
+    # OpenTelemetry semantic conventions. The most recent max_spans are kept in memory;
+    # given an OpenTelemetry tracer, every span is also started and ended on it.
+    def __init__(self, tracer=None, max_spans: int = 10_000):
+        self.tracer = tracer
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+
+    def on_request(self, event: RequestEvent):
+        attributes = {
+            "http.request.method": event.method,
+            "http.route": event.endpoint,
+            "http.request.body.size": event.requestBytes,
+            "http.response.body.size": event.responseBytes,
+        }
+        if event.statusCode is not None:
+            attributes["http.response.status_code"] = event.statusCode
+        if event.error is not None:
+            attributes["error.type"] = event.error
+        self._export(f"{event.method} {event.endpoint}", event, attributes)
+
+    def on_token_refresh(self, event: TokenRefreshEvent):
+        attributes = {} if event.error is None else {"error.type": event.error}
+        self._export("token refresh", event, attributes)
+
+    def on_job(self, event: JobEvent):
+        attributes = {
+            "io.job.id": event.jobId,
+            "io.job.type": event.jobType,
+            "io.job.status": str(event.status),
+            "io.job.polls": event.polls,
+            "io.job.poll_wait": event.waited,
+        }
+        self._export(f"job {event.jobType}", event, attributes)
+
+    def _export(self, name: str, event: BaseModel, attributes: dict):
+        span = Span(
+            name=name,
+            startTime=event.timestamp - event.duration,
+            endTime=event.timestamp,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        if self.tracer is not None:
+            otel_span = self.tracer.start_span(
+                name, start_time=int(span.startTime * 1e9), attributes=attributes
+            )
+            otel_span.end(end_time=int(span.endTime * 1e9))
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+from atomic_file import atomic_write
+
+
+class JournalEntry(BaseModel):
+    flowId: str
+    tenantId: str
+    stage: str  # e.g. upload, train or predict
+    jobType: str
+    jobId: str
+    datasetIds: list[str] = []
+    status: str = "submitted"  # submitted, or the job's terminal status
+    error: Optional[str] = None
+    timestamp: float = 0.0  # In seconds since the epoch
+
+
+class JobJournal:
+    # An append-only JSON lines file of the jobs each flow submitted and how they ended,
+    # so a flow interrupted by a crash can re-attach to its jobs instead of redoing them.
+    # Every entry is flushed to the OS as it is written, which survives the process
+    # dying; fsyncs, which also survive the machine going down, are batched to at most
+    # one per fsync_interval seconds. Kept in memory only when path is None.
+    def __init__(self, path: Optional[str] = None, fsync_interval: float = 1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._latest: dict[tuple[str, str], JournalEntry] = {}
+        self._file = None
+        self._last_fsync = 0.0
+        self._fsync_timer: threading.Timer | None = None
+        if path is not None:
+            nbr_lines = self._load()
+            if nbr_lines > 2 * len(self._latest):
+                self.compact()
+            self._file = open(path, "ab")
+
+    def latest(self, flow_id: str, stage: str) -> JournalEntry | None:
+        return self._latest.get((flow_id, stage))
+
+    def entries(self, flow_id: str) -> list[JournalEntry]:
+        return [entry for (flow, _), entry in self._latest.items() if flow == flow_id]
+
+    def in_flight(self) -> list[JournalEntry]:
+        # Jobs that were submitted but not seen to finish, e.g. because of a crash
+        return [e for e in self._latest.values() if e.status == "submitted"]
+
+    def record(self, entry: JournalEntry) -> JournalEntry:
+        entry = entry.model_copy(update={"timestamp": time.time()})
+        with self._lock:
+            self._latest[(entry.flowId, entry.stage)] = entry
+            if self._file is not None:
+                self._file.write(entry.model_dump_json().encode() + b"\n")
+                self._file.flush()
+                self._schedule_fsync()
+        return entry
+
+    def sync(self):
+        with self._lock:
+            self._fsync()
+
+    def compact(self):
+        # Rewrites the file with only the latest entry of each flow stage
+        with self._lock:
+            if self.path is None:
+                return
+            lines = [entry.model_dump_json() for entry in self._latest.values()]
+            atomic_write(self.path, "".join(line + "\n" for line in lines).encode())
+            if self._file is not None:
+                self._file.close()
+                self._file = open(self.path, "ab")
+
+    def close(self):
+        with self._lock:
+            self._fsync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self) -> int:
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        # A crash mid-write can leave a partial last line, which is dropped so the
+        # next entry starts on a line of its own
+        complete = data[: data.rfind(b"\n") + 1]
+        if len(complete) < len(data):
+            print(f"Dropping a partially written entry at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(len(complete))
+        lines = complete.splitlines()
+        for line_nbr, line in enumerate(lines, 1):
+            try:
+                entry = JournalEntry.model_validate_json(line)
+            except ValidationError as e:
+                # Like the watermarks, silently losing jobs would redo finished work
+                raise ValueError(
+                    f"Unreadable entry on line {line_nbr} of {self.path}: {e}"
+                ) from e
+            self._latest[(entry.flowId, entry.stage)] = entry
+        return len(lines)
+
+    def _schedule_fsync(self):
+        # Called with the lock held. Entries written within fsync_interval of the last
+        # fsync share the next one, which a timer runs if nothing else triggers it.
+        delay = self._last_fsync + self.fsync_interval - time.monotonic()
+        if delay <= 0:
+            self._fsync()
+        elif self._fsync_timer is None:
+            self._fsync_timer = threading.Timer(delay, self.sync)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+    def _fsync(self):
+        if self._fsync_timer is not None:
+            self._fsync_timer.cancel()
+            self._fsync_timer = None
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
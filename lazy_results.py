@@ -0,0 +1,120 @@
+import json
+import re
+from typing import Iterator
+
+import data_models as dm
+
+_WHITESPACE = re.compile(r"\s*")
+_COLON = re.compile(r"\s*:\s*")
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+class LazyResultsResponse:
+    # Keeps the raw /results body and validates a ResultsObject only when it is accessed,
+    # instead of validating every forecast and historical row of every dataset up front.
+    # With include_series=False, forecast and historicalData are skipped entirely and
+    # ResultsSummaryObjects are returned. Objects are validated on every access.
+    def __init__(self, content: bytes | str, include_series: bool = True):
+        self.content = content.decode() if isinstance(content, bytes) else content
+        self.include_series = include_series
+        self._message: str | None = None
+        self._spans: list[tuple[int, int]] | None = None
+        self._index: dict[str, list[int]] | None = None
+
+    @property
+    def message(self) -> str | None:
+        self._scan()
+        return self._message
+
+    @property
+    def dataset_ids(self) -> list[str]:
+        self._scan()
+        return list(self._index)
+
+    def __len__(self) -> int:
+        self._scan()
+        return len(self._spans)
+
+    def __contains__(self, dataset_id: str) -> bool:
+        self._scan()
+        return dataset_id in self._index
+
+    def __getitem__(self, index: int) -> dm.ResultsSummaryObject:
+        return self.at(index)
+
+    def __iter__(self) -> Iterator[dm.ResultsSummaryObject]:
+        for index in range(len(self)):
+            yield self.at(index)
+
+    def at(
+        self, index: int, include_series: bool | None = None
+    ) -> dm.ResultsSummaryObject:
+        self._scan()
+        start, end = self._spans[index]
+        if self.include_series if include_series is None else include_series:
+            return dm.ResultsObject.model_validate_json(self.content[start:end])
+        return dm.ResultsSummaryObject.model_validate_json(self.content[start:end])
+
+    def get(
+        self, dataset_id: str, include_series: bool | None = None
+    ) -> dm.ResultsSummaryObject | None:
+        # The first result for the dataset; see get_all for datasets with several
+        self._scan()
+        indices = self._index.get(dataset_id)
+        return None if indices is None else self.at(indices[0], include_series)
+
+    def get_all(
+        self, dataset_id: str, include_series: bool | None = None
+    ) -> list[dm.ResultsSummaryObject]:
+        self._scan()
+        return [
+            self.at(index, include_series) for index in self._index.get(dataset_id, [])
+        ]
+
+    def view(self, include_series: bool) -> "LazyResultsResponse":
+        # Shares the body and index, e.g. to change include_series of a cached response
+        self._scan()
+        view = LazyResultsResponse(self.content, include_series)
+        view._message = self._message
+        view._spans = self._spans
+        view._index = self._index
+        return view
+
+    def to_response(self) -> dm.ResultsResponseSuccess:
+        # Validates everything, exactly like parsing the response eagerly
+        return dm.ResultsResponseSuccess.model_validate_json(self.content)
+
+    def _scan(self):
+        # One pass over the body on first access records where each result starts and
+        # ends and builds the datasetId index; the decoded objects are dropped right away
+        if self._spans is not None:
+            return
+        decoder = json.JSONDecoder()
+        content = self.content
+        pos = _WHITESPACE.match(content).end()
+        if not content.startswith("{", pos):
+            raise ValueError("Results response is not a JSON object")
+        pos += 1
+        message, spans, index = "", [], {}
+        while True:
+            pos = _SEPARATOR.match(content, pos).end()
+            if content.startswith("}", pos):
+                break
+            key, pos = decoder.raw_decode(content, pos)
+            pos = _COLON.match(content, pos).end()
+            if key != "results" or not content.startswith("[", pos):
+                value, pos = decoder.raw_decode(content, pos)
+                if key == "message":
+                    message = value
+                continue
+            pos += 1
+            while True:
+                pos = _SEPARATOR.match(content, pos).end()
+                if content.startswith("]", pos):
+                    pos += 1
+                    break
+                result, end = decoder.raw_decode(content, pos)
+                index.setdefault(result["datasetId"], []).append(len(spans))
+                spans.append((pos, end))
+                pos = end
+        self._message, self._spans, self._index = message, spans, index
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+import weakref
+from typing import Callable, Generic, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class LoopLocal(Generic[T]):
+    # One value per event loop, made by factory on first use from that loop. asyncio
+    # primitives, tasks and httpx clients are bound to the loop they were first used on,
+    # so module-level objects keep theirs here instead of breaking on the next
+    # asyncio.run. A value is dropped with its loop.
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._values: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def get(self) -> T:
+        # Must be called on the event loop
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            value = self._values.get(loop)
+            if value is None:
+                value = self._values[loop] = self.factory()
+            return value
+
+    def pop(self) -> T | None:
+        # Forgets the running loop's value and returns it, if it had one
+        with self._lock:
+            return self._values.pop(asyncio.get_running_loop(), None)
+
+    def values(self) -> Iterator[T]:
+        with self._lock:
+            return iter(list(self._values.values()))
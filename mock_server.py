@@ -0,0 +1,581 @@
+# Local stand-in for the Inventory Optimization API and the Visma Connect token
+# endpoint, for benchmarking and trying out the pipeline offline. Run it with
+# `python mock_server.py --port 8000`, or start it in-process with MockServer.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from pydantic import BaseModel, ValidationError
+
+import config
+import data_models as dm
+from serialization import decompress, dump_json
+
+
+class MockServerConfig(BaseModel):
+    latency: float = 0.0  # Seconds added to every response
+    latency_jitter: float = 0.0  # Up to this many seconds more, uniformly distributed
+    error_rate: float = 0.0  # Fraction of requests answered with error_status
+    error_status: int = 503
+    error_endpoints: Optional[list[str]] = None  # Defaults to all but "token"
+    retry_after: Optional[float] = None  # Sent with injected errors when set
+    token_lifetime: float = 3600.0  # Tokens are rejected with 403 after this long
+    job_durations: dict[str, float] = {
+        "upload": 1.0,
+        "trainer": 2.0,
+        "prediction": 2.0,
+        "inventory_classification": 1.0,
+    }
+    not_found_duration: float = 0.0  # /status answers 404 this long after job start
+    dataset_failure_rate: float = 0.0  # Fraction of uploaded datasets reported failed
+    history_length: int = 24  # Most recent transactions returned as historicalData
+    seed: Optional[int] = None
+
+
+class _Job(BaseModel):
+    kind: str
+    tenantId: str
+    started: Optional[float] = None  # Upload jobs start when the data is PUT
+    duration: float
+    datasetIds: list[str] = []
+    failedDatasetIds: list[str] = []
+    suppliers: dict[str, str] = {}
+
+
+class MockServer:
+    # Keeps uploaded data, trained parameters and jobs in memory. Jobs are inProgress
+    # for their configured duration, and results are generated from the uploaded data
+    # so their size scales like the real API's.
+    def __init__(
+        self,
+        mock_config: MockServerConfig | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.config = mock_config or MockServerConfig()
+        self.requests: Counter[str] = Counter()
+        self.injected_errors: Counter[str] = Counter()
+        self.rejected_tokens = 0
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._tokens: dict[str, float] = {}  # Token to expiry time
+        self._jobs: dict[str, _Job] = {}
+        # tenant_id -> dataset_id -> transactionId (or date) -> (departureDate, quantity)
+        self._data: dict[str, dict[str, dict[str, tuple[str, float]]]] = {}
+        # tenant_id -> dataset_id -> (frequency, horizon) from /start_trainer
+        self._trained: dict[str, dict[str, tuple[str, int]]] = {}
+        self._results: dict[str, bytes] = {}
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_url(self) -> str:
+        return f"{self.url}/token"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        # Blocks until interrupted, for running the server in its own process
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def configure(self):
+        # Points api and async_api at this server; they read config on every request
+        config.IO_BASE_URL = self.url
+        config.VISMA_CONNECT_URL = self.token_url
+
+    def expire_tokens(self):
+        # Every token issued so far is rejected from now on, as if it had expired
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "injected_errors": dict(self.injected_errors),
+                "rejected_tokens": self.rejected_tokens,
+                "tokens_issued": self.requests["token"],
+                "jobs": len(self._jobs),
+                "datasets": sum(len(data) for data in self._data.values()),
+            }
+
+    ### REQUEST HANDLING ###############################################################
+    def handle(
+        self, method: str, path: str, headers, body: bytes
+    ) -> tuple[int, dict | bytes, dict]:
+        url = urlsplit(path)
+        segments = [unquote(segment) for segment in url.path.strip("/").split("/")]
+        endpoint = segments[0]
+        with self._lock:
+            self.requests[endpoint] += 1
+        self._sleep()
+
+        if (method, endpoint) == ("POST", "token"):
+            return self._issue_token()
+        if self._inject_error(endpoint):
+            extra_headers = {}
+            if self.config.retry_after is not None:
+                extra_headers["Retry-After"] = str(self.config.retry_after)
+            return _failure(
+                self.config.error_status, "InjectedError", endpoint, extra_headers
+            )
+        # The presigned url carries its own credentials, like the real one
+        if (method, endpoint) == ("PUT", "upload") and len(segments) == 2:
+            return self._upload(segments[1], body, headers.get("Content-Encoding"))
+        if not self._is_authorized(headers.get("Authorization", "")):
+            return _failure(403, "Forbidden", "Access token is invalid or expired")
+
+        tenant_id = headers.get("tenantId", "")
+        job_id = headers.get("jobId", "")
+        if method in ("POST", "PUT"):
+            try:
+                body = json.loads(decompress(body, headers.get("Content-Encoding")))
+            except (ValueError, zlib.error) as e:
+                return _failure(400, "BadRequest", f"Invalid JSON body: {e}")
+        try:
+            if (method, endpoint) == ("GET", "presigned_url"):
+                return self._presigned_url(tenant_id)
+            if (method, endpoint) == ("POST", "start_trainer"):
+                return self._start_trainer(tenant_id, dm.StartTrainerPayload(**body))
+            if (method, endpoint) == ("POST", "create_prediction"):
+                payload = dm.CreatePredictionPayload(**body)
+                return self._create_prediction(tenant_id, payload)
+            if (method, endpoint) == ("POST", "start_inventory_classification"):
+                payload = dm.StartInventoryClassificationPayload(**body)
+                return self._start_inventory_classification(tenant_id, payload)
+            if (method, endpoint) == ("GET", "status"):
+                return self._status(tenant_id, job_id)
+            if (method, endpoint) == ("GET", "results"):
+                return self._job_results(tenant_id, job_id, "prediction")
+            if (method, endpoint) == ("GET", "inventory_classification_results"):
+                return self._job_results(tenant_id, job_id, "inventory_classification")
+            if (method, endpoint) == ("DELETE", "data") and len(segments) == 2:
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                return self._delete_data(tenant_id, segments[1], query)
+        except ValidationError as e:
+            return _failure(400, "BadRequest", str(e))
+        return _failure(404, "NotFound", f"No route for {method} {url.path}")
+
+    def _sleep(self):
+        delay = self.config.latency
+        if self.config.latency_jitter:
+            with self._lock:
+                delay += self._random.uniform(0.0, self.config.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _inject_error(self, endpoint: str) -> bool:
+        endpoints = self.config.error_endpoints
+        if not self.config.error_rate or endpoint == "token" and endpoints is None:
+            return False
+        if endpoints is not None and endpoint not in endpoints:
+            return False
+        with self._lock:
+            if self._random.random() >= self.config.error_rate:
+                return False
+            self.injected_errors[endpoint] += 1
+        return True
+
+    def _issue_token(self) -> tuple[int, dict, dict]:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens[token] = time.monotonic() + self.config.token_lifetime
+        return (
+            200,
+            {"access_token": token, "expires_in": self.config.token_lifetime},
+            {},
+        )
+
+    def _is_authorized(self, authorization: str) -> bool:
+        token = authorization.removeprefix("Bearer ")
+        with self._lock:
+            expires_at = self._tokens.get(token)
+            if expires_at is not None and expires_at > time.monotonic():
+                return True
+            self.rejected_tokens += 1
+            return False
+
+    def _start_job(
+        self, kind: str, tenant_id: str, started: float | None, **fields
+    ) -> str:
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = _Job(
+                kind=kind,
+                tenantId=tenant_id,
+                started=started,
+                duration=self.config.job_durations.get(kind, 0.0),
+                **fields,
+            )
+        return job_id
+
+    ### ENDPOINTS ######################################################################
+    def _presigned_url(self, tenant_id: str) -> tuple[int, dict, dict]:
+        job_id = self._start_job("upload", tenant_id, None)
+        response = {
+            "url": f"{self.url}/upload/{job_id}",
+            "jobId": job_id,
+            "message": "OK",
+        }
+        return 200, response, {}
+
+    def _upload(
+        self, job_id: str, body: bytes, content_encoding: str | None
+    ) -> tuple[int, dict, dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.kind != "upload" or job.started is not None:
+            return _failure(403, "Forbidden", "Presigned url is invalid or used")
+        try:
+            datasets = json.loads(decompress(body, content_encoding))["datasets"]
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            return _failure(400, "BadRequest", f"Invalid upload payload: {e}")
+
+        with self._lock:
+            data = self._data.setdefault(job.tenantId, {})
+            for dataset in datasets:
+                dataset_id = dataset["datasetId"]
+                if self._random.random() < self.config.dataset_failure_rate:
+                    job.failedDatasetIds.append(dataset_id)
+                    continue
+                # Uploads add to the history, replacing transactions sent before
+                transactions = data.setdefault(dataset_id, {})
+                for transaction in dataset["transactions"]:
+                    key = (
+                        transaction.get("transactionId") or transaction["departureDate"]
+                    )
+                    transactions[key] = (
+                        transaction["departureDate"],
+                        transaction["quantity"],
+                    )
+                job.datasetIds.append(dataset_id)
+            job.started = time.monotonic()
+        return 200, {}, {}
+
+    def _start_trainer(
+        self, tenant_id: str, payload: dm.StartTrainerPayload
+    ) -> tuple[int, dict, dict]:
+        with self._lock:
+            trained = self._trained.setdefault(tenant_id, {})
+            for parameters in payload.parametersArray:
+                trained[parameters.datasetId] = (
+                    parameters.frequency,
+                    parameters.horizon,
+                )
+        dataset_ids = [parameters.datasetId for parameters in payload.parametersArray]
+        job_id = self._start_job(
+            "trainer", tenant_id, time.monotonic(), datasetIds=dataset_ids
+        )
+        return 202, {"jobId": job_id, "message": "Trainer started"}, {}
+
+    def _create_prediction(
+        self, tenant_id: str, payload: dm.CreatePredictionPayload
+    ) -> tuple[int, dict, dict]:
+        suppliers = {
+            parameters.datasetId: parameters.supplier.supplierId
+            for parameters in payload.parametersArray
+        }
+        job_id = self._start_job(
+            "prediction",
+            tenant_id,
+            time.monotonic(),
+            datasetIds=list(suppliers),
+            suppliers=suppliers,
+        )
+        return 202, {"jobId": job_id, "message": "Prediction created"}, {}
+
+    def _start_inventory_classification(
+        self, tenant_id: str, payload: dm.StartInventoryClassificationPayload
+    ) -> tuple[int, dict, dict]:
+        job_id = self._start_job(
+            "inventory_classification",
+            tenant_id,
+            time.monotonic(),
+            datasetIds=payload.datasetIds,
+        )
+        return 202, {"jobId": job_id, "message": "Inventory classification started"}, {}
+
+    def _status(self, tenant_id: str, job_id: str) -> tuple[int, dict, dict]:
+        job = self._get_job(tenant_id, job_id)
+        if job is None:
+            return _failure(404, "NotFound", f"Job {job_id} not found")
+        now = time.monotonic()
+        if (
+            job.started is not None
+            and now - job.started < self.config.not_found_duration
+        ):
+            return _failure(404, "NotFound", f"Job {job_id} not found")
+        if not self._is_complete(job, now):
+            return (
+                200,
+                {"status": "inProgress", "message": "", "datasetsStatus": []},
+                {},
+            )
+
+        datasets_status = [
+            {"datasetId": dataset_id, "status": "completed", "message": ""}
+            for dataset_id in job.datasetIds
+        ] + [
+            {"datasetId": dataset_id, "status": "failed", "message": "Injected failure"}
+            for dataset_id in job.failedDatasetIds
+        ]
+        status = (
+            "failed" if job.failedDatasetIds and not job.datasetIds else "completed"
+        )
+        message = f"{job.kind} job {status}"
+        return (
+            200,
+            {"status": status, "message": message, "datasetsStatus": datasets_status},
+            {},
+        )
+
+    def _job_results(
+        self, tenant_id: str, job_id: str, kind: str
+    ) -> tuple[int, bytes | dict, dict]:
+        job = self._get_job(tenant_id, job_id)
+        if job is None or job.kind != kind:
+            return _failure(404, "NotFound", f"Job {job_id} not found")
+        if not self._is_complete(job, time.monotonic()):
+            return _failure(404, "NotFound", f"Job {job_id} is still in progress")
+        # Results are generated once per job, so repeated fetches return the same body
+        with self._lock:
+            body = self._results.get(job_id)
+            if body is None:
+                if kind == "prediction":
+                    body = self._prediction_results(job)
+                else:
+                    body = self._classification_results(job)
+                self._results[job_id] = body
+        return 200, body, {}
+
+    def _delete_data(
+        self, tenant_id: str, dataset_id: str, query: dict
+    ) -> tuple[int, dict, dict]:
+        from_date, to_date = query.get("fromDate"), query.get("toDate")
+        with self._lock:
+            data = self._data.get(tenant_id, {})
+            transactions = data.get(dataset_id, {})
+            if from_date is None and to_date is None:
+                kept = {}
+            else:
+                kept = {
+                    key: (departure_date, quantity)
+                    for key, (departure_date, quantity) in transactions.items()
+                    if from_date is not None
+                    and departure_date < from_date
+                    or to_date is not None
+                    and departure_date > to_date
+                }
+            if kept:
+                data[dataset_id] = kept
+            else:
+                data.pop(dataset_id, None)
+        nbr_deleted = len(transactions) - len(kept)
+        return 200, {"message": f"Deleted {nbr_deleted} transactions"}, {}
+
+    ### HELPERS ########################################################################
+    def _get_job(self, tenant_id: str, job_id: str) -> _Job | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.tenantId == tenant_id else None
+
+    def _is_complete(self, job: _Job, now: float) -> bool:
+        return job.started is not None and now - job.started >= job.duration
+
+    def _prediction_results(self, job: _Job) -> bytes:
+        data = self._data.get(job.tenantId, {})
+        trained = self._trained.get(job.tenantId, {})
+        results = []
+        for dataset_id in job.datasetIds:
+            history = sorted(data.get(dataset_id, {}).values())[
+                -self.config.history_length :
+            ]
+            frequency, horizon = trained.get(dataset_id, ("M", 4))
+            mean = sum(q for _, q in history) / len(history) if history else 0.0
+            last = date.fromisoformat(history[-1][0]) if history else date.today()
+            forecast = []
+            for period in range(1, horizon + 1):
+                season = mean * 0.1 * self._random.uniform(-1.0, 1.0)
+                noise = mean * 0.05 * self._random.uniform(-1.0, 1.0)
+                predicted = max(mean + season + noise, 0.0)
+                forecast.append(
+                    {
+                        "date": _add_periods(last, frequency, period).isoformat(),
+                        "predictedQuantity": predicted,
+                        "predictedSeason": season,
+                        "predictedTrend": mean,
+                        "predictedNoise": noise,
+                        "lowerQuantity": predicted * 0.8,
+                        "upperQuantity": predicted * 1.2,
+                    }
+                )
+            valid_dates = {
+                "startDate": _add_periods(last, frequency, 1).isoformat(),
+                "endDate": _add_periods(last, frequency, horizon).isoformat(),
+            }
+            results.append(
+                {
+                    "datasetId": dataset_id,
+                    "supplierId": job.suppliers.get(dataset_id, ""),
+                    "safetyStockSuggestion": {
+                        "quantity": mean * 0.5,
+                        "validDateInterval": valid_dates,
+                    },
+                    "reorderPointSuggestion": {
+                        "quantity": mean * 1.5,
+                        "validDateInterval": valid_dates,
+                    },
+                    "replenishmentSuggestion": {
+                        "quantity": mean,
+                        "validDateInterval": valid_dates,
+                    },
+                    "forecast": forecast,
+                    "historicalData": [
+                        {"date": departure_date, "quantity": quantity}
+                        for departure_date, quantity in history
+                    ],
+                }
+            )
+        return dump_json({"message": "", "results": results})
+
+    def _classification_results(self, job: _Job) -> bytes:
+        results = [
+            {
+                "datasetId": dataset_id,
+                "abcCategory": self._random.choice("ABC"),
+                "isSeasonal": (is_seasonal := self._random.random() < 0.5),
+                "seasonalities": ["yearly"] if is_seasonal else [],
+                "demandType": self._random.choice(
+                    ["smooth", "erratic", "intermittent", "lumpy"]
+                ),
+                "trend": self._random.choice(["increasing", "decreasing", "none"]),
+            }
+            for dataset_id in job.datasetIds
+        ]
+        return dump_json({"message": "", "results": results})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+    disable_nagle_algorithm = True  # Headers and body are written separately
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._respond("GET")
+
+    def do_POST(self):
+        self._respond("POST")
+
+    def do_PUT(self):
+        self._respond("PUT")
+
+    def do_DELETE(self):
+        self._respond("DELETE")
+
+    def _respond(self, method: str):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status_code, response, headers = self.server.mock.handle(
+            method, self.path, self.headers, body
+        )
+        content = response if isinstance(response, bytes) else dump_json(response)
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _failure(
+    status_code: int, error: str, message: str, headers: dict | None = None
+) -> tuple[int, dict, dict]:
+    return (
+        status_code,
+        dm.FailureResponse(error=error, message=message).model_dump(),
+        headers or {},
+    )
+
+
+def _add_periods(start: date, frequency: str, nbr_periods: int) -> date:
+    if frequency == "D":
+        return start + timedelta(days=nbr_periods)
+    if frequency == "W":
+        return start + timedelta(weeks=nbr_periods)
+    month = start.month - 1 + nbr_periods
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+
+### MAIN ###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Inventory Optimization API"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--token-lifetime", type=float, default=3600.0)
+    parser.add_argument("--job-duration", type=float, default=None)
+    parser.add_argument("--not-found-duration", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mock_config = MockServerConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        token_lifetime=args.token_lifetime,
+        not_found_duration=args.not_found_duration,
+        seed=args.seed,
+    )
+    if args.job_duration is not None:
+        mock_config.job_durations = dict.fromkeys(
+            mock_config.job_durations, args.job_duration
+        )
+    server = MockServer(mock_config, args.host, args.port)
+    print(f"Serving on {server.url}. Point the client at it with:")
+    print(f"\tIO_BASE_URL={server.url}")
+    print(f"\tVISMA_CONNECT_URL={server.token_url}")
+    server.serve_forever()
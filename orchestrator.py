@@ -0,0 +1,341 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+import async_api
+import config
+import data_models as dm
+from async_api import UploadSource
+from rate_limit import TenantRateLimiter
+
+
+### FLOWS ##############################################################################
+class FlowContext:
+    # Shared by the stages of one tenant's flow; each stage's return value is kept in
+    # outputs under the stage name
+    def __init__(self, flow: "TenantFlow"):
+        self.flow = flow
+        self.tenant_id = flow.tenant_id
+        self.dataset_ids: list[str] = []
+        self.outputs: dict[str, Any] = {}
+
+
+class Stage:
+    # One step of a flow, run once all of depends_on have finished. Stages that clean up
+    # after a flow set run_on_failure to run even if a dependency failed or was skipped.
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[FlowContext], Awaitable[Any]],
+        depends_on: tuple[str, ...] = (),
+        run_on_failure: bool = False,
+    ):
+        self.name = name
+        self.run = run
+        self.depends_on = depends_on
+        self.run_on_failure = run_on_failure
+
+
+async def _upload(context: FlowContext) -> list[str]:
+    flow = context.flow
+    context.dataset_ids = await async_api.upload_data(
+        context.tenant_id, flow.payload_function, flow.arg
+    )
+    return context.dataset_ids
+
+
+async def _watch(
+    context: FlowContext, job_id: str, job_type: str
+) -> dm.StatusResponseSuccess:
+    # Jobs of every tenant are polled through the one multiplexed status scheduler
+    status_response = await async_api.STATUS_SCHEDULER.watch(
+        context.tenant_id, job_id, job_type
+    )
+    if status_response.status == "failed":
+        raise Exception(f"Job {job_id} ({job_type}) failed: {status_response.message}")
+    return status_response
+
+
+async def _train(context: FlowContext) -> dm.StatusResponseSuccess:
+    res = await async_api.start_trainer(
+        context.tenant_id, context.dataset_ids, wait=False
+    )
+    return await _watch(context, res.jobId, "trainer")
+
+
+async def _predict(context: FlowContext) -> dm.CreatePredictionResponseSuccess:
+    res = await async_api.create_prediction(
+        context.tenant_id, context.dataset_ids, wait=False
+    )
+    await _watch(context, res.jobId, "prediction")
+    return res
+
+
+async def _results(context: FlowContext) -> dm.ResultsResponseSuccess:
+    job_id = context.outputs["predict"].jobId
+    return await async_api.get_results(context.tenant_id, job_id)
+
+
+async def _classify(
+    context: FlowContext,
+) -> dm.StartInventoryClassificationResponseSuccess:
+    res = await async_api.start_inventory_classification(
+        context.tenant_id, context.dataset_ids, wait=False
+    )
+    await _watch(context, res.jobId, "inventory_classification")
+    return res
+
+
+async def _classification_results(
+    context: FlowContext,
+) -> dm.InventoryClassificationResultsResponse:
+    job_id = context.outputs["classify"].jobId
+    return await async_api.get_inventory_classification_results(
+        context.tenant_id, job_id
+    )
+
+
+async def _delete(context: FlowContext) -> dm.BulkDeleteReport | None:
+    # Deletes whatever was uploaded, even if a later stage failed
+    if not context.dataset_ids:
+        return None
+    report = await async_api.delete_data_bulk(context.tenant_id, context.dataset_ids)
+    if report.failed:
+        raise Exception(f"{len(report.failed)} datasets could not be deleted")
+    return report
+
+
+PREDICTION_FLOW = (
+    Stage("upload", _upload),
+    Stage("train", _train, ("upload",)),
+    Stage("predict", _predict, ("train",)),
+    Stage("results", _results, ("predict",)),
+    Stage("delete", _delete, ("results",), run_on_failure=True),
+)
+INVENTORY_CLASSIFICATION_FLOW = (
+    Stage("upload", _upload),
+    Stage("classify", _classify, ("upload",)),
+    Stage("results", _classification_results, ("classify",)),
+    Stage("delete", _delete, ("results",), run_on_failure=True),
+)
+
+
+class TenantFlow:
+    # A tenant, the data to upload for it and the stages to run
+    def __init__(
+        self,
+        tenant_id: str,
+        payload_function: Callable[[Any], UploadSource],
+        arg,
+        stages: tuple[Stage, ...] = PREDICTION_FLOW,
+    ):
+        self.tenant_id = tenant_id
+        self.payload_function = payload_function
+        self.arg = arg
+        self.stages = stages
+
+
+### SUMMARY ############################################################################
+class StageResult(BaseModel):
+    tenantId: str
+    stage: str
+    status: str = "pending"  # pending, completed, failed or skipped
+    queued: float = 0.0  # Seconds between becoming ready and starting
+    duration: float = 0.0
+    error: Optional[str] = None
+
+
+class StageSummary(BaseModel):
+    stage: str
+    completed: int
+    failed: int
+    skipped: int
+    meanQueued: float
+    meanDuration: float
+    p50Duration: float
+    p95Duration: float
+    maxDuration: float
+
+
+class FlowRunSummary(BaseModel):
+    duration: float
+    results: list[StageResult]
+
+    @property
+    def failed_tenants(self) -> list[str]:
+        return sorted(
+            {result.tenantId for result in self.results if result.status == "failed"}
+        )
+
+    def stages(self) -> list[StageSummary]:
+        by_stage: dict[str, list[StageResult]] = {}
+        for result in self.results:
+            by_stage.setdefault(result.stage, []).append(result)
+        summaries = []
+        for stage, results in by_stage.items():
+            ran = [r for r in results if r.status in ("completed", "failed")]
+            durations = np.array([r.duration for r in ran] or [0.0])
+            summaries.append(
+                StageSummary(
+                    stage=stage,
+                    completed=sum(r.status == "completed" for r in results),
+                    failed=sum(r.status == "failed" for r in results),
+                    skipped=sum(r.status == "skipped" for r in results),
+                    meanQueued=float(np.mean([r.queued for r in ran] or [0.0])),
+                    meanDuration=float(durations.mean()),
+                    p50Duration=float(np.percentile(durations, 50)),
+                    p95Duration=float(np.percentile(durations, 95)),
+                    maxDuration=float(durations.max()),
+                )
+            )
+        return summaries
+
+    def print_summary(self):
+        nbr_tenants = len({result.tenantId for result in self.results})
+        print(f"Ran flows for {nbr_tenants} tenants in {self.duration:.1f}s")
+        for summary in self.stages():
+            print(
+                f"{summary.stage}: {summary.completed} completed, {summary.failed} "
+                f"failed, {summary.skipped} skipped, {summary.meanQueued:.1f}s queued "
+                f"and {summary.meanDuration:.1f}s running on average (p50 "
+                f"{summary.p50Duration:.1f}s, p95 {summary.p95Duration:.1f}s, max "
+                f"{summary.maxDuration:.1f}s)"
+            )
+        if self.failed_tenants:
+            print(f"Failed tenants: {', '.join(self.failed_tenants)}")
+
+
+### ORCHESTRATOR #######################################################################
+class _TenantRun:
+    def __init__(self, flow: TenantFlow):
+        self.context = FlowContext(flow)
+        self.stages = {stage.name: stage for stage in flow.stages}
+        self.results = {
+            stage.name: StageResult(tenantId=flow.tenant_id, stage=stage.name)
+            for stage in flow.stages
+        }
+        self.waiting_on = {stage.name: len(stage.depends_on) for stage in flow.stages}
+        self.dependents: dict[str, list[str]] = {name: [] for name in self.stages}
+        for stage in flow.stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.dependents:
+                    raise ValueError(
+                        f"Stage {stage.name} depends on unknown stage {dependency}"
+                    )
+                self.dependents[dependency].append(stage.name)
+        self.ready: deque[tuple[Stage, float]] = deque()
+
+
+class Orchestrator:
+    # Runs every tenant's stages as a dependency graph on a shared pool of max_workers
+    # slots. Ready stages are taken from the tenants in turn, so a tenant with many
+    # datasets can't starve the others, and stage_limits caps how many of a stage run
+    # at once across tenants (e.g. {"upload": 4}). A rate_limiter limits the requests
+    # the stages make per tenant in place of async_api.TENANT_RATE_LIMITER; status polls
+    # are made by the shared status scheduler under its own rate limit.
+    def __init__(
+        self,
+        max_workers: int = config.ORCHESTRATOR_MAX_WORKERS,
+        stage_limits: dict[str, int] | None = None,
+        rate_limiter: TenantRateLimiter | None = None,
+    ):
+        self.max_workers = max_workers
+        self.stage_limits = stage_limits or {}
+        self.rate_limiter = rate_limiter
+        self._running: dict[str, int] = {}
+        self._rotation: deque[_TenantRun] = deque()
+
+    async def run(self, flows: list[TenantFlow]) -> FlowRunSummary:
+        started = time.monotonic()
+        runs = [_TenantRun(flow) for flow in flows]
+        self._running.clear()
+        self._rotation.clear()
+        nbr_pending = sum(len(run.stages) for run in runs)
+        for run in runs:
+            for name, nbr_dependencies in run.waiting_on.items():
+                if nbr_dependencies == 0:
+                    self._make_ready(run, run.stages[name])
+
+        tasks: set[asyncio.Task] = set()
+        while nbr_pending:
+            while len(tasks) < self.max_workers:
+                next_stage = self._next_stage()
+                if next_stage is None:
+                    break
+                task = asyncio.ensure_future(self._run_stage(*next_stage))
+                tasks.add(task)
+            if not tasks:
+                raise ValueError("The flows' stages depend on each other in a cycle")
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                nbr_pending -= task.result()
+
+        return FlowRunSummary(
+            duration=time.monotonic() - started,
+            results=[result for run in runs for result in run.results.values()],
+        )
+
+    def _make_ready(self, run: _TenantRun, stage: Stage):
+        if not run.ready and run not in self._rotation:
+            self._rotation.append(run)
+        run.ready.append((stage, time.monotonic()))
+
+    def _next_stage(self) -> tuple[_TenantRun, Stage, float] | None:
+        # Round robin over tenants with ready stages, passing over stages at their limit
+        for _ in range(len(self._rotation)):
+            run = self._rotation.popleft()
+            for i, (stage, ready_at) in enumerate(run.ready):
+                if self._running.get(stage.name, 0) < self.stage_limits.get(
+                    stage.name, self.max_workers
+                ):
+                    del run.ready[i]
+                    if run.ready:
+                        self._rotation.append(run)
+                    self._running[stage.name] = self._running.get(stage.name, 0) + 1
+                    return run, stage, ready_at
+            self._rotation.append(run)
+        return None
+
+    async def _run_stage(self, run: _TenantRun, stage: Stage, ready_at: float) -> int:
+        # Returns how many stages were settled: this one and any skipped because of it
+        result = run.results[stage.name]
+        if self.rate_limiter is not None:
+            # Each stage runs in a task of its own, so this only applies to its requests
+            async_api.REQUEST_RATE_LIMITER.set(self.rate_limiter)
+        started = time.monotonic()
+        result.queued = started - ready_at
+        try:
+            run.context.outputs[stage.name] = await stage.run(run.context)
+            result.status = "completed"
+        except Exception as e:
+            result.status = "failed"
+            result.error = f"{type(e).__name__}: {e}"
+            print(f"Stage {stage.name} failed for tenant {run.context.tenant_id}: {e}")
+        finally:
+            result.duration = time.monotonic() - started
+            self._running[stage.name] -= 1
+        return 1 + self._settle(run, stage.name)
+
+    def _settle(self, run: _TenantRun, finished: str) -> int:
+        # Readies the dependents whose dependencies have all finished, and skips those
+        # that can't run because one of them didn't complete
+        nbr_skipped = 0
+        for name in run.dependents[finished]:
+            run.waiting_on[name] -= 1
+            if run.waiting_on[name]:
+                continue
+            stage = run.stages[name]
+            dependencies_completed = all(
+                run.results[dependency].status == "completed"
+                for dependency in stage.depends_on
+            )
+            if dependencies_completed or stage.run_on_failure:
+                self._make_ready(run, stage)
+            else:
+                run.results[name].status = "skipped"
+                nbr_skipped += 1 + self._settle(run, name)
+        return nbr_skipped
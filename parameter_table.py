@@ -0,0 +1,244 @@
+import csv
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+
+from columnar import float_column, str_column
+from serialization import dump_json_numbers, dump_json_strings
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Table columns as named in CSV and Parquet files, and the from_arrays argument each
+# one is passed as
+COLUMNS = {
+    "datasetId": "dataset_id",
+    "frequency": "frequency",
+    "horizon": "horizon",
+    "currentInventoryLevel": "current_inventory_level",
+    "wantedServiceLevel": "wanted_service_level",
+    "replenishmentIntervalValue": "replenishment_interval",
+    "replenishmentIntervalGranularity": "replenishment_granularity",
+    "supplierId": "supplier_id",
+    "leadTimeValue": "lead_time",
+    "leadTimeGranularity": "lead_time_granularity",
+}
+
+# One element of parametersArray, filled in a column at a time rather than from a dict
+# per dataset
+_TRAINER_PARAMETERS_JSON = b'{"datasetId":"%s","frequency":"%s","horizon":%s}'
+_PREDICTION_PARAMETERS_JSON = (
+    b'{"datasetId":"%s","currentInventoryLevel":%s,"wantedServiceLevel":%s,'
+    b'"replenishmentInterval":{"value":%s,"granularity":"%s"},'
+    b'"supplier":{"supplierId":"%s","leadTime":{"value":%s,"granularity":"%s"}}}'
+)
+
+
+class ParameterTable:
+    # Per-dataset training and prediction parameters held as one array per column, so
+    # payloads for any number of datasets are validated once per column and serialised
+    # without building a pydantic object per dataset
+    def __init__(
+        self,
+        dataset_ids: np.ndarray,
+        frequency: np.ndarray,
+        horizon: np.ndarray,
+        current_inventory_level: np.ndarray,
+        wanted_service_level: np.ndarray,
+        replenishment_interval: np.ndarray,
+        replenishment_granularity: np.ndarray,
+        supplier_id: np.ndarray,
+        lead_time: np.ndarray,
+        lead_time_granularity: np.ndarray,
+    ):
+        self.dataset_ids = dataset_ids
+        self.frequency = frequency
+        self.horizon = horizon
+        self.current_inventory_level = current_inventory_level
+        self.wanted_service_level = wanted_service_level
+        self.replenishment_interval = replenishment_interval
+        self.replenishment_granularity = replenishment_granularity
+        self.supplier_id = supplier_id
+        self.lead_time = lead_time
+        self.lead_time_granularity = lead_time_granularity
+        self._rows = {dataset_id: row for row, dataset_id in enumerate(dataset_ids)}
+
+    @classmethod
+    def from_arrays(
+        cls,
+        dataset_id: Sequence[str] | np.ndarray,
+        frequency: str | Sequence[str] | np.ndarray = "M",
+        horizon: int | Sequence[int] | np.ndarray = 4,
+        current_inventory_level: float | Sequence[float] | np.ndarray = 50.0,
+        wanted_service_level: float | Sequence[float] | np.ndarray = 0.95,
+        replenishment_interval: int | Sequence[int] | np.ndarray = 1,
+        replenishment_granularity: str | Sequence[str] | np.ndarray = "M",
+        supplier_id: str | Sequence[str] | np.ndarray = "supplier-1",
+        lead_time: int | Sequence[int] | np.ndarray = 2,
+        lead_time_granularity: str | Sequence[str] | np.ndarray = "W",
+    ) -> "ParameterTable":
+        # Validation runs once per column; a single value is used for every dataset, and
+        # the defaults are the parameters generate_data uses
+        dataset_ids = str_column("datasetId", dataset_id, len(dataset_id))
+        nbr_rows = len(dataset_ids)
+        unique_ids, counts = np.unique(dataset_ids.astype(str), return_counts=True)
+        if len(unique_ids) < nbr_rows:
+            raise ValueError(f"Duplicate datasetId {unique_ids[np.argmax(counts > 1)]}")
+
+        wanted_service_level = float_column(
+            "wantedServiceLevel",
+            _broadcast(wanted_service_level, nbr_rows),
+            nbr_rows,
+            nullable=False,
+        )
+        invalid = (wanted_service_level <= 0) | (wanted_service_level >= 1)
+        if invalid.any():
+            row = int(np.argmax(invalid))
+            raise ValueError(
+                f"Column wantedServiceLevel has invalid value "
+                f"{wanted_service_level[row]} at row {row}, expected between 0 and 1"
+            )
+        return cls(
+            dataset_ids=dataset_ids,
+            frequency=_str_column("frequency", frequency, nbr_rows),
+            horizon=_positive_int_column("horizon", horizon, nbr_rows),
+            current_inventory_level=float_column(
+                "currentInventoryLevel",
+                _broadcast(current_inventory_level, nbr_rows),
+                nbr_rows,
+                nullable=False,
+            ),
+            wanted_service_level=wanted_service_level,
+            replenishment_interval=_positive_int_column(
+                "replenishmentIntervalValue", replenishment_interval, nbr_rows
+            ),
+            replenishment_granularity=_str_column(
+                "replenishmentIntervalGranularity", replenishment_granularity, nbr_rows
+            ),
+            supplier_id=_str_column("supplierId", supplier_id, nbr_rows),
+            lead_time=_positive_int_column("leadTimeValue", lead_time, nbr_rows),
+            lead_time_granularity=_str_column(
+                "leadTimeGranularity", lead_time_granularity, nbr_rows
+            ),
+        )
+
+    @classmethod
+    def from_columns(cls, columns: Mapping[str, Iterable]) -> "ParameterTable":
+        # Columns named as in COLUMNS, e.g. a dict of lists or np.load of an .npz file.
+        # Missing columns take the from_arrays defaults and other columns are ignored,
+        # so ERP exports can be passed as they are.
+        if "datasetId" not in columns:
+            raise ValueError("Column datasetId is required")
+        return cls.from_arrays(
+            **{arg: columns[name] for name, arg in COLUMNS.items() if name in columns}
+        )
+
+    @classmethod
+    def from_csv(cls, path: str, delimiter: str = ",") -> "ParameterTable":
+        # Numbers are parsed as part of validating their column
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f, delimiter=delimiter)
+            rows = list(reader)
+            columns = {
+                name: [row[name] for row in rows] for name in reader.fieldnames or []
+            }
+        print(f"Loaded parameters for {len(rows)} datasets from {path}")
+        return cls.from_columns(columns)
+
+    @classmethod
+    def from_parquet(cls, path: str) -> "ParameterTable":
+        if pyarrow is None:
+            raise ImportError("Reading parquet files requires pyarrow")
+        names = pyarrow.parquet.read_schema(path).names
+        table = pyarrow.parquet.read_table(
+            path, columns=[name for name in COLUMNS if name in names]
+        )
+        print(f"Loaded parameters for {table.num_rows} datasets from {path}")
+        return cls.from_columns(
+            {
+                name: table.column(name).to_numpy(zero_copy_only=False)
+                for name in table.column_names
+            }
+        )
+
+    def __len__(self) -> int:
+        return len(self.dataset_ids)
+
+    def select(self, dataset_ids: Iterable[str]) -> "ParameterTable":
+        # The rows of these datasets, in this order
+        try:
+            rows = np.fromiter(
+                (self._rows[dataset_id] for dataset_id in dataset_ids), dtype=np.int64
+            )
+        except KeyError as e:
+            raise ValueError(f"No parameters for dataset {e.args[0]}") from None
+        return ParameterTable(
+            dataset_ids=self.dataset_ids[rows],
+            frequency=self.frequency[rows],
+            horizon=self.horizon[rows],
+            current_inventory_level=self.current_inventory_level[rows],
+            wanted_service_level=self.wanted_service_level[rows],
+            replenishment_interval=self.replenishment_interval[rows],
+            replenishment_granularity=self.replenishment_granularity[rows],
+            supplier_id=self.supplier_id[rows],
+            lead_time=self.lead_time[rows],
+            lead_time_granularity=self.lead_time_granularity[rows],
+        )
+
+    def start_trainer_body(self) -> bytes:
+        # Serialises to the same bytes as dump_model(StartTrainerPayload(...))
+        rows = [
+            _TRAINER_PARAMETERS_JSON % row
+            for row in zip(
+                dump_json_strings(self.dataset_ids.tolist()),
+                dump_json_strings(self.frequency.tolist()),
+                dump_json_numbers(self.horizon),
+            )
+        ]
+        return b'{"parametersArray":[%s]}' % b",".join(rows)
+
+    def create_prediction_body(self) -> bytes:
+        # Serialises to the same bytes as dump_model(CreatePredictionPayload(...))
+        rows = [
+            _PREDICTION_PARAMETERS_JSON % row
+            for row in zip(
+                dump_json_strings(self.dataset_ids.tolist()),
+                dump_json_numbers(self.current_inventory_level),
+                dump_json_numbers(self.wanted_service_level),
+                dump_json_numbers(self.replenishment_interval),
+                dump_json_strings(self.replenishment_granularity.tolist()),
+                dump_json_strings(self.supplier_id.tolist()),
+                dump_json_numbers(self.lead_time),
+                dump_json_strings(self.lead_time_granularity.tolist()),
+            )
+        ]
+        return b'{"parametersArray":[%s]}' % b",".join(rows)
+
+
+### HELPERS ############################################################################
+def _broadcast(values, nbr_rows: int):
+    if isinstance(values, str) or np.ndim(values) == 0:
+        return np.full(nbr_rows, values)
+    return values
+
+
+def _str_column(name: str, values, nbr_rows: int) -> np.ndarray:
+    column = str_column(name, _broadcast(values, nbr_rows), nbr_rows)
+    empty = column == ""
+    if empty.any():
+        raise ValueError(f"Column {name} is empty at row {int(np.argmax(empty))}")
+    return column
+
+
+def _positive_int_column(name: str, values, nbr_rows: int) -> np.ndarray:
+    column = float_column(name, _broadcast(values, nbr_rows), nbr_rows, nullable=False)
+    invalid = (column != np.round(column)) | (column < 1)
+    if invalid.any():
+        row = int(np.argmax(invalid))
+        raise ValueError(
+            f"Column {name} has invalid value {column[row]} at row {row}, expected a "
+            "positive whole number"
+        )
+    return column.astype(np.int64)
@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from pydantic import BaseModel
+
+import async_api
+import config
+import data_models as dm
+from async_api import UploadSource
+
+
+class PipelineBatch(BaseModel):
+    batchNbr: int
+    datasetIds: list[str] = []
+    stage: str = "upload"  # The stage the batch is in, or reached before failing
+    status: str = "pending"  # pending, completed or failed
+    error: Optional[str] = None
+    predictionJobId: Optional[str] = None
+    durations: dict[str, float] = {}  # Seconds spent in each stage
+    waited: dict[str, float] = {}  # Seconds queued in front of each stage
+
+
+class PipelineSummary(BaseModel):
+    duration: float
+    batches: list[PipelineBatch]
+
+    @property
+    def failed(self) -> list[PipelineBatch]:
+        return [batch for batch in self.batches if batch.status == "failed"]
+
+    def stage_durations(self) -> dict[str, float]:
+        # Total time each stage spent on batches; with full overlap the wall time
+        # approaches the largest of these rather than their sum
+        totals = {}
+        for batch in self.batches:
+            for stage, duration in batch.durations.items():
+                totals[stage] = totals.get(stage, 0.0) + duration
+        return totals
+
+    def print_summary(self):
+        totals = self.stage_durations()
+        print(
+            f"Ran {len(self.batches)} batches in {self.duration:.1f}s, "
+            f"{sum(totals.values()):.1f}s of stage time overlapped"
+        )
+        for stage, total in totals.items():
+            print(f"{stage}: {total:.1f}s")
+        for batch in self.failed:
+            print(f"Batch {batch.batchNbr} failed in {batch.stage}: {batch.error}")
+
+
+async def run_pipeline(
+    tenant_id: str,
+    payload_function: Callable[[Any], UploadSource],
+    arg,
+    batch_size: int = config.PIPELINE_BATCH_SIZE,
+    queue_size: int = config.PIPELINE_QUEUE_SIZE,
+    on_results: Callable[[PipelineBatch, dm.ResultsResponseSuccess], Any] | None = None,
+) -> PipelineSummary:
+    # Splits the datasets into batches of batch_size and runs upload, train, predict and
+    # (when on_results is given) results as concurrent stages, so batch N+1 uploads
+    # while batch N trains and batch N-1 predicts. At most queue_size batches wait in
+    # front of each stage; a full queue holds back the stage before it, down to reading
+    # the datasets. A failed batch is dropped from the pipeline without stopping others.
+    stages: list[tuple[str, Callable[[PipelineBatch], Awaitable]]] = [
+        ("train", lambda batch: _train(tenant_id, batch)),
+        ("predict", lambda batch: _predict(tenant_id, batch)),
+    ]
+    if on_results is not None:
+        stages.append(("results", lambda batch: _results(tenant_id, batch, on_results)))
+
+    started = time.monotonic()
+    batches: list[PipelineBatch] = []
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    async def produce():
+        # Reading and batching the datasets may block, so it happens off the loop
+        datasets = await asyncio.to_thread(_iter_datasets, payload_function, arg)
+        for batch_nbr in itertools.count():
+            chunk = await asyncio.to_thread(_take, datasets, batch_size)
+            if not chunk:
+                break
+            batch = PipelineBatch(
+                batchNbr=batch_nbr, datasetIds=[d.datasetId for d in chunk]
+            )
+            batches.append(batch)
+            await queues[0].put((batch, chunk, time.monotonic()))
+        await queues[0].put(None)
+
+    async def upload():
+        while (item := await queues[0].get()) is not None:
+            batch, chunk, queued_at = item
+            if await _run_stage(
+                batch, "upload", queued_at, _upload(tenant_id, batch, chunk)
+            ):
+                await queues[1].put((batch, time.monotonic()))
+        await queues[1].put(None)
+
+    async def stage_worker(index: int, name: str, run: Callable):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        while (item := await inbox.get()) is not None:
+            batch, queued_at = item
+            if await _run_stage(batch, name, queued_at, run(batch)) and outbox:
+                await outbox.put((batch, time.monotonic()))
+        if outbox is not None:
+            await outbox.put(None)
+
+    print(f"Running the pipeline in batches of {batch_size} datasets...")
+    consumers = [
+        asyncio.ensure_future(upload()),
+        *(
+            asyncio.ensure_future(stage_worker(index + 1, name, run))
+            for index, (name, run) in enumerate(stages)
+        ),
+    ]
+    try:
+        await produce()
+    except BaseException:
+        # Reading the datasets failed, or the pipeline was cancelled. The stages would
+        # wait forever for the end of the batches, so they are stopped instead.
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        raise
+    await asyncio.gather(*consumers)
+    for batch in batches:
+        if batch.status == "pending":
+            batch.status = "completed"
+    summary = PipelineSummary(duration=time.monotonic() - started, batches=batches)
+    print(
+        f"Pipeline complete! {len(batches) - len(summary.failed)} of {len(batches)} "
+        "batches succeeded\n"
+    )
+    return summary
+
+
+async def _run_stage(
+    batch: PipelineBatch, stage: str, queued_at: float, coroutine: Awaitable
+) -> bool:
+    batch.stage = stage
+    started = time.monotonic()
+    batch.waited[stage] = started - queued_at
+    try:
+        await coroutine
+        return True
+    except Exception as e:
+        batch.status = "failed"
+        batch.error = f"{type(e).__name__}: {e}"
+        print(f"Batch {batch.batchNbr} failed in {stage}: {e}")
+        return False
+    finally:
+        batch.durations[stage] = time.monotonic() - started
+
+
+async def _upload(tenant_id: str, batch: PipelineBatch, chunk: list):
+    # A failed upload job raises; datasets that failed on their own leave the batch
+    batch.datasetIds = await async_api.upload_data(tenant_id, list, chunk)
+    if not batch.datasetIds:
+        raise Exception("None of the batch's datasets were uploaded")
+
+
+async def _train(tenant_id: str, batch: PipelineBatch):
+    res = await async_api.start_trainer(tenant_id, batch.datasetIds, wait=False)
+    await _watch(tenant_id, res.jobId, "trainer")
+
+
+async def _predict(tenant_id: str, batch: PipelineBatch):
+    res = await async_api.create_prediction(tenant_id, batch.datasetIds, wait=False)
+    batch.predictionJobId = res.jobId
+    await _watch(tenant_id, res.jobId, "prediction")
+
+
+async def _watch(tenant_id: str, job_id: str, job_type: str):
+    status_response = await async_api.STATUS_SCHEDULER.watch(
+        tenant_id, job_id, job_type
+    )
+    if status_response.status == "failed":
+        raise Exception(f"Job {job_id} ({job_type}) failed: {status_response.message}")
+
+
+async def _results(
+    tenant_id: str,
+    batch: PipelineBatch,
+    on_results: Callable[[PipelineBatch, dm.ResultsResponseSuccess], Any],
+):
+    results_response = await async_api.get_results(
+        tenant_id, batch.predictionJobId, use_cache=False
+    )
+    if asyncio.iscoroutine(outcome := on_results(batch, results_response)):
+        await outcome
+
+
+def _iter_datasets(payload_function: Callable[[Any], UploadSource], arg) -> Iterator:
+    payload = payload_function(arg)
+    if isinstance(payload, dm.UploadDataPayload):
+        payload = payload.datasets
+    return iter(payload)
+
+
+def _take(datasets: Iterator, nbr_datasets: int) -> list:
+    return list(itertools.islice(datasets, nbr_datasets))
@@ -0,0 +1,169 @@
+import abc
+import random
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+### STRATEGIES #########################################################################
+class PollingStrategy(abc.ABC):
+    def __init__(self, deadline: float | None = None):
+        # Seconds after which polling a single job gives up
+        self.deadline = deadline
+
+    @abc.abstractmethod
+    def next_delay(self, job_type: str, attempt: int, elapsed: float) -> float:
+        pass
+
+    def record_completion(self, job_type: str, duration: float):
+        pass
+
+
+class FixedIntervalPolling(PollingStrategy):
+    def __init__(self, interval: float, deadline: float | None = None):
+        super().__init__(deadline)
+        self.interval = interval
+
+    def next_delay(self, job_type: str, attempt: int, elapsed: float) -> float:
+        return self.interval
+
+
+class ExponentialBackoffPolling(PollingStrategy):
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        factor: float = 1.5,
+        max_delay: float = 30.0,
+        jitter: float = 0.2,
+        deadline: float | None = None,
+    ):
+        super().__init__(deadline)
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def next_delay(self, job_type: str, attempt: int, elapsed: float) -> float:
+        delay = min(self.initial_delay * self.factor**attempt, self.max_delay)
+        return self._jittered(delay)
+
+    def _jittered(self, delay: float) -> float:
+        # Spread polls of jobs started together so they don't hit /status in lockstep
+        return delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+
+class LearnedDurationPolling(ExponentialBackoffPolling):
+    # Learns how long each job type usually takes and waits until just before that
+    # before polling, then polls more and more sparsely the further the job overruns.
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        factor: float = 1.5,
+        max_delay: float = 30.0,
+        jitter: float = 0.2,
+        deadline: float | None = None,
+        smoothing: float = 0.3,
+        lead: float = 0.9,
+    ):
+        super().__init__(initial_delay, factor, max_delay, jitter, deadline)
+        self.smoothing = smoothing
+        self.lead = lead
+        self.expected_durations: dict[str, float] = {}
+
+    def next_delay(self, job_type: str, attempt: int, elapsed: float) -> float:
+        expected = self.expected_durations.get(job_type)
+        if expected is None:
+            return super().next_delay(job_type, attempt, elapsed)
+        target = expected * self.lead
+        if elapsed < target:
+            return max(target - elapsed, self.initial_delay)
+        overrun_delay = (elapsed - target) * (self.factor - 1.0)
+        return self._jittered(
+            min(max(overrun_delay, self.initial_delay), self.max_delay)
+        )
+
+    def record_completion(self, job_type: str, duration: float):
+        # Exponentially weighted moving average of completed job durations
+        expected = self.expected_durations.get(job_type)
+        self.expected_durations[job_type] = (
+            duration
+            if expected is None
+            else self.smoothing * duration + (1.0 - self.smoothing) * expected
+        )
+
+
+def retry_after(headers) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+### STATS ##############################################################################
+class PollRecord(BaseModel):
+    jobId: str
+    jobType: str
+    polls: int = 0
+    waited: float = 0.0
+    duration: Optional[float] = None
+    status: Optional[str] = None
+
+
+class PollTypeSummary(BaseModel):
+    jobType: str
+    jobs: int
+    meanPolls: float
+    meanWaited: float
+    meanDuration: float
+
+
+class PollStats:
+    def __init__(self, max_records: int = 10_000):
+        self.max_records = max_records
+        self.records: OrderedDict[str, PollRecord] = OrderedDict()
+
+    def start(self, job_id: str, job_type: str) -> PollRecord:
+        record = PollRecord(jobId=job_id, jobType=job_type)
+        self.records[job_id] = record
+        while len(self.records) > self.max_records:
+            self.records.popitem(last=False)
+        return record
+
+    def summary(self) -> list[PollTypeSummary]:
+        by_type: dict[str, list[PollRecord]] = {}
+        for record in self.records.values():
+            if record.duration is not None:
+                by_type.setdefault(record.jobType, []).append(record)
+        return [
+            PollTypeSummary(
+                jobType=job_type,
+                jobs=len(records),
+                meanPolls=sum(r.polls for r in records) / len(records),
+                meanWaited=sum(r.waited for r in records) / len(records),
+                meanDuration=sum(r.duration for r in records) / len(records),
+            )
+            for job_type, records in by_type.items()
+        ]
+
+    def print_summary(self):
+        for summary in self.summary():
+            print(
+                f"{summary.jobType}: {summary.jobs} jobs, "
+                f"{summary.meanPolls:.1f} polls and {summary.meanWaited:.1f}s waiting "
+                f"per job, {summary.meanDuration:.1f}s mean duration"
+            )
+
+    def clear(self):
+        self.records.clear()
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from loop_local import LoopLocal
+
+
+class RateLimiter:
+    # Token bucket: allows bursts of up to `burst` calls, then `rate` calls per second
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._locks = LoopLocal(asyncio.Lock)
+
+    async def acquire(self):
+        async with self._locks.get():
+            self._refill()
+            if self._tokens < 1.0:
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._tokens + (now - self._updated) * self.rate, float(self.burst)
+        )
+        self._updated = now
+
+
+class TenantRateLimiter:
+    # One token bucket per tenant, created on first use. With no rate, nothing waits.
+    def __init__(self, rate: float | None = None, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._limiters: dict[str, RateLimiter] = {}
+
+    def set_rate(self, rate: float | None, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._limiters.clear()
+
+    async def acquire(self, tenant_id: str):
+        if self.rate is None or not tenant_id:
+            return
+        limiter = self._limiters.get(tenant_id)
+        if limiter is None:
+            limiter = self._limiters[tenant_id] = RateLimiter(self.rate, self.burst)
+        await limiter.acquire()
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, TypeVar
+
+from atomic_file import atomic_write
+
+T = TypeVar("T")
+CacheKey = tuple[str, str, str]  # (kind, tenant_id, job_id)
+
+
+class ResultsCache:
+    # Results of completed jobs never change, so they are cached without expiry. The
+    # memory tier holds parsed responses, evicting the least recently used once their
+    # body sizes add up to max_bytes; cached responses are shared, so don't mutate
+    # them. The optional disk tier keeps the gzipped bodies across restarts.
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.nbr_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[CacheKey, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def load(self, key: CacheKey, parse: Callable[[bytes], T]) -> T | None:
+        # Reads the disk tier (blocking), parses the body and promotes it to memory
+        if self.path is None:
+            return None
+        try:
+            with open(self._file_path(key), "rb") as f:
+                content = gzip.decompress(f.read())
+            results = parse(content)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            print(f"Ignoring unreadable cached results {self._file_path(key)}: {e}")
+            return None
+        self._remember(key, results, len(content))
+        with self._lock:
+            self.hits += 1
+        return results
+
+    def put(self, key: CacheKey, results: Any, content: bytes):
+        # content is the raw response body the results were parsed from
+        self._remember(key, results, len(content))
+        if self.path is not None:
+            atomic_write(self._file_path(key), gzip.compress(content, compresslevel=6))
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def invalidate(self, key: CacheKey):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbr_bytes -= entry[1]
+        if self.path is not None:
+            try:
+                os.remove(self._file_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self, include_disk: bool = False):
+        with self._lock:
+            self._entries.clear()
+            self.nbr_bytes = 0
+        if include_disk and self.path is not None and os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith(".json.gz"):
+                    os.remove(os.path.join(self.path, name))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: CacheKey, results: Any, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbr_bytes -= previous[1]
+            self._entries[key] = (results, size)
+            self.nbr_bytes += size
+            while self.nbr_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbr_bytes -= evicted_size
+
+    def _file_path(self, key: CacheKey) -> str:
+        # Tenant and job IDs are hashed so they can't form arbitrary paths
+        digest = hashlib.blake2b("\0".join(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.path, f"{digest}.json.gz")
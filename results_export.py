@@ -0,0 +1,317 @@
+import json
+import os
+import struct
+from typing import IO, Iterable, Iterator
+
+import numpy as np
+
+import data_models as dm
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+FILE_FORMATS = ("numpy", "arrow", "parquet")
+ID_COLUMNS = ("datasetId", "supplierId")
+
+# Columns of each table besides datasetId and supplierId, as (name, dtype). Dates are
+# stored as datetime64[D] so they can be memory-mapped like every other column.
+TABLES = {
+    "forecast": [
+        ("date", "datetime64[D]"),
+        ("predictedQuantity", "float64"),
+        ("predictedSeason", "float64"),
+        ("predictedTrend", "float64"),
+        ("predictedNoise", "float64"),
+        ("lowerQuantity", "float64"),
+        ("upperQuantity", "float64"),
+    ],
+    "historicalData": [
+        ("date", "datetime64[D]"),
+        ("quantity", "float64"),
+    ],
+    "suggestions": [
+        (f"{suggestion}{field}", dtype)
+        for suggestion in ("safetyStock", "reorderPoint", "replenishment")
+        for field, dtype in (
+            ("Quantity", "float64"),
+            ("StartDate", "datetime64[D]"),
+            ("EndDate", "datetime64[D]"),
+        )
+    ],
+}
+
+# .npy files are written with a fixed-size header so the final shape can be filled in
+# once all rows are appended, without knowing the row count up front
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128
+
+
+### WRITE ##############################################################################
+def write_results(
+    results: Iterable[dm.ResultsObject],
+    path: str,
+    file_format: str = "parquet",
+    chunk_size: int = 10_000,
+) -> list[str]:
+    # Flattens results into the forecast, historicalData and suggestions tables, one
+    # chunk of results at a time, and returns the paths of the files written. Accepts
+    # any iterable of ResultsObjects, e.g. a LazyResultsResponse.
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unsupported file format: {file_format}")
+    if file_format != "numpy" and pa is None:
+        raise ImportError(f"Writing {file_format} files requires pyarrow")
+    os.makedirs(path, exist_ok=True)
+
+    dictionary = _Dictionary()
+    writers = {
+        table: (
+            _NumpyTableWriter(path, table)
+            if file_format == "numpy"
+            else _ArrowTableWriter(path, table, file_format, dictionary)
+        )
+        for table in TABLES
+    }
+    try:
+        for chunk in _chunked(results, chunk_size):
+            for table, columns in _flatten(chunk, dictionary).items():
+                writers[table].write(columns)
+    finally:
+        paths = [
+            file_path for writer in writers.values() for file_path in writer.close()
+        ]
+    if file_format == "numpy":
+        paths.append(dictionary.save(os.path.join(path, "dictionary.json")))
+    return paths
+
+
+def _flatten(
+    results: list[dm.ResultsObject], dictionary: "_Dictionary"
+) -> dict[str, dict[str, np.ndarray]]:
+    forecast_lengths = [len(result.forecast) for result in results]
+    historical_lengths = [len(result.historicalData) for result in results]
+    dataset_ids = dictionary.encode([result.datasetId for result in results])
+    supplier_ids = dictionary.encode([result.supplierId for result in results])
+
+    forecast = [row for result in results for row in result.forecast]
+    historical = [row for result in results for row in result.historicalData]
+    suggestions = {
+        "safetyStock": [result.safetyStockSuggestion for result in results],
+        "reorderPoint": [result.reorderPointSuggestion for result in results],
+        "replenishment": [result.replenishmentSuggestion for result in results],
+    }
+
+    tables = {
+        "forecast": {
+            "datasetId": np.repeat(dataset_ids, forecast_lengths),
+            "supplierId": np.repeat(supplier_ids, forecast_lengths),
+            **{
+                name: np.asarray([getattr(row, name) for row in forecast], dtype)
+                for name, dtype in TABLES["forecast"]
+            },
+        },
+        "historicalData": {
+            "datasetId": np.repeat(dataset_ids, historical_lengths),
+            "supplierId": np.repeat(supplier_ids, historical_lengths),
+            **{
+                name: np.asarray([getattr(row, name) for row in historical], dtype)
+                for name, dtype in TABLES["historicalData"]
+            },
+        },
+        "suggestions": {"datasetId": dataset_ids, "supplierId": supplier_ids},
+    }
+    for name, rows in suggestions.items():
+        interval = [row.validDateInterval for row in rows]
+        tables["suggestions"][f"{name}Quantity"] = np.asarray(
+            [row.quantity for row in rows], "float64"
+        )
+        tables["suggestions"][f"{name}StartDate"] = np.asarray(
+            [row.startDate for row in interval], "datetime64[D]"
+        )
+        tables["suggestions"][f"{name}EndDate"] = np.asarray(
+            [row.endDate for row in interval], "datetime64[D]"
+        )
+    return tables
+
+
+class _Dictionary:
+    # Shared codes for datasetId and supplierId, so every table stores int32 codes
+    def __init__(self):
+        self.codes: dict[str, int] = {}
+        self.values: list[str] = []
+
+    def encode(self, values: list[str]) -> np.ndarray:
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(self.values, dtype=object)[codes]
+
+    def save(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump(self.values, f)
+        return path
+
+
+class _NumpyTableWriter:
+    # One .npy file per column, appended to chunk by chunk
+    def __init__(self, directory: str, table: str):
+        self.nbr_rows = 0
+        self.files: dict[str, tuple[str, IO[bytes], np.dtype]] = {}
+        dtypes = [(name, "int32") for name in ID_COLUMNS] + TABLES[table]
+        for name, dtype in dtypes:
+            file_path = os.path.join(directory, f"{table}.{name}.npy")
+            f = open(file_path, "wb")
+            f.write(b"\0" * _NPY_HEADER_SIZE)
+            self.files[name] = (file_path, f, np.dtype(dtype))
+
+    def write(self, columns: dict[str, np.ndarray]):
+        for name, (_, f, dtype) in self.files.items():
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self.nbr_rows += len(columns["datasetId"])
+
+    def close(self) -> list[str]:
+        for _, f, dtype in self.files.values():
+            f.seek(0)
+            f.write(_npy_header(dtype, self.nbr_rows))
+            f.close()
+        return [file_path for file_path, _, _ in self.files.values()]
+
+
+class _ArrowTableWriter:
+    def __init__(
+        self, directory: str, table: str, file_format: str, dictionary: _Dictionary
+    ):
+        extension = "arrow" if file_format == "arrow" else "parquet"
+        self.path = os.path.join(directory, f"{table}.{extension}")
+        self.file_format = file_format
+        self.dictionary = dictionary
+        self.schema = pa.schema(
+            [(name, pa.string()) for name in ID_COLUMNS]
+            + [
+                (name, pa.date32() if dtype.startswith("datetime") else pa.float64())
+                for name, dtype in TABLES[table]
+            ]
+        )
+        self.writer = (
+            pa.ipc.new_file(self.path, self.schema)
+            if file_format == "arrow"
+            else pa.parquet.ParquetWriter(self.path, self.schema)
+        )
+
+    def write(self, columns: dict[str, np.ndarray]):
+        arrays = [
+            pa.array(
+                (
+                    self.dictionary.decode(columns[field.name])
+                    if field.name in ID_COLUMNS
+                    else columns[field.name]
+                ),
+                type=field.type,
+            )
+            for field in self.schema
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.file_format == "arrow":
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write_table(pa.Table.from_batches([batch]))
+
+    def close(self) -> list[str]:
+        self.writer.close()
+        return [self.path]
+
+
+### READ ###############################################################################
+class ResultsTables:
+    # Memory-mapped numpy export. Each table is a dict of column arrays; datasetId and
+    # supplierId are int32 codes into `dictionary`.
+    def __init__(self, tables: dict[str, dict[str, np.ndarray]], dictionary: list[str]):
+        self.tables = tables
+        self.dictionary = np.asarray(dictionary, dtype=object)
+        self._codes = {value: code for code, value in enumerate(dictionary)}
+
+    def __getitem__(self, table: str) -> dict[str, np.ndarray]:
+        return self.tables[table]
+
+    def code(self, value: str) -> int | None:
+        return self._codes.get(value)
+
+    def rows_for(self, table: str, dataset_id: str) -> dict[str, np.ndarray]:
+        columns = self.tables[table]
+        code = self.code(dataset_id)
+        if code is None:
+            return {name: column[:0] for name, column in columns.items()}
+        rows = np.flatnonzero(columns["datasetId"] == code)
+        return {name: column[rows] for name, column in columns.items()}
+
+
+def read_numpy_results(path: str, mmap: bool = True) -> ResultsTables:
+    with open(os.path.join(path, "dictionary.json")) as f:
+        dictionary = json.load(f)
+    mmap_mode = "r" if mmap else None
+    tables = {
+        table: {
+            name: np.load(
+                os.path.join(path, f"{table}.{name}.npy"), mmap_mode=mmap_mode
+            )
+            for name in (*ID_COLUMNS, *(name for name, _ in columns))
+        }
+        for table, columns in TABLES.items()
+    }
+    return ResultsTables(tables, dictionary)
+
+
+def read_arrow_results(path: str) -> dict[str, "pa.Table"]:
+    # Arrow files are memory-mapped, so reading them copies nothing; Parquet files are
+    # decoded, with datasetId and supplierId kept dictionary-encoded
+    if pa is None:
+        raise ImportError("Reading arrow and parquet files requires pyarrow")
+    tables = {}
+    for table in TABLES:
+        arrow_path = os.path.join(path, f"{table}.arrow")
+        if os.path.exists(arrow_path):
+            tables[table] = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+        else:
+            tables[table] = pa.parquet.read_table(
+                os.path.join(path, f"{table}.parquet"),
+                memory_map=True,
+                read_dictionary=list(ID_COLUMNS),
+            )
+    return tables
+
+
+### HELPERS ############################################################################
+def _chunked(
+    results: Iterable[dm.ResultsObject], chunk_size: int
+) -> Iterator[list[dm.ResultsObject]]:
+    chunk = []
+    for result in results:
+        chunk.append(result)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _npy_header(dtype: np.dtype, nbr_rows: int) -> bytes:
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (nbr_rows,),
+        }
+    ).encode()
+    header_length = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2
+    header = header.ljust(header_length - 1) + b"\n"
+    return _NPY_MAGIC + struct.pack("<H", header_length) + header
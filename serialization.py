@@ -0,0 +1,123 @@
+import re
+import zlib
+from typing import Any
+
+import numpy as np
+import pydantic_core
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# zlib window bits selecting the gzip and raw zlib (HTTP "deflate") containers
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Characters that JSON strings must escape, other than the NUL that separates joined
+# strings
+_NEEDS_ESCAPING = re.compile(r'[\x01-\x1f"\\]')
+
+
+def dump_model(model: BaseModel) -> bytes:
+    # Encode straight from the model in pydantic-core without building a dict tree first
+    return model.__pydantic_serializer__.to_json(model)
+
+
+def dump_dataset(dataset) -> bytes:
+    # Accepts both dm.Dataset and columnar.ColumnarDataset
+    if isinstance(dataset, BaseModel):
+        return dump_model(dataset)
+    return dataset.to_json_bytes()
+
+
+def dump_json(obj: Any) -> bytes:
+    # Plain Python data (e.g. columnar exports) goes through orjson when it is installed,
+    # else pydantic-core. Both write floats and non-ASCII text exactly like dump_model,
+    # which content hashes and byte-identical request bodies depend on.
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return pydantic_core.to_json(obj)
+
+
+def dump_json_numbers(column: np.ndarray) -> list[bytes]:
+    # The JSON literal of each number in an int or float column, formatted like
+    # dump_json in a single call for the whole column; NaN, a missing value, is written
+    # as null
+    if not len(column):
+        return []
+    if orjson is not None:
+        literals = orjson.dumps(
+            np.ascontiguousarray(column), option=orjson.OPT_SERIALIZE_NUMPY
+        )
+    else:
+        values = column.astype(object)
+        values[np.isnan(column)] = None
+        literals = pydantic_core.to_json(values.tolist())
+    # Numbers contain no commas, so the array splits into one literal per row
+    return literals[1:-1].split(b",")
+
+
+def dump_json_strings(values: list[str]) -> list[bytes]:
+    # Each string as dump_json writes it between the quotes. Ids and dates rarely need
+    # escaping, so they are checked and encoded all at once.
+    joined = "\x00".join(values)
+    if (
+        not values
+        or _NEEDS_ESCAPING.search(joined) is not None
+        or joined.count("\x00") >= len(values)
+    ):
+        return [dump_json(value)[1:-1] for value in values]
+    return joined.encode().split(b"\x00")
+
+
+def encode_body(
+    payload: BaseModel | bytes, compression: str | None = None
+) -> tuple[bytes, dict]:
+    # Payloads may also be JSON that is already serialised, e.g. by a ParameterTable
+    body = payload if isinstance(payload, bytes) else dump_model(payload)
+    body = compress(body, compression)
+    return body, content_encoding_headers(compression)
+
+
+def compressobj(compression: str | None):
+    if not compression:
+        return None
+    if compression not in _WBITS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    return zlib.compressobj(wbits=_WBITS[compression])
+
+
+def compress(body: bytes, compression: str | None = None) -> bytes:
+    compressor = compressobj(compression)
+    if compressor is None:
+        return body
+    return compressor.compress(body) + compressor.flush()
+
+
+def decompress(body: bytes, compression: str | None = None) -> bytes:
+    if not compression or compression == "identity":
+        return body
+    if compression not in _WBITS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    return zlib.decompress(body, wbits=_WBITS[compression])
+
+
+def content_encoding_headers(compression: str | None = None) -> dict:
+    return {"Content-Encoding": compression} if compression else {}
+
+
+class BodyWriter:
+    # Writes a request body to a file object, compressing on the fly if requested
+    def __init__(self, file, compression: str | None = None):
+        self.file = file
+        self.compressor = compressobj(compression)
+
+    def write(self, data: bytes):
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+
+    def finish(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
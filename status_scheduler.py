@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+import config
+import data_models as dm
+from instrumentation import Instrumentation
+from loop_local import LoopLocal
+from polling import PollingStrategy, PollRecord, PollStats, retry_after
+from rate_limit import RateLimiter
+
+
+class _WatchedJob:
+    def __init__(
+        self,
+        tenant_id: str,
+        job_id: str,
+        job_type: str,
+        future: asyncio.Future,
+        record: PollRecord,
+    ):
+        self.tenant_id = tenant_id
+        self.job_id = job_id
+        self.job_type = job_type
+        self.future = future
+        self.record = record
+        self.started = time.monotonic()
+        self.not_found = 0
+
+
+class _LoopState:
+    def __init__(self, max_concurrent_requests: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.due: list[tuple[float, int, _WatchedJob]] = []
+        self.sequence = itertools.count()
+        self.in_flight: set[asyncio.Task] = set()
+        self.wakeup = asyncio.Event()
+        self.runner: asyncio.Task | None = None
+
+
+class StatusScheduler:
+    # Drives /status polling for any number of jobs from a single task on the event
+    # loop. Every job is due at the time its polling strategy asks for, and all jobs
+    # share one rate limit and one cap on in-flight /status requests.
+    def __init__(
+        self,
+        send_status_request: Callable[[str, str], Awaitable[httpx.Response]],
+        strategy: PollingStrategy,
+        poll_stats: PollStats,
+        max_concurrent_requests: int = 20,
+        requests_per_second: float = 20.0,
+        instrumentation: Instrumentation | None = None,
+    ):
+        # Called with (tenant_id, job_id); takes care of headers and token refresh
+        self.send_status_request = send_status_request
+        self.strategy = strategy
+        self.poll_stats = poll_stats
+        self.instrumentation = instrumentation or Instrumentation()
+        self.rate_limiter = RateLimiter(requests_per_second, max_concurrent_requests)
+        # Jobs watched from different event loops are polled by a runner on each
+        self._states = LoopLocal(lambda: _LoopState(max_concurrent_requests))
+
+    def watch(
+        self,
+        tenant_id: str,
+        job_id: str,
+        job_type: str = "job",
+        callback: Callable[[dm.StatusResponseSuccess], None] | None = None,
+    ) -> asyncio.Future:
+        # Must be called on the event loop; await the returned future for the result
+        future = asyncio.get_running_loop().create_future()
+        if callback is not None:
+
+            def on_done(future: asyncio.Future):
+                if not future.cancelled() and future.exception() is None:
+                    callback(future.result())
+
+            future.add_done_callback(on_done)
+        job = _WatchedJob(
+            tenant_id=tenant_id,
+            job_id=job_id,
+            job_type=job_type,
+            future=future,
+            record=self.poll_stats.start(job_id, job_type),
+        )
+        state = self._states.get()
+        self._schedule(state, job, 0.0)
+        if state.runner is None or state.runner.done():
+            # Shared by every watcher, so it doesn't run in the context of whichever one
+            # started it
+            state.runner = asyncio.get_running_loop().create_task(
+                self._run(state), context=contextvars.Context()
+            )
+        return future
+
+    @property
+    def nbr_watched(self) -> int:
+        return sum(
+            len(state.due) + len(state.in_flight) for state in self._states.values()
+        )
+
+    def _schedule(self, state: _LoopState, job: _WatchedJob, delay: float):
+        due = time.monotonic() + delay
+        heapq.heappush(state.due, (due, next(state.sequence), job))
+        state.wakeup.set()
+
+    async def _run(self, state: _LoopState):
+        while state.due or state.in_flight:
+            if not state.due:
+                await self._wait(state, None)
+                continue
+            due, _, job = state.due[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                await self._wait(state, delay)
+                continue
+            heapq.heappop(state.due)
+            await self.rate_limiter.acquire()
+            await state.semaphore.acquire()
+            state.in_flight.add(asyncio.ensure_future(self._poll(state, job)))
+
+    async def _wait(self, state: _LoopState, timeout: float | None):
+        try:
+            await asyncio.wait_for(state.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        state.wakeup.clear()
+
+    async def _poll(self, state: _LoopState, job: _WatchedJob):
+        try:
+            delay = await self._poll_once(job)
+            if delay is not None:
+                self._schedule(state, job, delay)
+            else:
+                self.instrumentation.record_job(
+                    job.record, time.monotonic() - job.started
+                )
+        except Exception as e:
+            job.record.status = job.record.status or "failed"
+            self.instrumentation.record_job(job.record, time.monotonic() - job.started)
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            state.in_flight.discard(asyncio.current_task())
+            state.semaphore.release()
+            state.wakeup.set()
+
+    async def _poll_once(self, job: _WatchedJob) -> float | None:
+        # Returns the delay until the next poll, or None once the job has finished
+        if job.future.cancelled():
+            return None
+        res = await self.send_status_request(job.tenant_id, job.job_id)
+        job.record.polls += 1
+        self.instrumentation.record_poll(job.record, res.status_code)
+        if res.status_code == 200:
+            status_response = dm.StatusResponseSuccess(**res.json())
+            if status_response.status != "inProgress":
+                job.record.duration = time.monotonic() - job.started
+                job.record.status = status_response.status
+                self.strategy.record_completion(job.job_type, job.record.duration)
+                job.future.set_result(status_response)
+                return None
+        elif res.status_code == 404 and job.not_found < config.MAX_RETRIES:
+            job.not_found += 1
+        elif res.status_code not in (429, 503) or retry_after(res.headers) is None:
+            failure_response = dm.FailureResponse(**res.json())
+            raise Exception(
+                f"Call to status for job {job.job_id} failed."
+                f"\nError: {failure_response.error}"
+                f"\nMessage: {failure_response.message}"
+            )
+
+        elapsed = time.monotonic() - job.started
+        delay = retry_after(res.headers)
+        if delay is None:
+            delay = self.strategy.next_delay(
+                job.job_type, job.record.polls - 1, elapsed
+            )
+        if (
+            self.strategy.deadline is not None
+            and elapsed + delay > self.strategy.deadline
+        ):
+            job.record.status = "deadlineExceeded"
+            raise TimeoutError(
+                f"Job {job.job_id} did not complete within {self.strategy.deadline} "
+                "seconds"
+            )
+        job.record.waited += delay
+        return delay
@@ -0,0 +1,150 @@
+from datetime import date
+from typing import Iterator, Literal, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from columnar import ColumnarDataset, TransactionColumns, datasets_to_json
+
+# Periods per year for each frequency, used as the default season length
+_PERIODS_PER_YEAR = {"D": 365, "W": 52, "M": 12}
+
+
+class SyntheticDataConfig(BaseModel):
+    nbr_datasets: int = 1
+    nbr_periods: int = 36  # Transactions per dataset, before intermittent gaps
+    frequency: Literal["D", "W", "M"] = "M"
+    end_date: Optional[str] = None  # Defaults to today
+    min_base_quantity: float = 50.0
+    max_base_quantity: float = 300.0
+    seasonality: float = 0.3  # Amplitude relative to the base quantity
+    season_length: Optional[int] = None  # In periods, defaults to one year
+    trend: float = 0.0  # Each dataset trends by up to ± this fraction per period
+    noise: float = 0.2  # Standard deviation relative to the expected quantity
+    intermittency: float = 0.0  # Probability that a period has no transaction
+    min_unit_cost: float = 50.0
+    max_unit_cost: float = 150.0
+    min_markup: float = 1.5
+    max_markup: float = 4.0
+    cost_drift: float = 0.0  # Standard deviation of the relative change per period
+    price_drift: float = 0.0
+    seed: Optional[int] = None
+    dataset_id_prefix: str = "synthetic-dataset"
+
+
+def iter_synthetic_datasets(
+    config: SyntheticDataConfig, chunk_size: int = 1000
+) -> Iterator[ColumnarDataset]:
+    # Generates chunk_size datasets at a time as (datasets x periods) matrices, so only
+    # one chunk is in memory and no per-transaction Python objects are created. The same
+    # seed and chunk size always give the same data.
+    for dataset_ids, transactions, nbr_transactions in _iter_chunks(config, chunk_size):
+        end = 0
+        for dataset_id, count in zip(dataset_ids, nbr_transactions.tolist()):
+            start, end = end, end + count
+            yield ColumnarDataset(
+                datasetId=dataset_id, transactions=transactions.take(slice(start, end))
+            )
+
+
+def write_synthetic_data(
+    path: str, config: SyntheticDataConfig, chunk_size: int = 1000
+) -> int:
+    # Streams an upload payload to a JSON file that iter_datasets_from_json can read,
+    # serialising a chunk of datasets at a time
+    nbr_transactions = 0
+    with open(path, "wb") as f:
+        f.write(b'{"datasets":[')
+        for i, chunk in enumerate(_iter_chunks(config, chunk_size)):
+            if i:
+                f.write(b",")
+            f.write(b",".join(datasets_to_json(*chunk)))
+            nbr_transactions += len(chunk[1])
+        f.write(b"]}")
+    return nbr_transactions
+
+
+def _iter_chunks(
+    config: SyntheticDataConfig, chunk_size: int
+) -> Iterator[tuple[list[str], TransactionColumns, np.ndarray]]:
+    # Each chunk's dataset ids, their transactions one dataset after the other, and the
+    # number of transactions of each dataset
+    rng = np.random.default_rng(config.seed)
+    departure_dates = _departure_dates(config)
+    transaction_ids = np.array(
+        [f"txn{i}" for i in range(config.nbr_periods)], dtype=object
+    )
+    periods = np.arange(config.nbr_periods, dtype=np.float64)
+    season_length = config.season_length or _PERIODS_PER_YEAR[config.frequency]
+
+    for start in range(0, config.nbr_datasets, chunk_size):
+        nbr_datasets = min(chunk_size, config.nbr_datasets - start)
+        quantity, unit_cost, unit_price, present = _generate_chunk(
+            config, rng, nbr_datasets, periods, season_length
+        )
+        # Boolean masks select row by row, so each dataset's periods stay together
+        codes = np.nonzero(present)[1].astype(np.int32)
+        transactions = TransactionColumns(
+            quantity=quantity[present],
+            departure_date_codes=codes,
+            departure_dates=departure_dates,
+            transaction_ids=transaction_ids[codes],
+            unit_cost=unit_cost[present],
+            unit_price=unit_price[present],
+        )
+        dataset_ids = [
+            f"{config.dataset_id_prefix}-{start + i + 1}" for i in range(nbr_datasets)
+        ]
+        yield dataset_ids, transactions, present.sum(axis=1)
+
+
+def _generate_chunk(
+    config: SyntheticDataConfig,
+    rng: np.random.Generator,
+    nbr_datasets: int,
+    periods: np.ndarray,
+    season_length: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    shape = (nbr_datasets, len(periods))
+
+    # Demand: base level with a linear trend, a seasonal wave and multiplicative noise
+    base = rng.uniform(
+        config.min_base_quantity, config.max_base_quantity, (shape[0], 1)
+    )
+    slope = rng.uniform(-config.trend, config.trend, (shape[0], 1))
+    phase = rng.uniform(0.0, 2.0 * np.pi, (shape[0], 1))
+    season = config.seasonality * np.sin(2.0 * np.pi * periods / season_length + phase)
+    quantity = base * np.maximum(1.0 + slope * periods, 0.0) * (1.0 + season)
+    quantity *= 1.0 + config.noise * rng.standard_normal(shape)
+    np.maximum(quantity, 0.0, out=quantity)
+
+    # Cost and price follow independent geometric random walks from their start values
+    unit_cost = rng.uniform(config.min_unit_cost, config.max_unit_cost, (shape[0], 1))
+    unit_cost = unit_cost * _random_walk(rng, shape, config.cost_drift)
+    markup = rng.uniform(config.min_markup, config.max_markup, (shape[0], 1))
+    unit_price = unit_cost * markup * _random_walk(rng, shape, config.price_drift)
+
+    present = rng.random(shape) >= config.intermittency
+    return quantity, unit_cost, unit_price, present
+
+
+def _random_walk(rng: np.random.Generator, shape: tuple, drift: float) -> np.ndarray:
+    if not drift:
+        return np.ones(shape)
+    return np.exp(np.cumsum(drift * rng.standard_normal(shape), axis=1))
+
+
+def _departure_dates(config: SyntheticDataConfig) -> np.ndarray:
+    # One calendar shared by all datasets, oldest first, ending at end_date
+    end = np.datetime64(config.end_date or date.today().isoformat(), "D")
+    if config.frequency == "M":
+        # Same day of the month as end_date, or the month's last day when it is shorter
+        months = end.astype("datetime64[M]") + np.arange(1 - config.nbr_periods, 1)
+        month_starts = months.astype("datetime64[D]")
+        month_lengths = (months + 1).astype("datetime64[D]") - month_starts
+        day = end - end.astype("datetime64[M]").astype("datetime64[D]")
+        dates = month_starts + np.minimum(day, month_lengths - 1)
+    else:
+        step = 7 if config.frequency == "W" else 1
+        dates = end - step * np.arange(config.nbr_periods - 1, -1, -1)
+    return np.datetime_as_string(dates, unit="D").astype(object)
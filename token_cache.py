@@ -0,0 +1,80 @@
+import abc
+import contextlib
+import os
+import threading
+from typing import Iterator, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from atomic_file import atomic_write
+
+# Not available on Windows, where the file cache then only locks within the process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class CachedToken(BaseModel):
+    access_token: str
+    expires_at: Optional[float] = None
+
+
+class TokenCache(abc.ABC):
+    @abc.abstractmethod
+    def load(self) -> CachedToken | None:
+        pass
+
+    @abc.abstractmethod
+    def store(self, token: CachedToken):
+        pass
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        # Held while fetching a new token so only one holder of the cache fetches
+        yield
+
+
+class MemoryTokenCache(TokenCache):
+    def __init__(self):
+        self._token: CachedToken | None = None
+
+    def load(self) -> CachedToken | None:
+        return self._token
+
+    def store(self, token: CachedToken):
+        self._token = token
+
+
+class FileTokenCache(TokenCache):
+    # Shares one token between processes on the same host. Writes are atomic, so readers
+    # never see a partial token, and fetches are serialised with an exclusive lock on a
+    # sibling lock file.
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.lock_path = f"{self.path}.lock"
+        self._thread_lock = threading.Lock()
+
+    def load(self) -> CachedToken | None:
+        try:
+            with open(self.path, "rb") as f:
+                return CachedToken.model_validate_json(f.read())
+        except (FileNotFoundError, ValidationError):
+            return None
+
+    def store(self, token: CachedToken):
+        atomic_write(self.path, token.model_dump_json().encode())
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.lock_path, "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
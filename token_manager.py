@@ -1,12 +1,147 @@
+import asyncio
+import base64
+import concurrent.futures
+import json
 import os
+import threading
+import time
+from typing import Callable
+
+from token_cache import CachedToken, MemoryTokenCache, TokenCache
 
 
 class TokenManager:
-    def __init__(self):
-        self.token = os.getenv("ACCESS_TOKEN")
+    def __init__(
+        self,
+        fetch_token: Callable[[], dict] | None = None,
+        refresh_margin: float = 60.0,
+        background_refresh: bool = True,
+        cache: TokenCache | None = None,
+    ):
+        # fetch_token returns the token endpoint's response, i.e. a dict with
+        # "access_token" and optionally "expires_in"
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self.cache = cache or MemoryTokenCache()
+        self.token = None
+        self.expires_at = None
+        self.refresh_at = None
+        self._lock = threading.Lock()
+        self._refreshing: concurrent.futures.Future | None = None
+        self._timer: threading.Timer | None = None
+        cached = self.cache.load()
+        if cached is not None:
+            self._set_token(cached.access_token, cached.expires_at)
+        else:
+            self.update_token(os.getenv("ACCESS_TOKEN"))
 
-    def update_token(self, new_token: str):
+    def update_token(self, new_token: str, expires_in: float | None = None):
+        if expires_in is not None:
+            expires_at = time.time() + float(expires_in)
+        else:
+            expires_at = _jwt_expiry(new_token)
+        self._set_token(new_token, expires_at)
+
+    def _set_token(self, new_token: str, expires_at: float | None):
         self.token = new_token
+        self.expires_at = expires_at
+
+        # Refresh ahead of expiry, but never sooner than halfway through the lifetime
+        self.refresh_at = None
+        if self.expires_at is not None:
+            lifetime = self.expires_at - time.time()
+            self.refresh_at = self.expires_at - min(self.refresh_margin, lifetime / 2)
+        self._schedule_background_refresh()
+
+    def needs_refresh(self) -> bool:
+        # A token without a known expiry is trusted until a request is rejected
+        if not self.token:
+            return True
+        if self.refresh_at is None:
+            return False
+        return time.time() >= self.refresh_at
+
+    def ensure_fresh(self) -> str:
+        if self.needs_refresh():
+            return self.refresh(stale_token=self.token)
+        return self.token
+
+    async def ensure_fresh_async(self) -> str:
+        if self.needs_refresh():
+            return await self.refresh_async(stale_token=self.token)
+        return self.token
+
+    def refresh(self, stale_token: str | None = None) -> str:
+        # Single-flight: concurrent callers wait for the refresh already in progress.
+        # Passing the token a request was rejected with skips the refresh when another
+        # caller has already replaced it.
+        with self._lock:
+            if stale_token is not None and self.token != stale_token:
+                return self.token
+            future = self._refreshing
+            is_owner = future is None
+            if is_owner:
+                future = self._refreshing = concurrent.futures.Future()
+        if not is_owner:
+            return future.result()
+
+        try:
+            with self.cache.lock():
+                self._refresh_from_cache_or_fetch()
+            future.set_result(self.token)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._refreshing = None
+        return self.token
+
+    def _refresh_from_cache_or_fetch(self):
+        # Another process sharing the cache may already have fetched a new token
+        cached = self.cache.load()
+        if cached is not None and cached.access_token != self.token:
+            self._set_token(cached.access_token, cached.expires_at)
+            if not self.needs_refresh():
+                return
+        if self.fetch_token is None:
+            raise RuntimeError("TokenManager has no fetch_token to refresh with")
+        response = self.fetch_token()
+        self.update_token(response["access_token"], response.get("expires_in"))
+        self.cache.store(
+            CachedToken(access_token=self.token, expires_at=self.expires_at)
+        )
+
+    async def refresh_async(self, stale_token: str | None = None) -> str:
+        # Waiting callers await the shared future instead of each occupying a thread
+        with self._lock:
+            if stale_token is not None and self.token != stale_token:
+                return self.token
+            future = self._refreshing
+        if future is not None:
+            return await asyncio.wrap_future(future)
+        return await asyncio.to_thread(self.refresh, stale_token)
+
+    def _schedule_background_refresh(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.background_refresh or self.fetch_token is None:
+            return
+        if self.refresh_at is None:
+            return
+        delay = max(self.refresh_at - time.time(), 0.0)
+        self._timer = threading.Timer(delay, self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh(stale_token=self.token)
+        except Exception as e:
+            # The next request will retry the refresh in the foreground
+            print(f"Background token refresh failed: {e}")
 
     def generate_headers(
         self,
@@ -25,3 +160,13 @@ class TokenManager:
         if job_id:
             headers["jobId"] = job_id
         return headers
+
+
+def _jwt_expiry(token: str | None) -> float | None:
+    # Reads the exp claim without verifying the signature; None if it isn't a JWT
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
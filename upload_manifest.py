@@ -0,0 +1,156 @@
+import hashlib
+import heapq
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from atomic_file import atomic_write
+
+
+class ManifestEntry(BaseModel):
+    contentHash: str
+    uploadedAt: float
+    firstDate: Optional[str] = None  # Departure dates the uploaded content spans
+    lastDate: Optional[str] = None
+
+
+class ManifestFile(BaseModel):
+    tenants: dict[str, dict[str, ManifestEntry]] = {}
+
+
+def content_hash(serialised_dataset: bytes) -> str:
+    # Hashes the serialised dataset, which is byte-identical for Dataset and
+    # ColumnarDataset, so the hash is stable across runs, processes and representations
+    return hashlib.blake2b(serialised_dataset, digest_size=16).hexdigest()
+
+
+class UploadManifest:
+    # Remembers the content hash of every dataset last uploaded successfully per tenant,
+    # so unchanged datasets can be skipped. Saved atomically after every change; when
+    # several processes share one path, the last one to save wins.
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        max_age: Optional[float] = None,
+    ):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_age = max_age  # Seconds after which a dataset is re-uploaded anyway
+        self._lock = threading.Lock()
+        self._tenants = self._load().tenants
+
+    def is_unchanged(self, tenant_id: str, dataset_id: str, content_hash: str) -> bool:
+        entry = self._tenants.get(tenant_id, {}).get(dataset_id)
+        return (
+            entry is not None
+            and entry.contentHash == content_hash
+            and not self._is_expired(entry, time.time())
+        )
+
+    def record(
+        self,
+        tenant_id: str,
+        content_hashes: dict[str, str],
+        date_spans: dict[str, tuple[str, str]] | None = None,
+    ):
+        # Call only once the upload of these datasets has completed
+        if not content_hashes:
+            return
+        uploaded_at = time.time()
+        date_spans = date_spans or {}
+        with self._lock:
+            entries = self._tenants.setdefault(tenant_id, {})
+            for dataset_id, content_hash in content_hashes.items():
+                first_date, last_date = date_spans.get(dataset_id, (None, None))
+                entries[dataset_id] = ManifestEntry(
+                    contentHash=content_hash,
+                    uploadedAt=uploaded_at,
+                    firstDate=first_date,
+                    lastDate=last_date,
+                )
+            self._evict(uploaded_at)
+            self._save()
+
+    def invalidate(
+        self,
+        tenant_id: str,
+        dataset_ids: Iterable[str] | None = None,
+        from_date: str = "",
+        to_date: str = "",
+    ):
+        # Forces the given datasets, or all of the tenant's, to be uploaded next time.
+        # With a date range, only datasets whose uploaded content overlaps it are forced.
+        with self._lock:
+            entries = self._tenants.get(tenant_id, {})
+            if dataset_ids is None:
+                dataset_ids = list(entries)
+            for dataset_id in dataset_ids:
+                entry = entries.get(dataset_id)
+                if entry is not None and _overlaps(entry, from_date, to_date):
+                    del entries[dataset_id]
+            if not entries:
+                self._tenants.pop(tenant_id, None)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._tenants.clear()
+            self._save()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._tenants.values())
+
+    def _is_expired(self, entry: ManifestEntry, now: float) -> bool:
+        return self.max_age is not None and now - entry.uploadedAt > self.max_age
+
+    def _evict(self, now: float):
+        # Drops expired entries, then the least recently uploaded beyond max_entries
+        for entries in self._tenants.values():
+            expired = [
+                d for d, entry in entries.items() if self._is_expired(entry, now)
+            ]
+            for dataset_id in expired:
+                del entries[dataset_id]
+        nbr_excess = len(self) - self.max_entries
+        if nbr_excess > 0:
+            oldest = heapq.nsmallest(
+                nbr_excess,
+                (
+                    (entry.uploadedAt, tenant_id, dataset_id)
+                    for tenant_id, entries in self._tenants.items()
+                    for dataset_id, entry in entries.items()
+                ),
+            )
+            for _, tenant_id, dataset_id in oldest:
+                del self._tenants[tenant_id][dataset_id]
+        for tenant_id in [t for t, entries in self._tenants.items() if not entries]:
+            del self._tenants[tenant_id]
+
+    def _load(self) -> ManifestFile:
+        try:
+            with open(self.path, "rb") as f:
+                return ManifestFile.model_validate_json(f.read())
+        except FileNotFoundError:
+            return ManifestFile()
+        except ValidationError as e:
+            # A corrupt manifest only costs a full re-upload, so start afresh
+            print(f"Ignoring unreadable upload manifest {self.path}: {e}")
+            return ManifestFile()
+
+    def _save(self):
+        atomic_write(
+            self.path, ManifestFile(tenants=self._tenants).model_dump_json().encode()
+        )
+
+
+def _overlaps(entry: ManifestEntry, from_date: str, to_date: str) -> bool:
+    # Entries without a date span (e.g. from older manifests) are assumed to overlap
+    if entry.firstDate is None or entry.lastDate is None:
+        return True
+    return (not to_date or entry.firstDate <= to_date) and (
+        not from_date or entry.lastDate >= from_date
+    )
@@ -0,0 +1,63 @@
+import threading
+from typing import Iterable, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from atomic_file import atomic_write
+
+
+class WatermarkFile(BaseModel):
+    tenants: dict[str, dict[str, str]] = {}
+
+
+class WatermarkStore:
+    # The latest departureDate uploaded per dataset and tenant. Dates are ISO 8601
+    # strings, which sort chronologically. Kept in memory only when path is None.
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tenants = self._load().tenants
+
+    def get(self, tenant_id: str, dataset_id: str) -> str | None:
+        return self._tenants.get(tenant_id, {}).get(dataset_id)
+
+    def advance(self, tenant_id: str, watermarks: dict[str, str]):
+        # Watermarks only move forward, so re-uploading an older window keeps them
+        if not watermarks:
+            return
+        with self._lock:
+            entries = self._tenants.setdefault(tenant_id, {})
+            for dataset_id, watermark in watermarks.items():
+                if dataset_id not in entries or watermark > entries[dataset_id]:
+                    entries[dataset_id] = watermark
+            self._save()
+
+    def reset(self, tenant_id: str, dataset_ids: Iterable[str] | None = None):
+        # The next incremental upload then sends the full history of these datasets
+        with self._lock:
+            if dataset_ids is None:
+                self._tenants.pop(tenant_id, None)
+            else:
+                entries = self._tenants.get(tenant_id, {})
+                for dataset_id in dataset_ids:
+                    entries.pop(dataset_id, None)
+            self._save()
+
+    def _load(self) -> WatermarkFile:
+        if self.path is None:
+            return WatermarkFile()
+        try:
+            with open(self.path, "rb") as f:
+                return WatermarkFile.model_validate_json(f.read())
+        except FileNotFoundError:
+            return WatermarkFile()
+        except ValidationError as e:
+            # Unlike the upload manifest, losing watermarks would re-upload duplicates
+            raise ValueError(f"Unreadable watermark file {self.path}: {e}") from e
+
+    def _save(self):
+        if self.path is not None:
+            atomic_write(
+                self.path,
+                WatermarkFile(tenants=self._tenants).model_dump_json().encode(),
+            )